@@ -26,12 +26,16 @@ else:
     from dezero.layers import Layer
     from dezero.models import Model
     from dezero.datasets import Dataset
+    from dezero.datasets import StreamDataset
     from dezero.dataloaders import DataLoader
     from dezero.dataloaders import SeqDataLoader
 
     import dezero.datasets
     import dezero.dataloaders
     import dezero.optimizers
+    import dezero.checkpoint
+    import dezero.profiler
+    import dezero.trainers
     import dezero.functions
     import dezero.functions_conv
     import dezero.layers
@@ -0,0 +1,383 @@
+import os
+import json
+import mmap
+import time
+import zlib
+import struct
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from dezero import cuda
+
+
+# =============================================================================
+# raw weight format (.dzw)
+# =============================================================================
+# The file is the magic, the header length (uint64), a JSON header mapping
+# every key to [dtype, shape, offset], and the arrays as raw C-order bytes,
+# each starting at a multiple of _ALIGN so they can be mapped in place.
+_MAGIC = b'DZW\x01'
+_ALIGN = 64
+
+
+def _align(n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def is_raw_file(path):
+    with open(path, 'rb') as f:
+        return f.read(len(_MAGIC)) == _MAGIC
+
+
+def save_arrays(path, arrays, compress=False):
+    """Save a dict of arrays.
+
+    Paths ending in `.dzw` get the raw format read back by `load_arrays`
+    with memory mapping. Any other path is written as a `.npz` archive
+    (compressed if `compress` is True), `.npz` being appended if missing.
+    """
+    try:
+        if path.endswith('.dzw'):
+            _save_raw(path, arrays)
+        elif compress:
+            np.savez_compressed(path, **arrays)
+        else:
+            np.savez(path, **arrays)
+    except (Exception, KeyboardInterrupt) as e:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+
+
+def _save_raw(path, arrays):
+    arrays = {key: np.require(cuda.as_numpy(a), requirements='C')
+              for key, a in arrays.items()}
+
+    index, offset = {}, 0
+    for key, a in arrays.items():
+        index[key] = [a.dtype.str, list(a.shape), offset]
+        offset = _align(offset + a.nbytes)
+
+    # The data starts after the header, whose length depends on the
+    # offsets it stores: grow the start until it settles.
+    start = 0
+    while True:
+        header = json.dumps({key: [dtype, shape, offset + start]
+                             for key, (dtype, shape, offset)
+                             in index.items()}).encode()
+        new_start = _align(len(_MAGIC) + 8 + len(header))
+        if new_start == start:
+            break
+        start = new_start
+
+    with open(path, 'wb') as f:
+        f.write(_MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for key, a in arrays.items():
+            f.seek(start + index[key][2])
+            f.write(a.data if a.size else b'')
+        f.truncate(max(f.tell(), start))
+
+
+def load_arrays(path, mmap_mode=True):
+    """Load the arrays saved by `save_arrays` as a dict-like object.
+
+    Raw `.dzw` files are memory-mapped copy-on-write when `mmap_mode` is
+    True: opening costs one header read, each array pages in from disk on
+    first touch, and writes to an array stay private to the process. Any
+    other file is opened with `np.load`.
+    """
+    if not is_raw_file(path):
+        return np.load(path)
+
+    with open(path, 'rb') as f:
+        f.seek(len(_MAGIC))
+        n, = struct.unpack('<Q', f.read(8))
+        index = json.loads(f.read(n).decode())
+        if mmap_mode:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        else:
+            # read into a buffer with the same alignment as the file
+            size = os.fstat(f.fileno()).st_size
+            raw = np.empty(size + _ALIGN, dtype=np.uint8)
+            start = -raw.ctypes.data % _ALIGN
+            buf = raw[start:start + size]
+            f.seek(0)
+            f.readinto(buf)
+
+    arrays = {}
+    for key, (dtype, shape, offset) in index.items():
+        arrays[key] = np.ndarray(shape, dtype=dtype, buffer=buf,
+                                 offset=offset)
+    return arrays
+
+
+# =============================================================================
+# model + optimizer checkpoint
+# =============================================================================
+def save_checkpoint(path, model, optimizer=None):
+    """Save the weights of `model` and the state of `optimizer` to one file.
+
+    The arrays are stored uncompressed under `'model/<parameter path>'` and
+    `'optimizer/<state key>'`, so saving and restoring costs little more
+    than the file I/O. Unlike `save_weights`, the model is not moved to the
+    CPU.
+
+    Args:
+        path (str): Output file. A `.dzw` path uses the memory-mappable raw
+            format, any other an `.npz` archive (`.npz` is appended if
+            missing).
+        model (dezero.Layer): Model to save.
+        optimizer (dezero.optimizers.Optimizer or None): Optimizer whose
+            `state_dict` is saved along with the model.
+    """
+    save_arrays(path, _checkpoint_arrays(model, optimizer))
+
+
+def load_checkpoint(path, model, optimizer=None):
+    """Restore `model` and `optimizer` from a file written by
+    `save_checkpoint`. The optimizer must already be set up on `model`."""
+    arrays = load_arrays(path)
+    model._load_params(arrays, prefix='model/')
+    if optimizer is not None:
+        prefix = 'optimizer/'
+        state = {key[len(prefix):]: arrays[key] for key in arrays
+                 if key.startswith(prefix)}
+        optimizer.load_state_dict(state)
+
+
+def _checkpoint_arrays(model, optimizer=None, out=None):
+    """Host arrays of a checkpoint. If `out` is a dict, every array is copied
+    into `out[key]`, reusing the buffer left there by a previous call, so
+    the result stops following the model."""
+    def host(key, a):
+        if out is None:
+            return cuda.as_numpy(a)
+        buf = out.get(key)
+        if buf is None or buf.shape != a.shape or buf.dtype != a.dtype:
+            buf = out[key] = np.empty(a.shape, dtype=a.dtype)
+        if cuda.get_array_module(a) is np:
+            np.copyto(buf, a)
+        else:
+            a.get(out=buf)
+        return buf
+
+    params_dict = {}
+    model._flatten_params(params_dict)
+    array_dict = {}
+    for key, param in params_dict.items():
+        if param is not None:
+            array_dict['model/' + key] = host('model/' + key, param.data)
+    if optimizer is not None:
+        for key, array in optimizer.state_dict().items():
+            array_dict['optimizer/' + key] = host('optimizer/' + key, array)
+    if out is not None:
+        for key in set(out) - set(array_dict):
+            del out[key]
+    return array_dict
+
+
+# =============================================================================
+# background checkpoint writer
+# =============================================================================
+class CheckpointWriter:
+    """Write checkpoints on a background thread.
+
+    `save` takes a snapshot of the model and optimizer (a device-to-host
+    transfer or a memcpy into buffers reused from the previous save), hands
+    it to a writer thread and returns, so training only stalls for the
+    copy. Each file is written under a
+    temporary name and renamed into place, so a crash never leaves a
+    partial `ckpt_00000100.dzw` behind, and only the newest `keep` files are
+    retained. At most one snapshot waits for the disk: `save` blocks on the
+    previous write before copying again.
+
+    Timing of every save is appended to `history` as a dict with `path`,
+    `step`, `bytes`, `snapshot_seconds` (time spent in `save`) and
+    `write_seconds` (time spent by the writer thread).
+
+    Args:
+        directory (str): Output directory, created if missing.
+        keep (int or None): Number of checkpoints to keep, at least 1.
+            `None` keeps all.
+        prefix (str): File name prefix.
+        ext (str): `.dzw` for the raw format or `.npz`.
+    """
+    def __init__(self, directory, keep=3, prefix='ckpt', ext='.dzw'):
+        if keep is not None and keep < 1:
+            raise ValueError('keep must be at least 1, got {}'.format(keep))
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.keep = keep
+        self.prefix = prefix
+        self.ext = ext
+        self.history = []
+        self._step = 0
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._future = None
+        self._buffers = {}  # snapshot arrays, reused once written
+
+    def save(self, model, optimizer=None, step=None):
+        self.wait()
+        if step is None:
+            step = self._step
+        self._step = step + 1
+
+        start = time.perf_counter()
+        arrays = _checkpoint_arrays(model, optimizer, out=self._buffers)
+        stats = {'path': self.path(step), 'step': step,
+                 'bytes': sum(a.nbytes for a in arrays.values()),
+                 'snapshot_seconds': time.perf_counter() - start,
+                 'write_seconds': None}
+        self.history.append(stats)
+        self._future = self._executor.submit(self._write, arrays, stats)
+
+    def wait(self):
+        """Block until the pending write is done and re-raise its error."""
+        future, self._future = self._future, None
+        if future is not None:
+            future.result()
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def path(self, step):
+        name = '{}_{:08d}{}'.format(self.prefix, step, self.ext)
+        return os.path.join(self.directory, name)
+
+    def checkpoints(self):
+        """Paths of the checkpoints in the directory, oldest first."""
+        names = [name for name in os.listdir(self.directory)
+                 if name.startswith(self.prefix + '_') and
+                 name.endswith(self.ext) and '.tmp' not in name]
+        return [os.path.join(self.directory, name) for name in sorted(names)]
+
+    def latest(self):
+        paths = self.checkpoints()
+        return paths[-1] if paths else None
+
+    def _write(self, arrays, stats):
+        start = time.perf_counter()
+        path = stats['path']
+        tmp = path[:-len(self.ext)] + '.tmp' + self.ext
+        save_arrays(tmp, arrays)
+        os.replace(tmp, path)
+
+        if self.keep is not None:
+            for old in self.checkpoints()[:-self.keep]:
+                os.remove(old)
+        stats['write_seconds'] = time.perf_counter() - start
+
+
+# =============================================================================
+# sharded / incremental checkpoints
+# =============================================================================
+MANIFEST = 'manifest.json'
+
+
+def _shard_group(path, depth):
+    parts = path.split('/')
+    return '.'.join(parts[:min(depth, len(parts) - 1)]) or '_root'
+
+
+def _shard_crc(keys, arrays):
+    crc = 0
+    for key in keys:
+        a = np.require(arrays[key], requirements='C')
+        meta = '{}:{}:{}'.format(key, a.dtype.str, a.shape)
+        crc = zlib.crc32(meta.encode(), crc)
+        crc = zlib.crc32(a.data if a.size else b'', crc)
+    return crc
+
+
+def save_sharded(directory, model, optimizer=None, depth=1):
+    """Save a checkpoint as one raw `.dzw` shard per parameter group plus a
+    `manifest.json`, rewriting only the shards whose contents changed.
+
+    A group is the first `depth` components of the parameter path (`res2`
+    for `res2/a/conv1/W`); the optimizer state of a parameter goes to the
+    shard of the parameter. Shards are named after a CRC32 of their
+    contents, so an unchanged group (e.g. one frozen with `FreezeParam`)
+    is detected by hashing and skipped. The manifest is replaced
+    atomically after the new shards are written, then shards it no longer
+    references are removed; a crash at any point leaves the previous
+    checkpoint loadable.
+
+    Returns:
+        dict: `written` and `skipped` shard names, and `bytes_written`.
+    """
+    os.makedirs(directory, exist_ok=True)
+    arrays = _checkpoint_arrays(model, optimizer)
+    state_names = optimizer.state_names if optimizer is not None else ()
+
+    groups = {}
+    for key in arrays:
+        path = None
+        if key.startswith('model/'):
+            path = key[len('model/'):]
+        else:
+            for name in state_names:
+                prefix = 'optimizer/' + name + '/'
+                if key.startswith(prefix):
+                    path = key[len(prefix):]
+        group = _shard_group(path, depth) if path is not None else '_root'
+        groups.setdefault(group, []).append(key)
+
+    stats = {'written': [], 'skipped': [], 'bytes_written': 0}
+    shards = {}
+    for group, keys in sorted(groups.items()):
+        crc = _shard_crc(keys, arrays)
+        name = '{}-{:08x}.dzw'.format(group, crc)
+        shards[group] = {'file': name, 'crc': crc, 'keys': keys}
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            stats['skipped'].append(group)
+            continue
+        tmp = path[:-len('.dzw')] + '.tmp.dzw'
+        save_arrays(tmp, {key: arrays[key] for key in keys})
+        os.replace(tmp, path)
+        stats['written'].append(group)
+        stats['bytes_written'] += os.path.getsize(path)
+
+    manifest = os.path.join(directory, MANIFEST)
+    with open(manifest + '.tmp', 'w') as f:
+        json.dump({'format': 1, 'shards': shards}, f)
+    os.replace(manifest + '.tmp', manifest)
+
+    files = {shard['file'] for shard in shards.values()}
+    for name in os.listdir(directory):
+        if name.endswith('.dzw') and name not in files:
+            os.remove(os.path.join(directory, name))
+    return stats
+
+
+def load_sharded(directory, model, optimizer=None, workers=4,
+                 mmap_mode=True):
+    """Restore a checkpoint written by `save_sharded`, reading the shards
+    listed in its manifest on `workers` threads."""
+    with open(os.path.join(directory, MANIFEST)) as f:
+        shards = json.load(f)['shards']
+
+    def load(shard):
+        return load_arrays(os.path.join(directory, shard['file']), mmap_mode)
+
+    arrays = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for shard_arrays in executor.map(load, shards.values()):
+            arrays.update(shard_arrays)
+
+    model._load_params(arrays, prefix='model/')
+    if optimizer is not None:
+        prefix = 'optimizer/'
+        state = {key[len(prefix):]: arrays[key] for key in arrays
+                 if key.startswith(prefix)}
+        optimizer.load_state_dict(state)
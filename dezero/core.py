@@ -10,6 +10,10 @@ import dezero
 class Config:
     enable_backprop = True
     train = True
+    conv_workers = 1  # threads splitting the batch in CPU convolutions
+    conv_col_budget = 0  # max bytes of a conv im2col buffer kept for backward
+    meta = False  # propagate shapes only (see Function.forward_meta)
+    function_hooks = ()  # hook(function, xs, ys) called after every forward
 
 
 @contextlib.contextmanager
@@ -39,12 +43,47 @@ except ImportError:
     array_types = (np.ndarray)
 
 
+class MetaArray:
+    """Shape and dtype of an array that is never allocated.
+
+    Variables holding a `MetaArray` flow through Functions while
+    `Config.meta` is set, which is how `dezero.profiler.dry_run` builds and
+    measures a model without touching data.
+    """
+    def __init__(self, shape, dtype=np.float32):
+        self.shape = tuple(int(s) for s in shape)
+        self.dtype = np.dtype(dtype)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape, dtype=np.int64))
+
+    @property
+    def nbytes(self):
+        return self.size * self.dtype.itemsize
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return 'meta{}'.format((self.shape, self.dtype.name))
+
+    def stand_in(self):
+        """A zero-stride array of the same shape and dtype (one element of
+        memory) for code that needs a real array."""
+        return np.broadcast_to(np.zeros((), dtype=self.dtype), self.shape)
+
+
 class Variable:
     __array_priority__ = 200
 
     def __init__(self, data, name=None):
         if data is not None:
-            if not isinstance(data, array_types):
+            if not isinstance(data, (array_types, MetaArray)):
                 raise TypeError('{} is not supported'.format(type(data)))
 
         self.data = data
@@ -105,7 +144,9 @@ class Variable:
         add_func(self.creator)
         while funcs:
             f = funcs.pop()
-            gys = [output().grad for output in f.outputs]  # output is weakref
+            # output is weakref; outputs nobody kept have no gradient
+            outputs = [output() for output in f.outputs]
+            gys = [y.grad if y is not None else None for y in outputs]
 
             with using_config('enable_backprop', create_graph):
                 gxs = f.backward(*gys)
@@ -113,8 +154,18 @@ class Variable:
                     gxs = (gxs,)
 
                 for x, gx in zip(f.inputs, gxs):
+                    flat_grad = getattr(x, '_flat_grad', None)
                     if x.grad is None:
-                        x.grad = gx
+                        if flat_grad is not None and not create_graph:
+                            # the first gradient goes into the flat buffer
+                            # of Layer.to_flat
+                            flat_grad[...] = gx.data
+                            x.grad = Variable(flat_grad)
+                        else:
+                            x.grad = gx
+                    elif not create_graph and x.grad.data is flat_grad:
+                        # accumulate into the flat buffer of Layer.to_flat
+                        x.grad.data += gx.data
                     else:
                         x.grad = x.grad + gx
 
@@ -122,8 +173,9 @@ class Variable:
                         add_func(x.creator)
 
             if not retain_grad:
-                for y in f.outputs:
-                    y().grad = None  # y is weakref
+                for y in outputs:
+                    if y is not None:
+                        y.grad = None
 
     def unchain_backward(self):
         if self.creator is not None:
@@ -165,7 +217,7 @@ class Variable:
 
 
 class Parameter(Variable):
-    pass
+    _flat_grad = None  # gradient view into a buffer made by Layer.to_flat
 
 
 def as_variable(obj):
@@ -185,9 +237,14 @@ class Function:
         inputs = [as_variable(x) for x in inputs]
 
         xs = [x.data for x in inputs]
-        ys = self.forward(*xs)
+        if Config.meta:
+            ys = self.forward_meta(*xs)
+        else:
+            ys = self.forward(*xs)
         if not isinstance(ys, tuple):
             ys = (ys,)
+        for hook in Config.function_hooks:
+            hook(self, xs, ys)
         outputs = [Variable(as_array(y)) for y in ys]
 
         if Config.enable_backprop:
@@ -199,17 +256,53 @@ class Function:
 
         return outputs if len(outputs) > 1 else outputs[0]
 
+    # True for Functions whose output is the broadcast of their inputs and
+    # costs one operation per output element
+    elementwise = False
+    # True for Functions whose output is a view of their input
+    view = False
+
     def forward(self, xs):
         raise NotImplementedError()
 
     def backward(self, gys):
         raise NotImplementedError()
 
+    def forward_meta(self, *xs):
+        """Forward pass on `MetaArray`s (mixed with real arrays), returning
+        `MetaArray`s. Functions override it with a shape rule. The default
+        broadcasts elementwise Functions and otherwise runs `forward` on
+        zero-stride stand-ins."""
+        xs = [x.stand_in() if isinstance(x, MetaArray) else x for x in xs]
+        if self.elementwise:
+            shape = np.broadcast_shapes(*[np.shape(x) for x in xs])
+            return MetaArray(shape, np.result_type(*xs))
+
+        ys = self.forward(*xs)
+        if not isinstance(ys, tuple):
+            return MetaArray(np.shape(ys), ys.dtype)
+        return tuple(MetaArray(np.shape(y), y.dtype) for y in ys)
+
+    def flops(self, xs, ys):
+        """Floating point operations of a forward from `xs` to `ys` (arrays
+        or `MetaArray`s)."""
+        return ys[0].size if self.elementwise else 0
+
+    def traffic(self, xs, ys):
+        """Bytes read and written by a forward from `xs` to `ys`, counting
+        every input and output once (views move nothing)."""
+        if self.view:
+            return 0, 0
+        return (sum(getattr(x, 'nbytes', 0) for x in xs),
+                sum(getattr(y, 'nbytes', 0) for y in ys))
+
 
 # =============================================================================
 # 사칙연산 / 연산자 오버로드
 # =============================================================================
 class Add(Function):
+    elementwise = True
+
     def forward(self, x0, x1):
         self.x0_shape, self.x1_shape = x0.shape, x1.shape
         y = x0 + x1
@@ -229,6 +322,8 @@ def add(x0, x1):
 
 
 class Mul(Function):
+    elementwise = True
+
     def forward(self, x0, x1):
         y = x0 * x1
         return y
@@ -249,6 +344,8 @@ def mul(x0, x1):
 
 
 class Neg(Function):
+    elementwise = True
+
     def forward(self, x):
         return -x
 
@@ -261,6 +358,8 @@ def neg(x):
 
 
 class Sub(Function):
+    elementwise = True
+
     def forward(self, x0, x1):
         self.x0_shape, self.x1_shape = x0.shape, x1.shape
         y = x0 - x1
@@ -286,6 +385,8 @@ def rsub(x0, x1):
 
 
 class Div(Function):
+    elementwise = True
+
     def forward(self, x0, x1):
         y = x0 / x1
         return y
@@ -311,6 +412,8 @@ def rdiv(x0, x1):
 
 
 class Pow(Function):
+    elementwise = True
+
     def __init__(self, c):
         self.c = c
 
@@ -1,4 +1,9 @@
 import math
+import queue
+import threading
+import traceback
+import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
 pil_available = True
 try:
     from PIL import Image
@@ -6,44 +11,134 @@ except:
     pil_available = False
 import numpy as np
 from dezero import cuda
+from dezero.datasets import StreamDataset
 
 
 class DataLoader:
-    def __init__(self, dataset, batch_size, shuffle=True, gpu=False):
+    """Iterate over a dataset in (x, t) batches.
+
+    With `num_workers > 0` batches are built ahead of the training loop by
+    worker processes (or threads with `multiprocess=False`), at most
+    `prefetch` batches at a time. Process workers hand batches over through
+    shared memory instead of pickling them. Call `close` (or use the loader
+    as a context manager) to stop the workers.
+
+    A `StreamDataset` is read in `batch_size` slices of its stream, through
+    its shuffle buffer if `shuffle` is set. Each worker reads one shard of
+    the stream and the loader takes batches from the workers in turn, so
+    the order depends on `num_workers` and `max_iter` is None.
+
+    A `sampler` (such as `BucketSampler`) replaces the batches of
+    `batch_size` consecutive indices: `sampler.batches(epoch)` gives the
+    index batches of each epoch. A `collate` function builds a batch from
+    the list of `(x, t)` examples instead of stacking them, e.g.
+    `pad_collate` for sequences of different lengths.
+
+    Args:
+        dataset (Dataset): Dataset to load from.
+        batch_size (int): Number of examples per batch.
+        shuffle (bool): Visit the examples in a new random order each epoch.
+        gpu (bool): Return CuPy arrays.
+        num_workers (int): Number of workers; 0 loads in the calling thread.
+        prefetch (int): Maximum number of batches in flight.
+        multiprocess (bool): Use processes (True) or threads as workers.
+        seed (int): If given, the order of epoch `e` is the permutation of
+            `RandomState(seed + e)`, independently of the global state.
+        sampler: Object whose `batches(epoch)` returns the list of index
+            arrays of an epoch; `batch_size`, `shuffle` and `seed` are
+            then unused.
+        collate (callable): Builds a batch from a list of examples.
+    """
+    def __init__(self, dataset, batch_size, shuffle=True, gpu=False,
+                 num_workers=0, prefetch=2, multiprocess=True, seed=None,
+                 sampler=None, collate=None):
         self.dataset = dataset
         self.batch_size = batch_size
         self.shuffle = shuffle
-        self.data_size = len(dataset)
-        self.max_iter = math.ceil(self.data_size / batch_size)
+        self.sampler = sampler
+        self.collate = collate
+        self.streaming = isinstance(dataset, StreamDataset)
+        if self.streaming or sampler is not None:
+            self.data_size = len(dataset) if hasattr(dataset, '__len__') \
+                else None
+            self.max_iter = None  # set by `reset` for a sampler
+        else:
+            self.data_size = len(dataset)
+            self.max_iter = math.ceil(self.data_size / batch_size)
         self.gpu = gpu
+        self.num_workers = num_workers
+        self.prefetch = max(prefetch, num_workers)
+        self.multiprocess = multiprocess
+        self.seed = seed
 
+        self.epoch = -1
+        self._workers = []
+        self._tasks = self._results = self._slots = None
+        self._free = []
+        self._stream = self._stop = None
+        self._queues = []
         self.reset()
 
     def reset(self):
         self.iteration = 0
-        if self.shuffle:
-            self.index = np.random.permutation(len(self.dataset))
+        self.epoch += 1
+        if self.streaming:
+            # stream workers read one epoch each
+            self.close()
+            self.index = None
+            self._stream_seed = None
+            if self.shuffle:
+                self._stream_seed = np.random.randint(2 ** 31) \
+                    if self.seed is None else self.seed + self.epoch
+            return
+        if self.sampler is not None:
+            self.index = None
+            self._batches = self.sampler.batches(self.epoch)
+            self.max_iter = len(self._batches)
+        elif self.shuffle:
+            if self.seed is None:
+                self.index = np.random.permutation(len(self.dataset))
+            else:
+                rng = np.random.RandomState(self.seed + self.epoch)
+                self.index = rng.permutation(len(self.dataset))
         else:
             self.index = np.arange(len(self.dataset))
+        self._submitted = 0
+        self._ready = {}
 
     def __iter__(self):
         return self
 
+    def _batch_index(self, i):
+        if self.sampler is not None:
+            return self._batches[i]
+        batch_size = self.batch_size
+        return self.index[i * batch_size:(i + 1) * batch_size]
+
     def __next__(self):
-        if self.iteration >= self.max_iter:
+        if self.streaming:
+            if self._stream is None:
+                self._stream = self._stream_batches()
+            batch = next(self._stream, None)
+            if batch is None:
+                self.reset()
+                raise StopIteration
+        elif self.iteration >= self.max_iter:
             self.reset()
             raise StopIteration
+        elif self.num_workers > 0:
+            batch = self._fetch(self.iteration)
+        else:
+            batch = _load_batch(self.dataset,
+                                self._batch_index(self.iteration),
+                                self.collate)
 
-        i, batch_size = self.iteration, self.batch_size
-        batch_index = self.index[i * batch_size:(i + 1) * batch_size]
-        batch = [self.dataset[i] for i in batch_index]
-
-        xp = cuda.cupy if self.gpu else np
-        x = xp.array([example[0] for example in batch])
-        t = xp.array([example[1] for example in batch])
+        if self.gpu:
+            xp = cuda.cupy
+            batch = tuple(xp.asarray(a) for a in batch)
 
         self.iteration += 1
-        return x, t
+        return batch
 
     def next(self):
         return self.__next__()
@@ -54,25 +149,520 @@ class DataLoader:
     def to_gpu(self):
         self.gpu = True
 
+    # =========================================================================
+    # workers
+    # =========================================================================
+    def _start(self, i):
+        # the first batch is loaded here; it sizes the shared buffers
+        batch = _load_batch(self.dataset, self._batch_index(i), self.collate)
+        self._ready[i] = batch
+        self._submitted = i + 1
+        self._free = list(range(self.prefetch))
+
+        slots = None
+        if self.multiprocess:
+            methods = multiprocessing.get_all_start_methods()
+            ctx = multiprocessing.get_context(
+                'fork' if 'fork' in methods else None)
+            self._tasks, self._results = ctx.Queue(), ctx.Queue()
+            worker = ctx.Process
+            if not any(a.dtype.hasobject for a in batch):
+                # workers share this process's tracker of shared memory,
+                # which forgets the block when it is unlinked in `close`
+                resource_tracker.ensure_running()
+                self._slots = _SharedSlots(self.prefetch, [
+                    (a.shape, a.dtype.str) for a in batch])
+                slots = self._slots.args()
+        else:
+            self._tasks, self._results = queue.Queue(), queue.Queue()
+            worker = threading.Thread
+
+        for _ in range(self.num_workers):
+            w = worker(target=_worker_loop,
+                       args=(self.dataset, self.collate, self._tasks,
+                             self._results, slots),
+                       daemon=True)
+            w.start()
+            self._workers.append(w)
+
+    def _fetch(self, i):
+        if not self._workers:
+            self._start(i)
+        while i not in self._ready:
+            self._submit(i)
+            self._receive()
+        batch = self._ready.pop(i)
+        # top up after taking the batch, so that waking a worker does not
+        # delay its delivery
+        self._submit(i + 1)
+        return batch
+
+    def _submit(self, i):
+        # every batch in flight holds one of `prefetch` slots
+        while self._free and self._submitted < self.max_iter and \
+                self._submitted < i + self.prefetch:
+            n = self._submitted
+            self._tasks.put((self.epoch, n, self._batch_index(n),
+                             self._free.pop()))
+            self._submitted += 1
+
+    def _receive(self):
+        epoch, i, slot, n, batch, error = self._results.get()
+        if error is not None:
+            self.close()
+            raise RuntimeError('DataLoader worker failed:\n' + error)
+        if batch is None:
+            batch = self._slots.get(slot, n)
+        self._free.append(slot)
+        # batches of an epoch that was reset are dropped
+        if epoch == self.epoch:
+            self._ready[i] = batch
+
+    # =========================================================================
+    # streams
+    # =========================================================================
+    def _stream_rng(self, shard):
+        if self._stream_seed is None:
+            return None
+        return np.random.RandomState([self._stream_seed, shard])
+
+    def _stream_batches(self):
+        if self.num_workers == 0:
+            yield from self.dataset.batches(self.batch_size,
+                                            rng=self._stream_rng(0))
+            return
+
+        if self.multiprocess:
+            methods = multiprocessing.get_all_start_methods()
+            ctx = multiprocessing.get_context(
+                'fork' if 'fork' in methods else None)
+            make_queue, worker, self._stop = ctx.Queue, ctx.Process, \
+                ctx.Event()
+        else:
+            make_queue, worker, self._stop = queue.Queue, threading.Thread, \
+                threading.Event()
+        # bounded queues: a worker waits while its batches are not taken
+        maxsize = math.ceil(self.prefetch / self.num_workers)
+        for shard in range(self.num_workers):
+            results = make_queue(maxsize)
+            w = worker(target=_stream_worker,
+                       args=(self.dataset, self.batch_size, shard,
+                             self.num_workers, self._stream_rng(shard),
+                             results, self._stop),
+                       daemon=True)
+            w.start()
+            self._workers.append(w)
+            self._queues.append(results)
+
+        active = list(self._queues)
+        while active:
+            for results in list(active):
+                batch, error = results.get()
+                if error is not None:
+                    self.close()
+                    raise RuntimeError('DataLoader worker failed:\n' + error)
+                if batch is None:
+                    active.remove(results)
+                else:
+                    yield batch
+
+    def close(self):
+        """Stop the workers and release the shared memory."""
+        self._stream = None
+        if not self._workers:
+            return
+        if self.streaming:
+            self._stop.set()
+            queues = self._queues
+        else:
+            for _ in self._workers:
+                self._tasks.put(None)
+            queues = [self._results]
+        # keep draining results while joining: a process does not exit
+        # before what it has put is read
+        while True:
+            alive = any(w.is_alive() for w in self._workers)
+            drained = False
+            for results in queues:
+                try:
+                    results.get(timeout=0.05 / len(queues))
+                    drained = True
+                except queue.Empty:
+                    pass
+            if not drained and not alive:
+                break
+        for w in self._workers:
+            w.join()
+        if self.multiprocess:
+            for results in queues + [self._tasks]:
+                if results is not None:
+                    results.close()
+        if self._slots is not None:
+            self._slots.close(unlink=True)
+        self._workers = []
+        self._tasks = self._results = self._slots = self._stop = None
+        self._queues = []
+        self._submitted = 0
+        self._ready = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+def _load_batch(dataset, batch_index, collate=None):
+    if collate is not None:
+        return collate([dataset[i] for i in batch_index])
+    if hasattr(dataset, 'get_batch'):
+        return dataset.get_batch(np.asarray(batch_index))
+    batch = [dataset[i] for i in batch_index]
+    x = np.array([example[0] for example in batch])
+    t = np.array([example[1] for example in batch])
+    return x, t
+
+
+def _worker_loop(dataset, collate, tasks, results, slots):
+    if slots is not None:
+        slots = _SharedSlots(*slots)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            epoch, i, batch_index, slot = task
+            try:
+                batch = _load_batch(dataset, batch_index, collate)
+                # batches that do not fit the slots are pickled instead
+                if slots is not None and slots.put(slot, batch):
+                    batch = None
+                results.put((epoch, i, slot, len(batch_index), batch, None))
+            except Exception:
+                results.put((epoch, i, slot, 0, None, traceback.format_exc()))
+    finally:
+        if slots is not None:
+            slots.close()
+
+
+def _stream_worker(dataset, batch_size, shard, num_shards, rng, results,
+                   stop):
+    try:
+        for batch in dataset.batches(batch_size, shard, num_shards, rng):
+            if not _put(results, (batch, None), stop):
+                return
+        _put(results, (None, None), stop)
+    except Exception:
+        _put(results, (None, traceback.format_exc()), stop)
+
+
+def _put(results, item, stop):
+    # a full queue is retried until the loader stops the worker
+    while not stop.is_set():
+        try:
+            results.put(item, timeout=0.05)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+class _SharedSlots:
+    """`n` preallocated batches of arrays with the given (shape, dtype)
+    specs in one shared memory block; created by the loader and attached
+    by name in the workers."""
+    def __init__(self, n, specs, name=None):
+        self.n = n
+        self.specs = specs
+        sizes = [n * int(np.prod(shape)) * np.dtype(dtype).itemsize
+                 for shape, dtype in specs]
+        offsets = np.cumsum([0] + [(size + 63) // 64 * 64 for size in sizes])
+        if name is None:
+            self.shm = shared_memory.SharedMemory(
+                create=True, size=max(int(offsets[-1]), 1))
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.arrays = [np.ndarray((n,) + tuple(shape), dtype,
+                                  buffer=self.shm.buf, offset=int(offset))
+                       for (shape, dtype), offset in zip(specs, offsets)]
+
+    def args(self):
+        return self.n, self.specs, self.shm.name
+
+    def put(self, slot, batch):
+        if len(batch) != len(self.arrays):
+            return False
+        for a, buf in zip(batch, self.arrays):
+            if a.dtype != buf.dtype or a.shape[1:] != buf.shape[2:] or \
+                    len(a) > buf.shape[1]:
+                return False
+        for a, buf in zip(batch, self.arrays):
+            buf[slot, :len(a)] = a
+        return True
+
+    def get(self, slot, n):
+        return tuple(buf[slot, :n].copy() for buf in self.arrays)
+
+    def close(self, unlink=False):
+        self.arrays = None  # views must go before the buffer is closed
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
 
 class SeqDataLoader(DataLoader):
-    def __init__(self, dataset, batch_size, gpu=False):
+    """Iterate over a sequence in batches of `batch_size` positions spread
+    evenly along it, advancing every position by one at each step.
+
+    A `StreamDataset` with `__len__` and `read(start, count)` (such as
+    `TokenStream`) is read in the calling thread, a chunk per position at a
+    time, so only `batch_size` chunks are in memory; `num_workers` is not
+    used for it.
+    """
+    def __init__(self, dataset, batch_size, gpu=False, num_workers=0,
+                 prefetch=2, multiprocess=True):
         super().__init__(dataset=dataset, batch_size=batch_size, shuffle=False,
-                         gpu=gpu)
+                         gpu=gpu, num_workers=num_workers, prefetch=prefetch,
+                         multiprocess=multiprocess)
+        if self.streaming:
+            self.data_size = len(dataset)
+            self.max_iter = math.ceil(self.data_size / batch_size)
 
-    def __next__(self):
-        if self.iteration >= self.max_iter:
-            self.reset()
-            raise StopIteration
+    def _batch_index(self, i):
+        jump = self.data_size // self.batch_size
+        return [(k * jump + i) % self.data_size for k in
+                range(self.batch_size)]
 
+    def _stream_batches(self):
         jump = self.data_size // self.batch_size
-        batch_index = [(i * jump + self.iteration) % self.data_size for i in
-                       range(self.batch_size)]
-        batch = [self.dataset[i] for i in batch_index]
+        chunk = getattr(self.dataset, 'chunk_size', 1024)
+        for i in range(self.max_iter):
+            j = i % chunk
+            if j == 0:
+                count = min(chunk, self.max_iter - i)
+                raw = [self.dataset.read(k * jump + i, count)
+                       for k in range(self.batch_size)]
+                xs = np.stack([x for x, _ in raw])
+                ts = None if raw[0][1] is None else \
+                    np.stack([t for _, t in raw])
+            yield self.dataset.transform_batch(
+                xs[:, j], None if ts is None else ts[:, j])
 
-        xp = cuda.cupy if self.gpu else np
-        x = xp.array([example[0] for example in batch])
-        t = xp.array([example[1] for example in batch])
 
-        self.iteration += 1
-        return x, t
\ No newline at end of file
+# =============================================================================
+# Samplers
+# =============================================================================
+class BucketSampler:
+    """Batches of sequences of similar lengths, for `DataLoader(sampler=)`.
+
+    Every epoch the indices are shuffled and split into pools of
+    `bucket_size` sequences; each pool is sorted by length and cut into
+    batches, and the batches of all pools are shuffled together. Padded to
+    their own longest sequence (see `pad_collate`), the batches then hold
+    little padding while their order stays random.
+
+    Example:
+        >>> sampler = BucketSampler([len(x) for x in train_set.data], 32)
+        >>> print(sampler.summary())
+        >>> loader = DataLoader(train_set, None, sampler=sampler,
+        ...                     collate=pad_collate)
+        >>> for x, t, mask in loader:
+        ...     ...
+
+    Args:
+        lengths (array-like): Length of every sequence of the dataset.
+        batch_size (int): Number of sequences per batch.
+        bucket_size (int): Number of sequences sorted together. Larger
+            pools pad less but mix lengths less. Defaults to
+            `50 * batch_size`.
+        shuffle (bool): Shuffle the pools and the batches every epoch.
+        seed (int): If given, epoch `e` draws from `RandomState(seed + e)`.
+    """
+    def __init__(self, lengths, batch_size, bucket_size=None, shuffle=True,
+                 seed=None):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.bucket_size = bucket_size or 50 * batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+
+    def __len__(self):
+        n, bucket_size = len(self.lengths), self.bucket_size
+        full, rest = divmod(n, bucket_size)
+        return full * math.ceil(bucket_size / self.batch_size) + \
+            math.ceil(rest / self.batch_size)
+
+    def _rng(self, epoch):
+        if self.seed is None:
+            return np.random
+        return np.random.RandomState(self.seed + epoch)
+
+    def batches(self, epoch=0):
+        """Index arrays of the batches of `epoch`."""
+        n = len(self.lengths)
+        rng = self._rng(epoch)
+        order = rng.permutation(n) if self.shuffle else np.arange(n)
+        batches = []
+        for start in range(0, n, self.bucket_size):
+            pool = order[start:start + self.bucket_size]
+            pool = pool[np.argsort(self.lengths[pool], kind='stable')]
+            batches.extend(pool[i:i + self.batch_size]
+                           for i in range(0, len(pool), self.batch_size))
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        return batches
+
+    def stats(self, epoch=0):
+        """Padding of the batches of `epoch`, next to batches of the same
+        size drawn without bucketing and to padding to the longest sequence
+        of the dataset. Efficiency is real over padded tokens; attention
+        costs grow with the padded length squared."""
+        def padding(batches):
+            longest = np.array([self.lengths[b].max() for b in batches])
+            sizes = np.array([len(b) for b in batches])
+            return {'padded': int((sizes * longest).sum()),
+                    'attention': int((sizes * longest ** 2).sum())}
+
+        tokens = int(self.lengths.sum())
+        n, batch_size = len(self.lengths), self.batch_size
+        order = self._rng(epoch).permutation(n)
+        stats = {'tokens': tokens, 'batches': len(self)}
+        for key, batches in (
+                ('bucketed', self.batches(epoch)),
+                ('random', [order[i:i + batch_size]
+                            for i in range(0, n, batch_size)])):
+            stats[key] = padding(batches)
+        longest = int(self.lengths.max())
+        stats['global'] = {'padded': n * longest,
+                           'attention': n * longest ** 2}
+        for key in ('bucketed', 'random', 'global'):
+            stats[key]['efficiency'] = tokens / stats[key]['padded']
+        return stats
+
+    def summary(self, epoch=0):
+        stats = self.stats(epoch)
+        lines = ['{:<10}{:>12}{:>12}{:>16}'.format(
+            'padding', 'padded', 'efficiency', 'attention')]
+        for key in ('bucketed', 'random', 'global'):
+            s = stats[key]
+            lines.append('{:<10}{:>12}{:>12.3f}{:>16}'.format(
+                key, s['padded'], s['efficiency'], s['attention']))
+        lines.append('{} tokens in {} batches'.format(stats['tokens'],
+                                                       stats['batches']))
+        return '\n'.join(lines)
+
+
+def pad_sequences(sequences, length=None, value=0, dtype=None):
+    """Stack sequences of different lengths into one array.
+
+    Args:
+        sequences (list of array-like): Sequences of shape (L_i, ...).
+        length (int): Padded length; the longest sequence by default.
+            Longer sequences are truncated.
+        value: Value of the padding.
+        dtype: dtype of the result; that of the first sequence by default.
+
+    Returns:
+        tuple: The (N, length, ...) padded array and the (N, length) bool
+        mask, True at real positions.
+
+    Raises:
+        ValueError: If `sequences` is empty.
+    """
+    if len(sequences) == 0:
+        raise ValueError('pad_sequences needs at least one sequence')
+    sequences = [np.asarray(s) for s in sequences]
+    lengths = np.array([len(s) for s in sequences])
+    if length is None:
+        length = int(lengths.max())
+    first = sequences[0]
+    padded = np.full((len(sequences), length) + first.shape[1:], value,
+                     dtype=first.dtype if dtype is None else dtype)
+    for i, s in enumerate(sequences):
+        padded[i, :len(s)] = s[:length]
+    mask = np.arange(length) < lengths[:, None]
+    return padded, mask
+
+
+def pad_collate(examples, value=0):
+    """`DataLoader` collate for `(x, t)` examples whose `x` are sequences;
+    returns `(x, t, mask)`. Labels that are sequences are padded like `x`
+    (they share its mask), others are stacked."""
+    x, mask = pad_sequences([example[0] for example in examples],
+                            value=value)
+    t = [example[1] for example in examples]
+    if np.ndim(t[0]) > 0:
+        t, _ = pad_sequences(t, length=x.shape[1], value=value)
+    else:
+        t = np.array(t)
+    return x, t, mask
+
+
+class DistributedSampler:
+    """Disjoint shares of a dataset for the ranks of data-parallel training,
+    for `DataLoader(sampler=)`.
+
+    Every rank draws the same permutation of epoch `e` from
+    `RandomState(seed + e)` and takes every `num_replicas`-th index of it
+    from position `rank`, so the ranks of an epoch read disjoint examples
+    and together read each example once. When the dataset does not divide
+    evenly, the permutation is padded with its first indices (a few
+    examples are read twice) or, with `drop_last`, cut (a few are not read
+    in that epoch); either way every rank gets the same number of batches.
+
+    Example:
+        >>> sampler = DistributedSampler(len(train_set), size, rank, 32)
+        >>> loader = DataLoader(train_set, None, sampler=sampler)
+
+    Args:
+        data_size (int): Number of examples in the dataset.
+        num_replicas (int): Number of ranks.
+        rank (int): Rank of this process, in `[0, num_replicas)`.
+        batch_size (int): Number of examples per batch of a rank.
+        shuffle (bool): Permute the examples every epoch.
+        seed (int): Seed shared by all the ranks.
+        drop_last (bool): Cut the permutation instead of padding it.
+    """
+    def __init__(self, data_size, num_replicas, rank, batch_size,
+                 shuffle=True, seed=0, drop_last=False):
+        if not 0 <= rank < num_replicas:
+            raise ValueError('rank {} is not in [0, {})'.format(
+                rank, num_replicas))
+        self.data_size = data_size
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.drop_last = drop_last
+        if drop_last:
+            self.num_samples = data_size // num_replicas
+        else:
+            self.num_samples = math.ceil(data_size / num_replicas)
+
+    def __len__(self):
+        return math.ceil(self.num_samples / self.batch_size)
+
+    def indices(self, epoch=0):
+        """Indices this rank reads in `epoch`, in order."""
+        if self.shuffle:
+            rng = np.random.RandomState(self.seed + epoch)
+            order = rng.permutation(self.data_size)
+        else:
+            order = np.arange(self.data_size)
+        total = self.num_samples * self.num_replicas
+        if total > self.data_size:
+            order = np.resize(order, total)  # repeats from the start
+        return order[self.rank:total:self.num_replicas]
+
+    def batches(self, epoch=0):
+        """Index arrays of the batches of this rank in `epoch`."""
+        indices = self.indices(epoch)
+        return [indices[i:i + self.batch_size]
+                for i in range(0, len(indices), self.batch_size)]
@@ -1,5 +1,8 @@
 import os
 import gzip
+import json
+import time
+import zlib
 import tarfile
 import pickle
 import numpy as np
@@ -8,15 +11,19 @@ from dezero.utils import get_file, cache_dir
 from dezero.transforms import Compose, Flatten, ToFloat, Normalize
 
 
+def _identity(x):
+    return x
+
+
 class Dataset:
     def __init__(self, train=True, transform=None, target_transform=None):
         self.train = train
         self.transform = transform
         self.target_transform = target_transform
         if self.transform is None:
-            self.transform = lambda x: x
+            self.transform = _identity
         if self.target_transform is None:
-            self.target_transform = lambda x: x
+            self.target_transform = _identity
 
         self.data = None
         self.label = None
@@ -33,10 +40,48 @@ class Dataset:
     def __len__(self):
         return len(self.data)
 
+    def get_batch(self, indices):
+        """Examples at `indices` as stacked (x, t) arrays.
+
+        When `data` (and `label`) are arrays and the transforms have a
+        `batch` version, the batch is one fancy-index and one transform
+        call per stage; otherwise the examples are fetched one by one.
+        """
+        transform = _batch_transform(self.transform)
+        target_transform = _batch_transform(self.target_transform)
+        if type(self).__getitem__ is not Dataset.__getitem__ or \
+                not isinstance(self.data, np.ndarray) or \
+                transform is None or target_transform is None or \
+                not (self.label is None or
+                     isinstance(self.label, np.ndarray)):
+            batch = [self[i] for i in indices]
+            x = np.array([example[0] for example in batch])
+            t = np.array([example[1] for example in batch])
+            return x, t
+
+        # fancy indexing copies, so the transforms may work in place
+        x = self.data[indices]
+        x = transform(x, inplace=not np.may_share_memory(x, self.data))
+        if self.label is None:
+            return x, np.full(len(x), None)
+        t = self.label[indices]
+        return x, target_transform(
+            t, inplace=not np.may_share_memory(t, self.label))
+
     def prepare(self):
         pass
 
 
+def _identity_batch(array, inplace=False):
+    return array
+
+
+def _batch_transform(transform):
+    if transform is _identity:
+        return _identity_batch
+    return getattr(transform, 'batch', None)
+
+
 # =============================================================================
 # Toy datasets
 # =============================================================================
@@ -131,41 +176,19 @@ class CIFAR10(Dataset):
 
     def prepare(self):
         url='https://www.cs.toronto.edu/~kriz/cifar-10-python.tar.gz'
-        self.data, self.label = load_cache_npz(url, self.train)
+        self.data, self.label = load_cache(url, self.train)
         if self.data is not None:
             return
-        filepath = get_file(url)
+        self.data, self.label = self._extract(get_file(url))
+        save_cache(self.data, self.label, url, self.train)
+        self.data, self.label = load_cache(url, self.train)
+
+    def _extract(self, filepath):
         if self.train:
-            self.data = np.empty((50000, 3 * 32 * 32))
-            self.label = np.empty((50000), dtype=int)
-            for i in range(5):
-                self.data[i * 10000:(i + 1) * 10000] = self._load_data(
-                    filepath, i + 1, 'train')
-                self.label[i * 10000:(i + 1) * 10000] = self._load_label(
-                    filepath, i + 1, 'train')
+            members = ['data_batch_{}'.format(i + 1) for i in range(5)]
         else:
-            self.data = self._load_data(filepath, 5, 'test')
-            self.label = self._load_label(filepath, 5, 'test')
-        self.data = self.data.reshape(-1, 3, 32, 32)
-        save_cache_npz(self.data, self.label, url, self.train)
-
-
-    def _load_data(self, filename, idx, data_type='train'):
-        assert data_type in ['train', 'test']
-        with tarfile.open(filename, 'r:gz') as file:
-            for item in file.getmembers():
-                if ('data_batch_{}'.format(idx) in item.name and data_type == 'train') or ('test_batch' in item.name and data_type == 'test'):
-                    data_dict = pickle.load(file.extractfile(item), encoding='bytes')
-                    data = data_dict[b'data']
-                    return data
-
-    def _load_label(self, filename, idx, data_type='train'):
-        assert data_type in ['train', 'test']
-        with tarfile.open(filename, 'r:gz') as file:
-            for item in file.getmembers():
-                if ('data_batch_{}'.format(idx) in item.name and data_type == 'train') or ('test_batch' in item.name and data_type == 'test'):
-                    data_dict = pickle.load(file.extractfile(item), encoding='bytes')
-                    return np.array(data_dict[b'labels'])
+            members = ['test_batch']
+        return extract_cifar(filepath, members, b'labels')
 
     def show(self, row=10, col=10):
         H, W = 32, 32
@@ -194,38 +217,19 @@ class CIFAR100(CIFAR10):
 
     def prepare(self):
         url = 'https://www.cs.toronto.edu/~kriz/cifar-100-python.tar.gz'
-        self.data, self.label = load_cache_npz(url, self.train)
+        cache = url + '.' + self.label_type
+        self.data, self.label = load_cache(cache, self.train)
         if self.data is not None:
             return
 
-        filepath = get_file(url)
-        if self.train:
-            self.data = self._load_data(filepath, 'train')
-            self.label = self._load_label(filepath, 'train')
-        else:
-            self.data = self._load_data(filepath, 'test')
-            self.label = self._load_label(filepath, 'test')
-        self.data = self.data.reshape(-1, 3, 32, 32)
-        save_cache_npz(self.data, self.label, url, self.train)
-
-    def _load_data(self, filename, data_type='train'):
-        with tarfile.open(filename, 'r:gz') as file:
-            for item in file.getmembers():
-                if data_type in item.name:
-                    data_dict = pickle.load(file.extractfile(item), encoding='bytes')
-                    data = data_dict[b'data']
-                    return data
-
-    def _load_label(self, filename, data_type='train'):
-        assert data_type in ['train', 'test']
-        with tarfile.open(filename, 'r:gz') as file:
-            for item in file.getmembers():
-                if data_type in item.name:
-                    data_dict = pickle.load(file.extractfile(item), encoding='bytes')
-                    if self.label_type == 'fine':
-                        return np.array(data_dict[b'fine_labels'])
-                    elif self.label_type == 'coarse':
-                        return np.array(data_dict[b'coarse_labels'])
+        self.data, self.label = self._extract(get_file(url))
+        save_cache(self.data, self.label, cache, self.train)
+        self.data, self.label = load_cache(cache, self.train)
+
+    def _extract(self, filepath):
+        members = ['train'] if self.train else ['test']
+        label_key = '{}_labels'.format(self.label_type).encode()
+        return extract_cifar(filepath, members, label_key)
 
     @staticmethod
     def labels(label_type='fine'):
@@ -276,57 +280,415 @@ class SinCurve(Dataset):
 
 
 class Shakespear(Dataset):
+    """Tiny Shakespeare as next-character pairs.
 
+    The text is encoded byte by byte (it is ASCII): ids number the distinct
+    bytes in order of first appearance, and `vocab[id]` is the byte of an
+    id. The encoded ids are cached on disk and memory-mapped, see
+    `encode_text`.
+    """
     def prepare(self):
         url = 'https://raw.githubusercontent.com/karpathy/char-rnn/master/data/tinyshakespeare/input.txt'
         file_name = 'shakespear.txt'
         path = get_file(url, file_name)
-        with open(path, 'r') as f:
-            data = f.read()
-        chars = list(data)
+        ids, self.vocab = encode_text(path)
+        self.data = ids[:-1]
+        self.label = ids[1:]
+        self.char_to_id = {chr(b): i for i, b in enumerate(self.vocab)}
+        self.id_to_char = {i: chr(b) for i, b in enumerate(self.vocab)}
+        self._lookup = _lookup_table(self.vocab)
+
+    def encode(self, text):
+        """Ids of the characters of `text`."""
+        ids = self._lookup[np.frombuffer(text.encode('latin-1'), np.uint8)]
+        if (ids < 0).any():
+            raise ValueError('characters out of the vocabulary in {!r}'.format(
+                text))
+        return ids.astype(self.vocab.dtype)
+
+    def decode(self, ids):
+        """Text of an array (or list) of ids."""
+        return self.vocab[np.asarray(ids)].tobytes().decode('latin-1')
+
+
+# =============================================================================
+# Streaming datasets: StreamDataset, TokenStream
+# =============================================================================
+class StreamDataset:
+    """Dataset read as a stream, for corpora larger than memory.
+
+    Subclasses implement `chunks(shard, num_shards)`, which yields the raw
+    examples of one of `num_shards` disjoint shards as `(x, t)` arrays of
+    many examples at a time (`t` is None for unlabeled data). Only a chunk
+    and the shuffle buffer are held in memory, whatever the corpus size.
+    `DataLoader` reads one shard per worker; iterating the dataset itself
+    yields single transformed `(x, t)` examples.
+
+    Args:
+        transform (callable): Transform of an example, as in `Dataset`.
+        target_transform (callable): Transform of a label.
+        buffer_size (int): Number of examples in the shuffle buffer; every
+            example read is drawn at random from the last `buffer_size`.
+            0 keeps the order of the stream.
+    """
+    def __init__(self, transform=None, target_transform=None, buffer_size=0):
+        self.transform = transform
+        self.target_transform = target_transform
+        if self.transform is None:
+            self.transform = _identity
+        if self.target_transform is None:
+            self.target_transform = _identity
+        self.buffer_size = buffer_size
+
+    def chunks(self, shard=0, num_shards=1):
+        raise NotImplementedError()
 
-        char_to_id = {}
-        id_to_char = {}
-        for word in data:
-            if word not in char_to_id:
-                new_id = len(char_to_id)
-                char_to_id[word] = new_id
-                id_to_char[new_id] = word
+    def shuffled_chunks(self, shard=0, num_shards=1, rng=None):
+        """`chunks` through the shuffle buffer, drawing with `rng` (a
+        `RandomState`); in stream order if `rng` is None."""
+        if rng is None or self.buffer_size <= 0:
+            yield from self.chunks(shard, num_shards)
+            return
+        xs, ts, count = [], [], 0
+        for x, t in self.chunks(shard, num_shards):
+            xs.append(x)
+            ts.append(t)
+            count += len(x)
+            if count <= self.buffer_size:
+                continue
+            # every example in the buffer is equally likely to go out
+            x, t = _concat(xs), _concat(ts)
+            order = rng.permutation(count)
+            out, keep = order[:count - self.buffer_size], \
+                order[count - self.buffer_size:]
+            yield x[out], None if t is None else t[out]
+            xs, ts = [x[keep]], [None if t is None else t[keep]]
+            count = self.buffer_size
+        if count:
+            x, t = _concat(xs), _concat(ts)
+            order = rng.permutation(count)
+            yield x[order], None if t is None else t[order]
+
+    def batches(self, batch_size, shard=0, num_shards=1, rng=None):
+        """Transformed `(x, t)` batches of `batch_size` examples of a shard;
+        the last one holds the remainder."""
+        xs, ts, count = [], [], 0
+        for x, t in self.shuffled_chunks(shard, num_shards, rng):
+            xs.append(x)
+            ts.append(t)
+            count += len(x)
+            if count < batch_size:
+                continue
+            x, t = _concat(xs), _concat(ts)
+            stop = count - count % batch_size
+            for i in range(0, stop, batch_size):
+                yield self.transform_batch(
+                    x[i:i + batch_size],
+                    None if t is None else t[i:i + batch_size])
+            xs = [x[stop:]]
+            ts = [None if t is None else t[stop:]]
+            count -= stop
+        if count:
+            yield self.transform_batch(_concat(xs), _concat(ts))
+
+    def transform_batch(self, x, t):
+        """Apply the transforms to raw `(x, t)` arrays of examples."""
+        transform = _batch_transform(self.transform)
+        if transform is None:
+            x = np.array([self.transform(example) for example in x])
+        else:
+            x = transform(x)
+        if t is None:
+            return x, np.full(len(x), None)
+        target_transform = _batch_transform(self.target_transform)
+        if target_transform is None:
+            return x, np.array([self.target_transform(label) for label in t])
+        return x, target_transform(t)
+
+    def __iter__(self):
+        rng = np.random if self.buffer_size > 0 else None
+        for x, t in self.shuffled_chunks(rng=rng):
+            for i in range(len(x)):
+                if t is None:
+                    yield self.transform(x[i]), None
+                else:
+                    yield self.transform(x[i]), self.target_transform(t[i])
+
+
+def _concat(arrays):
+    if arrays[0] is None:
+        return None
+    return arrays[0] if len(arrays) == 1 else np.concatenate(arrays)
+
+
+class TokenStream(StreamDataset):
+    """Next-token pairs `(x, t) = (tokens[i], tokens[i + 1])` of a file of
+    raw tokens: the bytes of a text file by default, or pre-encoded ids of
+    any fixed-width `dtype`. The file is read `chunk_size` tokens at a time.
+
+    Shards are contiguous ranges of the file. `SeqDataLoader` reads the
+    stream at `batch_size` offsets through `read`.
+
+    Example:
+        >>> train_set = TokenStream(get_file(url, 'shakespear.txt'))
+        >>> loader = SeqDataLoader(train_set, batch_size=30)
+    """
+    def __init__(self, path, dtype=np.uint8, chunk_size=1 << 16,
+                 transform=None, target_transform=None, buffer_size=0):
+        super().__init__(transform, target_transform, buffer_size)
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.chunk_size = chunk_size
+        self.num_tokens = os.path.getsize(path) // self.dtype.itemsize
 
-        indices = np.array([char_to_id[c] for c in chars])
-        self.data = indices[:-1]
-        self.label = indices[1:]
-        self.char_to_id = char_to_id
-        self.id_to_char = id_to_char
+    def __len__(self):
+        return max(self.num_tokens - 1, 0)
+
+    def _read(self, f, start, stop):
+        itemsize = self.dtype.itemsize
+        f.seek(start * itemsize)
+        return np.frombuffer(f.read((stop - start) * itemsize), self.dtype)
+
+    def chunks(self, shard=0, num_shards=1):
+        n = len(self)
+        start, stop = n * shard // num_shards, n * (shard + 1) // num_shards
+        with open(self.path, 'rb') as f:
+            for i in range(start, stop, self.chunk_size):
+                # one token of overlap: the label of the last pair
+                tokens = self._read(f, i, min(i + self.chunk_size, stop) + 1)
+                yield tokens[:-1], tokens[1:]
+
+    def read(self, start, count):
+        """Raw `(x, t)` of the `count` pairs from `start`, wrapping around
+        the end of the stream."""
+        n = len(self)
+        start %= n
+        with open(self.path, 'rb') as f:
+            pieces = []
+            while count > 0:
+                stop = min(start + count, n)
+                pieces.append(self._read(f, start, stop + 1))
+                count -= stop - start
+                start = 0
+        x = _concat([tokens[:-1] for tokens in pieces])
+        t = _concat([tokens[1:] for tokens in pieces])
+        return x, t
 
 
 # =============================================================================
 # Utils
 # =============================================================================
-def load_cache_npz(filename, train=False):
-    filename = filename[filename.rfind('/') + 1:]
-    prefix = '.train.npz' if train else '.test.npz'
-    filepath = os.path.join(cache_dir, filename + prefix)
-    if not os.path.exists(filepath):
-        return None, None
+def extract_cifar(filepath, members, label_key=b'labels'):
+    """Read the pickled CIFAR batches `members` (base names inside the
+    `.tar.gz` at `filepath`, in the order they are stacked) in a single
+    streaming pass over the archive.
+
+    The images are copied straight into one uint8 buffer allocated when
+    the first batch is read; every batch must hold the same number of
+    images. Returns `(data, label)` with `data` of shape (N, 3, 32, 32).
+    """
+    start = time.perf_counter()
+    print("Extracting: " + os.path.basename(filepath))
+    index = {name: i for i, name in enumerate(members)}
+    data, label = None, None
+    found = set()
+    with tarfile.open(filepath, 'r|gz') as file:
+        for item in file:
+            name = os.path.basename(item.name)
+            if not item.isfile() or name not in index:
+                continue
+            batch = pickle.load(file.extractfile(item), encoding='bytes')
+            x = batch[b'data']
+            n = len(x)
+            if data is None:
+                data = np.empty((n * len(members), 3 * 32 * 32),
+                                dtype=np.uint8)
+                label = np.empty(n * len(members), dtype=int)
+            elif n * len(members) != len(data):
+                raise ValueError('{}: {} has {} images, expected {}'.format(
+                    filepath, name, n, len(data) // len(members)))
+            i = index[name]
+            data[i * n:(i + 1) * n] = x
+            label[i * n:(i + 1) * n] = batch[label_key]
+            found.add(name)
+            if len(found) == len(members):
+                break
+    missing = [name for name in members if name not in found]
+    if missing:
+        raise ValueError('{}: missing {}'.format(filepath, ', '.join(missing)))
+    print(" Done ({:.1f}s)".format(time.perf_counter() - start))
+    return data.reshape(-1, 3, 32, 32), label
+
+
+def build_vocab(filepath, chunk_size=1 << 24):
+    """Distinct bytes of the file at `filepath` as a uint8 array, in order
+    of first appearance; the file is read `chunk_size` bytes at a time."""
+    seen = np.zeros(256, dtype=bool)
+    vocab = []
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            chunk = np.frombuffer(chunk, np.uint8)
+            # counting is linear; only chunks with new bytes are sorted
+            if not (np.bincount(chunk, minlength=256).astype(bool) &
+                    ~seen).any():
+                continue
+            values, first = np.unique(chunk, return_index=True)
+            new = ~seen[values]
+            vocab.extend(values[new][np.argsort(first[new])])
+            seen[values] = True
+    return np.array(vocab, dtype=np.uint8)
+
+
+def _lookup_table(vocab):
+    lookup = np.full(256, -1, dtype=np.int16)
+    lookup[vocab] = np.arange(len(vocab))
+    return lookup
+
+
+def encode_text(filepath, chunk_size=1 << 24, verify=False):
+    """Encode the bytes of the file at `filepath` with the ids of
+    `build_vocab`. Returns `(ids, vocab)` as uint8 arrays.
+
+    The ids are encoded a chunk at a time through a lookup table into a
+    raw `.npy` in the cache directory, then opened memory-mapped like
+    `load_cache`; the cache is rebuilt when the file changes.
+    """
+    cachepath = os.path.join(cache_dir, os.path.basename(filepath))
+    stat = os.stat(filepath)
+    source = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    arrays, meta = _load_arrays(cachepath, ('ids', 'vocab'), verify)
+    if arrays is not None and meta.get('source') == source:
+        return arrays
+
+    start = time.perf_counter()
+    print("Encoding: " + os.path.basename(filepath))
+    try:
+        vocab = build_vocab(filepath, chunk_size)
+        lookup = _lookup_table(vocab).astype(np.uint8)
+        path = cachepath + '.ids.npy'
+        if not os.path.exists(cache_dir):
+            os.mkdir(cache_dir)
+        ids = np.lib.format.open_memmap(path + '.tmp', mode='w+',
+                                        dtype=np.uint8,
+                                        shape=(stat.st_size,))
+        with open(filepath, 'rb') as f:
+            for i in range(0, stat.st_size, chunk_size):
+                chunk = np.frombuffer(f.read(chunk_size), np.uint8)
+                ids[i:i + len(chunk)] = lookup[chunk]
+        ids.flush()
+        del ids
+        os.replace(path + '.tmp', path)
+        meta = {'ids': _array_info(path),
+                'vocab': _save_array(cachepath + '.vocab.npy', vocab),
+                'source': source}
+        _save_meta(cachepath, meta)
+    except (Exception, KeyboardInterrupt) as e:
+        _remove_partial(cachepath, ('ids', 'vocab'))
+        raise
+    print(" Done ({:.1f}s)".format(time.perf_counter() - start))
+    arrays, _ = _load_arrays(cachepath, ('ids', 'vocab'))
+    return arrays
 
-    loaded = np.load(filepath)
-    return loaded['data'], loaded['label']
 
-def save_cache_npz(data, label, filename, train=False):
+def _cache_path(filename, train):
     filename = filename[filename.rfind('/') + 1:]
-    prefix = '.train.npz' if train else '.test.npz'
-    filepath = os.path.join(cache_dir, filename + prefix)
-
-    if os.path.exists(filepath):
-        return
-
-    print("Saving: " + filename + prefix)
+    prefix = '.train' if train else '.test'
+    return os.path.join(cache_dir, filename + prefix)
+
+
+def _checksum(filepath, chunk_size=1 << 22):
+    crc = 0
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def load_cache(filename, train=False, verify=False):
+    """Open the cached `(data, label)` arrays of `filename` (a dataset URL).
+
+    The arrays are read-only memory maps of raw `.npy` files, so opening
+    the cache reads nothing but the headers, and processes forked from
+    this one (e.g. `DataLoader` workers) share the same pages. The CRC32
+    checksums in the `.json` sidecar are recomputed whenever a file's size
+    or modification time differs from the ones recorded with it, or always
+    with `verify=True`. Returns `(None, None)` if the cache is missing or
+    does not match its sidecar.
+    """
+    arrays, _ = _load_arrays(_cache_path(filename, train), ('data', 'label'),
+                             verify)
+    return (None, None) if arrays is None else arrays
+
+
+def save_cache(data, label, filename, train=False):
+    """Write `data` and `label` as raw `.npy` files in their own dtype plus
+    a `.json` sidecar with their shapes, dtypes and checksums.
+
+    Every file goes through a temporary name and the sidecar is written
+    last, so an interrupted save never leaves a cache that loads.
+    """
+    filepath = _cache_path(filename, train)
+    print("Saving: " + os.path.basename(filepath))
     try:
-        np.savez_compressed(filepath, data=data, label=label)
+        meta = {key: _save_array('{}.{}.npy'.format(filepath, key), array)
+                for key, array in (('data', data), ('label', label))}
+        _save_meta(filepath, meta)
     except (Exception, KeyboardInterrupt) as e:
-        if os.path.exists(filepath):
-            os.remove(filepath)
+        _remove_partial(filepath, ('data', 'label'))
         raise
     print(" Done")
     return filepath
+
+
+def _load_arrays(filepath, keys, verify=False):
+    # memory maps of `filepath.<key>.npy` and the sidecar, or (None, None)
+    try:
+        with open(filepath + '.json', 'r') as f:
+            meta = json.load(f)
+        arrays = []
+        for key in keys:
+            path = '{}.{}.npy'.format(filepath, key)
+            info = meta[key]
+            stat = os.stat(path)
+            if verify or stat.st_size != info['size'] or \
+                    stat.st_mtime_ns != info['mtime_ns']:
+                if _checksum(path) != info['crc32']:
+                    return None, None
+            array = np.load(path, mmap_mode='r')
+            if list(array.shape) != info['shape'] or \
+                    array.dtype.str != info['dtype']:
+                return None, None
+            arrays.append(array)
+    except (OSError, ValueError, KeyError):
+        return None, None
+    return tuple(arrays), meta
+
+
+def _save_array(path, array):
+    if not os.path.exists(cache_dir):
+        os.mkdir(cache_dir)
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, np.ascontiguousarray(array))
+    os.replace(path + '.tmp', path)
+    return _array_info(path)
+
+
+def _array_info(path):
+    array = np.load(path, mmap_mode='r')
+    stat = os.stat(path)
+    return {'shape': list(array.shape), 'dtype': array.dtype.str,
+            'crc32': _checksum(path), 'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns}
+
+
+def _save_meta(filepath, meta):
+    with open(filepath + '.json.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(filepath + '.json.tmp', filepath + '.json')
+
+
+def _remove_partial(filepath, keys):
+    for path in ['{}.{}.npy.tmp'.format(filepath, key) for key in keys] + \
+            [filepath + '.json.tmp']:
+        if os.path.exists(path):
+            os.remove(path)
@@ -1,13 +1,15 @@
 import numpy as np
 import dezero
 from dezero import cuda, utils
-from dezero.core import Function, Variable, as_variable, as_array
+from dezero.core import Function, Variable, MetaArray, as_variable, as_array
 
 
 # =============================================================================
 # Basic functions: sin / cos / tanh / exp / log
 # =============================================================================
 class Sin(Function):
+    elementwise = True
+
     def forward(self, x):
         xp = cuda.get_array_module(x)
         y = xp.sin(x)
@@ -24,6 +26,8 @@ def sin(x):
 
 
 class Cos(Function):
+    elementwise = True
+
     def forward(self, x):
         xp = cuda.get_array_module(x)
         y = xp.cos(x)
@@ -40,6 +44,8 @@ def cos(x):
 
 
 class Tanh(Function):
+    elementwise = True
+
     def forward(self, x):
         xp = cuda.get_array_module(x)
         y = xp.tanh(x)
@@ -56,6 +62,8 @@ def tanh(x):
 
 
 class Exp(Function):
+    elementwise = True
+
     def forward(self, x):
         xp = cuda.get_array_module(x)
         y = xp.exp(x)
@@ -72,6 +80,8 @@ def exp(x):
 
 
 class Log(Function):
+    elementwise = True
+
     def forward(self, x):
         xp = cuda.get_array_module(x)
         y = xp.log(x)
@@ -91,6 +101,8 @@ def log(x):
 # Tensor operations: reshape / transpose / get_item / expand_dims / flatten
 # =============================================================================
 class Reshape(Function):
+    view = True
+
     def __init__(self, shape):
         self.shape = shape
 
@@ -99,6 +111,13 @@ class Reshape(Function):
         y = x.reshape(self.shape)
         return y
 
+    def forward_meta(self, x):
+        shape = self.shape
+        if -1 in shape:
+            known = -int(np.prod(shape))
+            shape = tuple(x.size // known if s == -1 else s for s in shape)
+        return MetaArray(shape, x.dtype)
+
     def backward(self, gy):
         return reshape(gy, self.x_shape)
 
@@ -110,6 +129,8 @@ def reshape(x, shape):
 
 
 class Transpose(Function):
+    view = True
+
     def __init__(self, axes=None):
         self.axes = axes
 
@@ -117,6 +138,10 @@ class Transpose(Function):
         y = x.transpose(self.axes)
         return y
 
+    def forward_meta(self, x):
+        axes = self.axes or tuple(range(x.ndim))[::-1]
+        return MetaArray([x.shape[ax] for ax in axes], x.dtype)
+
     def backward(self, gy):
         if self.axes is None:
             return transpose(gy)
@@ -193,6 +218,22 @@ class Sum(Function):
         y = x.sum(axis=self.axis, keepdims=self.keepdims)
         return y
 
+    def forward_meta(self, x):
+        axis = self.axis
+        if axis is None:
+            axis = tuple(range(x.ndim))
+        elif not isinstance(axis, tuple):
+            axis = (axis,)
+        axis = [ax % x.ndim for ax in axis]
+        if self.keepdims:
+            shape = [1 if i in axis else s for i, s in enumerate(x.shape)]
+        else:
+            shape = [s for i, s in enumerate(x.shape) if i not in axis]
+        return MetaArray(shape, x.dtype)
+
+    def flops(self, xs, ys):
+        return xs[0].size
+
     def backward(self, gy):
         gy = utils.reshape_sum_backward(gy, self.x_shape, self.axis,
                                         self.keepdims)
@@ -213,6 +254,9 @@ class SumTo(Function):
         y = utils.sum_to(x, self.shape)
         return y
 
+    def forward_meta(self, x):
+        return MetaArray(self.shape, x.dtype)
+
     def backward(self, gy):
         gx = broadcast_to(gy, self.x_shape)
         return gx
@@ -225,6 +269,8 @@ def sum_to(x, shape):
 
 
 class BroadcastTo(Function):
+    view = True
+
     def __init__(self, shape):
         self.shape = shape
 
@@ -234,6 +280,9 @@ class BroadcastTo(Function):
         y = xp.broadcast_to(x, self.shape)
         return y
 
+    def forward_meta(self, x):
+        return MetaArray(self.shape, x.dtype)
+
     def backward(self, gy):
         gx = sum_to(gy, self.x_shape)
         return gx
@@ -259,6 +308,15 @@ class MatMul(Function):
         y = x.dot(W)
         return y
 
+    def forward_meta(self, x, W):
+        if x.ndim < 2 or W.ndim != 2:
+            return super().forward_meta(x, W)
+        return MetaArray(x.shape[:-1] + W.shape[1:],
+                         np.result_type(x.dtype, W.dtype))
+
+    def flops(self, xs, ys):
+        return 2 * ys[0].size * xs[1].shape[0]
+
     def backward(self, gy):
         x, W = self.inputs
         gx = matmul(gy, W.T)
@@ -277,6 +335,14 @@ class Linear(Function):
             y += b
         return y
 
+    def forward_meta(self, x, W, b):
+        return MetaArray(x.shape[:-1] + W.shape[1:],
+                         np.result_type(x.dtype, W.dtype))
+
+    def flops(self, xs, ys):
+        x, W, b = xs
+        return ys[0].size * (2 * W.shape[0] + (b is not None))
+
     def backward(self, gy):
         x, W, b = self.inputs
         gb = None if b.data is None else sum_to(gy, b.shape)
@@ -309,6 +375,8 @@ def sigmoid_simple(x):
 
 
 class Sigmoid(Function):
+    elementwise = True
+
     def forward(self, x):
         xp = cuda.get_array_module(x)
         # y = 1 / (1 + xp.exp(-x))
@@ -326,6 +394,8 @@ def sigmoid(x):
 
 
 class ReLU(Function):
+    elementwise = True
+
     def forward(self, x):
         xp = cuda.get_array_module(x)
         y = xp.maximum(x, 0.0)
@@ -360,6 +430,10 @@ class Softmax(Function):
         y /= y.sum(axis=self.axis, keepdims=True)
         return y
 
+    def flops(self, xs, ys):
+        # max, subtract, exp, sum and divide
+        return 5 * xs[0].size
+
     def backward(self, gy):
         y = self.outputs[0]()
         gx = y * gy
@@ -381,6 +455,9 @@ class LogSoftmax(Function):
         y = x - log_z
         return y
 
+    def flops(self, xs, ys):
+        return 5 * xs[0].size
+
     def backward(self, gy):
         y = self.outputs[0]()
         gx = gy - exp(y) * gy.sum(axis=self.axis, keepdims=True)
@@ -392,6 +469,8 @@ def log_softmax(x, axis=1):
 
 
 class LeakyReLU(Function):
+    elementwise = True
+
     def __init__(self, slope):
         self.slope = slope
 
@@ -412,6 +491,136 @@ def leaky_relu(x, slope=0.2):
     return LeakyReLU(slope)(x)
 
 
+# =============================================================================
+# lstm
+# =============================================================================
+class LSTM(Function):
+    """A whole sequence of LSTM steps as one graph node.
+
+    The gates are laid out as `[f, i, o, u]` along the last axis of `W_x`
+    (I, 4H), `W_h` (H, 4H) and `b` (4H,), in the order of `layers.LSTM`.
+    """
+    def forward(self, x, W_x, W_h, b, *state):
+        xp = cuda.get_array_module(x)
+        T, N, _ = x.shape
+        H = W_h.shape[0]
+        h, c = state if state else (None, None)
+
+        # all input projections in one matmul
+        gates = xp.dot(x.reshape(T * N, -1), W_x).reshape(T, N, 4 * H)
+        gates += b
+        hs = xp.empty((T, N, H), dtype=gates.dtype)
+        cs = xp.empty((T, N, H), dtype=gates.dtype)
+        tcs = xp.empty((T, N, H), dtype=gates.dtype)
+
+        for t in range(T):
+            a = gates[t]
+            if h is not None:
+                a += xp.dot(h, W_h)
+            sig = a[:, :3 * H]
+            xp.tanh(sig * 0.5, out=sig)
+            sig *= 0.5
+            sig += 0.5
+            xp.tanh(a[:, 3 * H:], out=a[:, 3 * H:])
+            f, i, o, u = (a[:, k * H:(k + 1) * H] for k in range(4))
+
+            c_new = cs[t]
+            xp.multiply(i, u, out=c_new)
+            if c is not None:
+                c_new += f * c
+            xp.tanh(c_new, out=tcs[t])
+            xp.multiply(o, tcs[t], out=hs[t])
+            h, c = hs[t], c_new
+
+        self.gates, self.hs, self.cs, self.tcs = gates, hs, cs, tcs
+        return hs, h.copy(), c.copy()
+
+    def forward_meta(self, x, W_x, W_h, b, *state):
+        T, N, _ = x.shape
+        H = W_h.shape[0]
+        return (MetaArray((T, N, H), x.dtype), MetaArray((N, H), x.dtype),
+                MetaArray((N, H), x.dtype))
+
+    def backward(self, ghs, gh, gc):
+        # outputs that were not used get a scalar zero gradient
+        xp = cuda.get_array_module(self.hs)
+        zero = xp.zeros((), dtype=self.hs.dtype)
+        return tuple(LSTMGrad(self)(*(g if g is not None else zero
+                                      for g in (ghs, gh, gc))))
+
+    def flops(self, xs, ys):
+        x, W_x, W_h = xs[:3]
+        T, N, _ = x.shape
+        return 2 * T * N * (W_x.size + W_h.size) + 16 * ys[0].size
+
+
+class LSTMGrad(Function):
+    """Hand-written backpropagation through time of `LSTM`."""
+    def __init__(self, lstm):
+        self.lstm = lstm
+
+    def forward(self, ghs, gh, gc):
+        lstm = self.lstm
+        x, W_x, W_h, b = (v.data for v in lstm.inputs[:4])
+        state = [v.data for v in lstm.inputs[4:]]
+        gates, hs, cs, tcs = lstm.gates, lstm.hs, lstm.cs, lstm.tcs
+        xp = cuda.get_array_module(x)
+        T, N, I = x.shape
+        H = W_h.shape[0]
+
+        gates_grad = xp.empty_like(gates)
+        dh = xp.zeros((N, H), dtype=gates.dtype) + gh
+        dc = xp.zeros((N, H), dtype=gates.dtype) + gc
+        for t in reversed(range(T)):
+            dh += ghs[t] if ghs.ndim else ghs
+            f, i, o, u = (gates[t, :, k * H:(k + 1) * H] for k in range(4))
+            df, di, do, du = (gates_grad[t, :, k * H:(k + 1) * H]
+                              for k in range(4))
+            tc = tcs[t]
+
+            xp.multiply(dh, tc, out=do)
+            dc += dh * o * (1 - tc * tc)
+            c_prev = cs[t - 1] if t > 0 else (state[1] if state else None)
+            if c_prev is None:
+                df[...] = 0
+            else:
+                xp.multiply(dc, c_prev, out=df)
+            xp.multiply(dc, u, out=di)
+            xp.multiply(dc, i, out=du)
+            dc *= f
+
+            # through the gate activations
+            sig = gates_grad[t, :, :3 * H]
+            sig *= gates[t, :, :3 * H] * (1 - gates[t, :, :3 * H])
+            du *= 1 - u * u
+            if t > 0 or state:
+                dh = xp.dot(gates_grad[t], W_h.T)
+
+        gates_flat = gates_grad.reshape(T * N, 4 * H)
+        gx = xp.dot(gates_flat, W_x.T).reshape(T, N, I)
+        gW_x = xp.dot(x.reshape(T * N, I).T, gates_flat)
+        gb = gates_flat.sum(axis=0)
+        if state:
+            h_prev = xp.concatenate([state[0][None], hs[:-1]])
+            gW_h = xp.dot(h_prev.reshape(T * N, H).T, gates_flat)
+            return gx, gW_x, gW_h, gb, dh, dc
+        gW_h = xp.dot(hs[:-1].reshape((T - 1) * N, H).T,
+                      gates_flat[N:])
+        return gx, gW_x, gW_h, gb
+
+
+def lstm(x, W_x, W_h, b, h=None, c=None):
+    """LSTM over a whole (T, N, I) sequence.
+
+    Returns the hidden states of all steps (T, N, H) and the last hidden
+    and cell states (N, H). Without `h` and `c` the sequence starts from
+    zero states.
+    """
+    if h is None:
+        return LSTM()(x, W_x, W_h, b)
+    return LSTM()(x, W_x, W_h, b, h, c)
+
+
 # =============================================================================
 # loss function: mean_squared_error / softmax_cross_entropy / sigmoid_cross_entropy / binary_cross_entropy
 # =============================================================================
@@ -428,6 +637,9 @@ class MeanSquaredError(Function):
         y = (diff ** 2).sum() / len(diff)
         return y
 
+    def flops(self, xs, ys):
+        return 3 * xs[0].size
+
     def backward(self, gy):
         x0, x1 = self.inputs
         diff = x0 - x1
@@ -460,6 +672,9 @@ class SoftmaxCrossEntropy(Function):
         y = -log_p.sum() / np.float32(N)
         return y
 
+    def flops(self, xs, ys):
+        return 5 * xs[0].size
+
     def backward(self, gy):
         x, t = self.inputs
         N, CLS_NUM = x.shape
@@ -570,6 +785,13 @@ class BatchNorm(Function):
             y = y.reshape(N, H, W, C).transpose(0, 3, 1, 2)
         return y
 
+    def forward_meta(self, x, gamma, beta):
+        return MetaArray(x.shape, x.dtype)
+
+    def flops(self, xs, ys):
+        # normalize, scale and shift; training adds the mean/var passes
+        return xs[0].size * (8 if dezero.Config.train else 4)
+
     def backward(self, gy):
         gy_ndim = gy.ndim
         if gy_ndim == 4:
@@ -615,6 +837,9 @@ class Max(Function):
         y = x.max(axis=self.axis, keepdims=self.keepdims)
         return y
 
+    def flops(self, xs, ys):
+        return xs[0].size
+
     def backward(self, gy):
         x = self.inputs[0]
         y = self.outputs[0]()  # weakref
@@ -642,6 +867,8 @@ def min(x, axis=None, keepdims=False):
 
 
 class Clip(Function):
+    elementwise = True
+
     def __init__(self, x_min, x_max):
         self.x_min = x_min
         self.x_max = x_max
@@ -665,6 +892,7 @@ def clip(x, x_min, x_max):
 # conv2d / col2im / im2col / basic_math
 # =============================================================================
 from dezero.functions_conv import conv2d
+from dezero.functions_conv import conv2d_relu
 from dezero.functions_conv import deconv2d
 from dezero.functions_conv import conv2d_simple
 from dezero.functions_conv import im2col
@@ -1,8 +1,10 @@
+import time
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from dezero import cuda
-from dezero.core import Function, as_variable
+from dezero.core import Function, Config, MetaArray, as_variable
 from dezero.utils import pair, get_conv_outsize, get_deconv_outsize
-from dezero.functions import linear, broadcast_to
+from dezero.functions import linear, broadcast_to, reshape
 
 
 # =============================================================================
@@ -47,16 +49,72 @@ def pooling_simple(x, kernel_size, stride=1, pad=0):
 #  conv2d / deconv2d
 # =============================================================================
 class Conv2d(Function):
-    def __init__(self, stride=1, pad=0):
+    def __init__(self, stride=1, pad=0, groups=1, keep_col=None, dilate=1):
         super().__init__()
         self.stride = pair(stride)
         self.pad = pair(pad)
+        self.dilate = pair(dilate)
+        self.groups = groups
+        self.keep_col = keep_col
+        self.col = None
+        self.col_stats = None
+
+    def forward_meta(self, x, W, b):
+        N, C, H, W_ = x.shape
+        OC, _, KH, KW = W.shape
+        (SH, SW), (PH, PW) = self.stride, self.pad
+        DH, DW = self.dilate
+        OH = get_conv_outsize(H, (KH - 1) * DH + 1, SH, PH)
+        OW = get_conv_outsize(W_, (KW - 1) * DW + 1, SW, PW)
+        return MetaArray((N, OC, OH, OW), x.dtype)
+
+    def flops(self, xs, ys):
+        x, W, b = xs
+        # one multiply-add per filter tap and output, plus the bias
+        return ys[0].size * (2 * W.size // W.shape[0] + (b is not None))
 
     def forward(self, x, W, b):
+        N, C, H, W_ = x.shape
+        KH, KW = W.shape[2:]
+        (SH, SW), (PH, PW) = self.stride, self.pad
+        DH, DW = self.dilate
+        OH = get_conv_outsize(H, (KH - 1) * DH + 1, SH, PH)
+        OW = get_conv_outsize(W_, (KW - 1) * DW + 1, SW, PW)
+        nbytes = N * C * KH * KW * OH * OW * x.dtype.itemsize
+
+        keep = self.keep_col
+        if keep is None:
+            keep = nbytes <= Config.conv_col_budget
+        # The col is only kept when it is built in one piece.
+        keep = (keep and Config.enable_backprop and self.groups == 1
+                and _batch_workers(x) == 1)
+        self.col_stats = {'bytes': nbytes, 'kept': keep,
+                          'forward_seconds': 0., 'backward_seconds': 0.}
+        self.keep_col = keep
+        # each batch chunk appends its im2col time; summed here, since the
+        # chunks may run on several threads
+        self._col_seconds = []
+        y = _parallel_over_batch(self._forward, (x,), (W, b))
+        self.col_stats['forward_seconds'] = sum(self._col_seconds)
+        return y
+
+    def _forward(self, x, W, b):
         xp = cuda.get_array_module(x)
 
+        if self.groups > 1:
+            y = _grouped_conv2d_array(x, W, self.stride, self.pad,
+                                      self.dilate, self.groups)
+            if b is not None:
+                y += b.reshape((1, b.size, 1, 1))
+            return y
+
         KH, KW = W.shape[2:]
-        col = im2col_array(x, (KH, KW), self.stride, self.pad, to_matrix=False)
+        start = time.perf_counter()
+        col = im2col_array(x, (KH, KW), self.stride, self.pad,
+                           to_matrix=False, dilate=self.dilate)
+        self._col_seconds.append(time.perf_counter() - start)
+        if self.keep_col:
+            self.col = col
 
         y = xp.tensordot(col, W, ((1, 2, 3), (1, 2, 3)))
         if b is not None:
@@ -69,7 +127,8 @@ class Conv2d(Function):
         x, W, b = self.inputs
         # ==== gx ====
         gx = deconv2d(gy, W, b=None, stride=self.stride, pad=self.pad,
-                      outsize=(x.shape[2], x.shape[3]))
+                      outsize=(x.shape[2], x.shape[3]), dilate=self.dilate,
+                      groups=self.groups)
         # ==== gW ====
         gW = Conv2DGradW(self)(x, gy)
         # ==== gb ====
@@ -79,36 +138,111 @@ class Conv2d(Function):
         return gx, gW, gb
 
 
-def conv2d(x, W, b=None, stride=1, pad=0):
-    return Conv2d(stride, pad)(x, W, b)
+def conv2d(x, W, b=None, stride=1, pad=0, groups=1, keep_col=None,
+           dilate=1):
+    """Two-dimensional convolution.
+
+    Args:
+        x (`dezero.Variable` or `ndarray`): Input of shape `(N, C, H, W)`.
+        W (`dezero.Variable` or `ndarray`): Filters of shape
+            `(OC, C // groups, KH, KW)`.
+        b (`dezero.Variable` or `ndarray` or None): Bias of shape `(OC,)`.
+        stride (int or (int, int)): Stride of filter applications.
+        pad (int or (int, int)): Spatial padding width for input arrays.
+        groups (int): Number of groups the input and output channels are
+            split into. Group `g` of the output only sees group `g` of the
+            input. `groups == C` gives a depthwise convolution.
+        keep_col (bool or None): If True, the im2col buffer built in forward
+            is kept for the weight gradient instead of being rebuilt in
+            backward. If None, it is kept when its size in bytes is within
+            `Config.conv_col_budget`.
+        dilate (int or (int, int)): Dilation factor of filter applications.
+            The filter taps sample the input `dilate` pixels apart, without
+            building an enlarged zero-filled filter.
+
+    Returns:
+        `dezero.Variable`: Output of shape `(N, OC, OH, OW)`. Its creator's
+            `col_stats` dict reports the im2col buffer size (`bytes`),
+            whether it was kept (`kept`), and the seconds spent building it
+            in forward and backward.
+    """
+    return Conv2d(stride, pad, groups, keep_col, dilate)(x, W, b)
+
+
+class Conv2dReLU(Conv2d):
+    """Conv2d followed by ReLU, applied in place on the conv output."""
+    def _forward(self, x, W, b):
+        xp = cuda.get_array_module(x)
+        y = super()._forward(x, W, b)
+        xp.maximum(y, 0, out=y)
+        return y
+
+    def backward(self, gy):
+        y = self.outputs[0]()  # weakref
+        gy = gy * (y.data > 0)
+        return super().backward(gy)
+
+
+def conv2d_relu(x, W, b=None, stride=1, pad=0, groups=1, keep_col=None,
+                dilate=1):
+    return Conv2dReLU(stride, pad, groups, keep_col, dilate)(x, W, b)
 
 
 class Deconv2d(Function):
-    def __init__(self, stride=1, pad=0, outsize=None):
+    def __init__(self, stride=1, pad=0, outsize=None, groups=1, dilate=1):
         super().__init__()
         self.stride = pair(stride)
         self.pad = pair(pad)
         self.outsize = outsize
+        self.dilate = pair(dilate)
+        self.groups = groups
+
+    def forward_meta(self, x, W, b):
+        N, C, H, W_ = x.shape
+        _, OC, KH, KW = W.shape
+        if self.outsize is None:
+            (SH, SW), (PH, PW) = self.stride, self.pad
+            DH, DW = self.dilate
+            out_h = get_deconv_outsize(H, (KH - 1) * DH + 1, SH, PH)
+            out_w = get_deconv_outsize(W_, (KW - 1) * DW + 1, SW, PW)
+        else:
+            out_h, out_w = pair(self.outsize)
+        return MetaArray((N, OC * self.groups, out_h, out_w), x.dtype)
+
+    def flops(self, xs, ys):
+        x, W, b = xs
+        # every input value is scattered to OC/G*KH*KW outputs
+        bias = ys[0].size if b is not None else 0
+        return 2 * x.size * (W.size // W.shape[0]) + bias
 
     def forward(self, x, W, b):
+        return _parallel_over_batch(self._forward, (x,), (W, b))
+
+    def _forward(self, x, W, b):
         xp = cuda.get_array_module(x)
 
         Weight = W
         SH, SW = self.stride
         PH, PW = self.pad
+        DH, DW = self.dilate
         C, OC, KH, KW = Weight.shape
+        OC *= self.groups
         N, C, H, W = x.shape
         if self.outsize is None:
-            out_h = get_deconv_outsize(H, KH, SH, PH)
-            out_w = get_deconv_outsize(W, KW, SW, PW)
+            out_h = get_deconv_outsize(H, (KH - 1) * DH + 1, SH, PH)
+            out_w = get_deconv_outsize(W, (KW - 1) * DW + 1, SW, PW)
         else:
             out_h, out_w = pair(self.outsize)
         img_shape = (N, OC, out_h, out_w)
 
-        gcol = xp.tensordot(Weight, x, (0, 1))
-        gcol = xp.rollaxis(gcol, 3)
-        y = col2im_array(gcol, img_shape, (KH, KW), self.stride, self.pad,
-                         to_matrix=False)
+        if self.groups > 1:
+            y = _grouped_deconv2d_array(x, Weight, img_shape, self.stride,
+                                        self.pad, self.dilate, self.groups)
+        else:
+            gcol = xp.tensordot(Weight, x, (0, 1))
+            gcol = xp.rollaxis(gcol, 3)
+            y = col2im_array(gcol, img_shape, (KH, KW), self.stride,
+                             self.pad, to_matrix=False, dilate=self.dilate)
         # b, k, h, w
         if b is not None:
             self.no_bias = True
@@ -119,7 +253,8 @@ class Deconv2d(Function):
         x, W, b = self.inputs
 
         # ==== gx ====
-        gx = conv2d(gy, W, b=None, stride=self.stride, pad=self.pad)
+        gx = conv2d(gy, W, b=None, stride=self.stride, pad=self.pad,
+                    dilate=self.dilate, groups=self.groups)
         # ==== gW ====
         f = Conv2DGradW(self)
         gW = f(gy, x)
@@ -130,8 +265,14 @@ class Deconv2d(Function):
         return gx, gW, gb
 
 
-def deconv2d(x, W, b=None, stride=1, pad=0, outsize=None):
-    return Deconv2d(stride, pad, outsize)(x, W, b)
+def deconv2d(x, W, b=None, stride=1, pad=0, outsize=None, groups=1,
+             dilate=1):
+    """Two-dimensional deconvolution (transposed convolution).
+
+    `W` has shape `(C, OC // groups, KH, KW)`; see `conv2d` for `dilate`
+    and `groups`.
+    """
+    return Deconv2d(stride, pad, outsize, groups, dilate)(x, W, b)
 
 
 class Conv2DGradW(Function):
@@ -141,12 +282,36 @@ class Conv2DGradW(Function):
         self.kernel_size = (kh, kw)
         self.stride = conv2d.stride
         self.pad = conv2d.pad
+        self.dilate = conv2d.dilate
+        self.groups = conv2d.groups
+        # Take over the forward im2col buffer, if Conv2d kept one.
+        self.col = getattr(conv2d, 'col', None)
+        conv2d.col = None
+        self.col_stats = getattr(conv2d, 'col_stats', None) or {}
+        self.col_stats.setdefault('backward_seconds', 0.)
 
     def forward(self, x, gy):
+        if self.col is not None:
+            col, self.col = self.col, None
+            xp = cuda.get_array_module(gy)
+            return xp.tensordot(gy, col, ((0, 2, 3), (0, 4, 5)))
+        self._col_seconds = []
+        gW = _parallel_over_batch(self._forward, (x, gy), reduce=True)
+        self.col_stats['backward_seconds'] += sum(self._col_seconds)
+        return gW
+
+    def _forward(self, x, gy):
         xp = cuda.get_array_module(x)
 
+        if self.groups > 1:
+            return _grouped_conv2d_grad_w_array(x, gy, self.kernel_size,
+                                                self.stride, self.pad,
+                                                self.dilate, self.groups)
+
+        start = time.perf_counter()
         col = im2col_array(x, self.kernel_size, self.stride, self.pad,
-                           to_matrix=False)
+                           to_matrix=False, dilate=self.dilate)
+        self._col_seconds.append(time.perf_counter() - start)
         gW = xp.tensordot(gy, col, ((0, 2, 3), (0, 4, 5)))
         return gW
 
@@ -156,11 +321,54 @@ class Conv2DGradW(Function):
 
         xh, xw = x.shape[2:]
         gx = deconv2d(gy, gW, stride=self.stride, pad=self.pad,
-                      outsize=(xh, xw))
-        ggy = conv2d(x, gW, stride=self.stride, pad=self.pad)
+                      outsize=(xh, xw), dilate=self.dilate, groups=self.groups)
+        ggy = conv2d(x, gW, stride=self.stride, pad=self.pad,
+                     dilate=self.dilate, groups=self.groups)
         return gx, ggy
 
 
+_executor = (0, None)
+
+
+def _batch_workers(x):
+    if cuda.get_array_module(x) is not np:
+        return 1
+    return max(min(Config.conv_workers, len(x)), 1)
+
+
+def _parallel_over_batch(f, xs, args=(), reduce=False):
+    """Evaluate `f(*xs, *args)` with the arrays in `xs` split along the batch
+    axis over `Config.conv_workers` threads.
+
+    NumPy releases the GIL inside `tensordot` and the im2col/col2im copies,
+    so the chunks run concurrently on a many-core CPU. The partial results
+    are concatenated along the batch axis, or summed if `reduce` is True (as
+    for the weight gradient). CuPy arrays and `conv_workers <= 1` call `f`
+    directly.
+    """
+    global _executor
+    x = xs[0]
+    workers = _batch_workers(x)
+    if workers == 1:
+        return f(*xs, *args)
+
+    if _executor[0] != workers:
+        if _executor[1] is not None:
+            _executor[1].shutdown(wait=False)
+        _executor = (workers, ThreadPoolExecutor(max_workers=workers))
+
+    bounds = np.linspace(0, len(x), workers + 1).astype(int)
+    futures = [_executor[1].submit(f, *[a[lo:hi] for a in xs], *args)
+               for lo, hi in zip(bounds[:-1], bounds[1:])]
+    ys = [future.result() for future in futures]
+    if reduce:
+        y = ys[0]
+        for partial in ys[1:]:
+            y += partial
+        return y
+    return np.concatenate(ys)
+
+
 # =============================================================================
 #  pooling(max-pooling) / average_pooling
 # =============================================================================
@@ -171,7 +379,19 @@ class Pooling(Function):
         self.stride = stride
         self.pad = pad
 
+    def forward_meta(self, x):
+        return MetaArray(_pooling_outshape(x.shape, self.kernel_size,
+                                           self.stride, self.pad), x.dtype)
+
+    def flops(self, xs, ys):
+        KH, KW = pair(self.kernel_size)
+        return ys[0].size * KH * KW
+
     def forward(self, x):
+        if _is_nonoverlapping(x.shape, self.kernel_size, self.stride,
+                              self.pad):
+            return self._forward_nonoverlapping(x)
+
         col = im2col_array(x, self.kernel_size, self.stride, self.pad,
                            to_matrix=False)
 
@@ -181,6 +401,25 @@ class Pooling(Function):
         y = col.max(axis=2)
         return y
 
+    def _forward_nonoverlapping(self, x):
+        xp = cuda.get_array_module(x)
+        windows = _nonoverlapping_windows(x, self.kernel_size, self.stride)
+        _, y = next(windows)
+        y = y.copy()
+        if not Config.enable_backprop:
+            for _, window in windows:
+                xp.maximum(y, window, out=y)
+            return y
+
+        # Strict `>` keeps the first maximum, as `argmax` does.
+        self.indexes = xp.zeros(y.shape, dtype=np.intp)
+        mask = xp.empty(y.shape, dtype=bool)
+        for k, window in windows:
+            xp.greater(window, y, out=mask)
+            xp.copyto(self.indexes, k, where=mask)
+            xp.maximum(y, window, out=y)
+        return y
+
     def backward(self, gy):
         return Pooling2DGrad(self)(gy)
 
@@ -202,6 +441,21 @@ class Pooling2DGrad(Function):
         N, C, H, W = self.input_shape
         KH, KW = pair(self.kernel_size)
 
+        if _is_nonoverlapping(self.input_shape, self.kernel_size, self.stride,
+                              self.pad):
+            # Every element is written below unless the windows leave a
+            # border uncovered, so zero-filling is only needed in that case.
+            if (OH * KH, OW * KW) == (H, W):
+                gx = xp.empty(self.input_shape, dtype=self.dtype)
+            else:
+                gx = xp.zeros(self.input_shape, dtype=self.dtype)
+            mask = xp.empty(gy.shape, dtype=bool)
+            for k, window in _nonoverlapping_windows(gx, self.kernel_size,
+                                                     self.stride):
+                xp.equal(self.indexes, k, out=mask)
+                xp.multiply(gy, mask, out=window)
+            return gx
+
         gcol = xp.zeros((N * C * OH * OW * KH * KW), dtype=self.dtype)
 
         indexes = (self.indexes.ravel()
@@ -231,6 +485,17 @@ class Pooling2DWithIndexes(Function):
         self.indexes = mpool2d.indexes
 
     def forward(self, x):
+        if _is_nonoverlapping(x.shape, self.kernel_size, self.stride,
+                              self.pad):
+            xp = cuda.get_array_module(x)
+            y = xp.empty(self.indexes.shape, dtype=x.dtype)
+            mask = xp.empty(y.shape, dtype=bool)
+            for k, window in _nonoverlapping_windows(x, self.kernel_size,
+                                                     self.stride):
+                xp.equal(self.indexes, k, out=mask)
+                xp.copyto(y, window, where=mask)
+            return y
+
         col = im2col_array(x, self.kernel_size, self.stride, self.pad,
                            to_matrix=False)
         N, C, KH, KW, OH, OW = col.shape
@@ -253,16 +518,45 @@ class AveragePooling(Function):
         self.pad = pad
         self.input_shape = None
 
+    def forward_meta(self, x):
+        return MetaArray(_pooling_outshape(x.shape, self.kernel_size,
+                                           self.stride, self.pad), x.dtype)
+
+    def flops(self, xs, ys):
+        KH, KW = pair(self.kernel_size)
+        return ys[0].size * KH * KW
+
     def forward(self, x):
         self.input_shape = x.shape
+        if _is_nonoverlapping(x.shape, self.kernel_size, self.stride,
+                              self.pad):
+            KH, KW = pair(self.kernel_size)
+            windows = _nonoverlapping_windows(x, self.kernel_size,
+                                              self.stride)
+            _, y = next(windows)
+            y = y.copy()
+            for _, window in windows:
+                y += window
+            y /= KH * KW
+            return y
+
         col = im2col_array(x, self.kernel_size, self.stride, self.pad,
                            to_matrix=False)
         y = col.mean(axis=(2, 3))
         return y
 
     def backward(self, gy):
-        # TODO(Koki): This is simple implementation
         N, C, OH, OW = gy.shape
+        _, _, H, W = self.input_shape
+        KH, KW = pair(self.kernel_size)
+        if (_is_nonoverlapping(self.input_shape, self.kernel_size,
+                               self.stride, self.pad)
+                and (OH * KH, OW * KW) == (H, W)):
+            gy = reshape(gy / (KH * KW), (N, C, OH, 1, OW, 1))
+            gx = broadcast_to(gy, (N, C, OH, KH, OW, KW))
+            return reshape(gx, self.input_shape)
+
+        # TODO(Koki): This is simple implementation
         KW, KH = pair(self.kernel_size)
         gy /= (KW*KH)
         gcol = broadcast_to(gy.reshape(-1), (KH, KW, N*C*OH*OW))
@@ -276,6 +570,40 @@ def average_pooling(x, kernel_size, stride=1, pad=0):
     return AveragePooling(kernel_size, stride, pad)(x)
 
 
+def _pooling_outshape(input_shape, kernel_size, stride, pad):
+    N, C, H, W = input_shape
+    KH, KW = pair(kernel_size)
+    SH, SW = pair(stride)
+    PH, PW = pair(pad)
+    return (N, C, get_conv_outsize(H, KH, SH, PH),
+            get_conv_outsize(W, KW, SW, PW))
+
+
+def _is_nonoverlapping(input_shape, kernel_size, stride, pad):
+    """True if the pooling windows tile the input without overlap or padding,
+    so that pooling can work on strided views instead of going through
+    im2col."""
+    if pair(pad) != (0, 0):
+        return False
+    H, W = input_shape[2:]
+    (KH, KW), (SH, SW) = pair(kernel_size), pair(stride)
+    OH = get_conv_outsize(H, KH, SH, 0)
+    OW = get_conv_outsize(W, KW, SW, 0)
+    return (SH == KH or OH == 1) and (SW == KW or OW == 1)
+
+
+def _nonoverlapping_windows(x, kernel_size, stride):
+    """Yield `(k, view)` for each kernel offset `k = kh * KW + kw`, where
+    `view` is the `(N, C, OH, OW)` strided view of `x` at that offset."""
+    H, W = x.shape[2:]
+    (KH, KW), (SH, SW) = pair(kernel_size), pair(stride)
+    OH = get_conv_outsize(H, KH, SH, 0)
+    OW = get_conv_outsize(W, KW, SW, 0)
+    for kh in range(KH):
+        for kw in range(KW):
+            yield kh * KW + kw, x[:, :, kh:OH * KH:KH, kw:OW * KW:KW]
+
+
 # =============================================================================
 #  im2col / col2im
 # =============================================================================
@@ -357,18 +685,19 @@ def col2im(x, input_shape, kernel_size, stride=1, pad=0, to_matrix=True):
 # =============================================================================
 #  numpy im2col
 # =============================================================================
-def im2col_array(img, kernel_size, stride, pad, to_matrix=True):
+def im2col_array(img, kernel_size, stride, pad, to_matrix=True, dilate=1):
 
     N, C, H, W = img.shape
     KH, KW = pair(kernel_size)
     SH, SW = pair(stride)
     PH, PW = pair(pad)
-    OH = get_conv_outsize(H, KH, SH, PH)
-    OW = get_conv_outsize(W, KW, SW, PW)
+    DH, DW = pair(dilate)
+    OH = get_conv_outsize(H, (KH - 1) * DH + 1, SH, PH)
+    OW = get_conv_outsize(W, (KW - 1) * DW + 1, SW, PW)
 
     xp = cuda.get_array_module(img)
     if xp != np:
-        col = _im2col_gpu(img, kernel_size, stride, pad)
+        col = _im2col_gpu(img, kernel_size, stride, pad, dilate)
     else:
         img = np.pad(img,
                      ((0, 0), (0, 0), (PH, PH + SH - 1), (PW, PW + SW - 1)),
@@ -376,10 +705,12 @@ def im2col_array(img, kernel_size, stride, pad, to_matrix=True):
         col = np.ndarray((N, C, KH, KW, OH, OW), dtype=img.dtype)
 
         for j in range(KH):
-            j_lim = j + SH * OH
+            jd = j * DH
+            j_lim = jd + SH * OH
             for i in range(KW):
-                i_lim = i + SW * OW
-                col[:, :, j, i, :, :] = img[:, :, j:j_lim:SH, i:i_lim:SW]
+                id_ = i * DW
+                i_lim = id_ + SW * OW
+                col[:, :, j, i, :, :] = img[:, :, jd:j_lim:SH, id_:i_lim:SW]
 
     if to_matrix:
         col = col.transpose((0, 4, 5, 1, 2, 3)).reshape((N * OH * OW, -1))
@@ -387,33 +718,170 @@ def im2col_array(img, kernel_size, stride, pad, to_matrix=True):
     return col
 
 
-def col2im_array(col, img_shape, kernel_size, stride, pad, to_matrix=True):
+def col2im_array(col, img_shape, kernel_size, stride, pad, to_matrix=True,
+                 dilate=1):
     N, C, H, W = img_shape
     KH, KW = pair(kernel_size)
     SH, SW = pair(stride)
     PH, PW = pair(pad)
-    OH = get_conv_outsize(H, KH, SH, PH)
-    OW = get_conv_outsize(W, KW, SW, PW)
+    DH, DW = pair(dilate)
+    OH = get_conv_outsize(H, (KH - 1) * DH + 1, SH, PH)
+    OW = get_conv_outsize(W, (KW - 1) * DW + 1, SW, PW)
 
     if to_matrix:
         col = col.reshape(N, OH, OW, C, KH, KW).transpose(0, 3, 4, 5, 1, 2)
 
     xp = cuda.get_array_module(col)
     if xp != np:
-        img = _col2im_gpu(col, SH, SW, PH, PW, H, W)
+        img = _col2im_gpu(col, SH, SW, PH, PW, H, W, DH, DW)
         return img
     else:
         img = np.zeros((N, C, H + 2 * PH + SH - 1, W + 2 * PW + SW - 1),
                        dtype=col.dtype)
         for j in range(KH):
-            j_lim = j + SH * OH
+            jd = j * DH
+            j_lim = jd + SH * OH
             for i in range(KW):
-                i_lim = i + SW * OW
-                img[:, :, j:j_lim:SH, i:i_lim:SW] += col[:, :, j, i, :, :]
+                id_ = i * DW
+                i_lim = id_ + SW * OW
+                img[:, :, jd:j_lim:SH, id_:i_lim:SW] += col[:, :, j, i, :, :]
         return img[:, :, PH:H + PH, PW:W + PW]
 
 
-def _im2col_gpu(img, kernel_size, stride, pad):
+# =============================================================================
+#  grouped / depthwise convolution
+# =============================================================================
+def _grouped_conv2d_array(x, W, stride, pad, dilate, groups):
+    N, C, H, W_ = x.shape
+    OC, CG, KH, KW = W.shape
+    G = groups
+    if G == C:
+        return _depthwise_conv2d_array(x, W, stride, pad, dilate)
+
+    col = im2col_array(x, (KH, KW), stride, pad, to_matrix=False,
+                       dilate=dilate)
+    OH, OW = col.shape[4:]
+    xp = cuda.get_array_module(x)
+    # One batched matmul over (N, G):
+    # (1, G, OC/G, C/G*KH*KW) @ (N, G, C/G*KH*KW, OH*OW)
+    col = col.reshape(N, G, CG * KH * KW, OH * OW)
+    y = xp.matmul(W.reshape(1, G, OC // G, CG * KH * KW), col)
+    return y.reshape(N, OC, OH, OW)
+
+
+def _grouped_deconv2d_array(x, W, img_shape, stride, pad, dilate, groups):
+    N, C, H, W_ = x.shape
+    _, OCG, KH, KW = W.shape
+    G = groups
+    if G == C:
+        return _depthwise_deconv2d_array(x, W, img_shape, stride, pad, dilate)
+
+    xp = cuda.get_array_module(x)
+    # (1, G, OC/G*KH*KW, C/G) @ (N, G, C/G, H*W)
+    W = W.reshape(G, C // G, OCG * KH * KW).transpose(0, 2, 1)
+    gcol = xp.matmul(W[None], x.reshape(N, G, C // G, H * W_))
+    gcol = gcol.reshape(N, G * OCG, KH, KW, H, W_)
+    return col2im_array(gcol, img_shape, (KH, KW), stride, pad,
+                        to_matrix=False, dilate=dilate)
+
+
+def _grouped_conv2d_grad_w_array(x, gy, kernel_size, stride, pad, dilate,
+                                 groups):
+    N, C, H, W = x.shape
+    OC = gy.shape[1]
+    KH, KW = kernel_size
+    G = groups
+    if G == C:
+        return _depthwise_conv2d_grad_w_array(x, gy, kernel_size, stride, pad,
+                                              dilate)
+
+    col = im2col_array(x, kernel_size, stride, pad, to_matrix=False,
+                       dilate=dilate)
+    OH, OW = col.shape[4:]
+    xp = cuda.get_array_module(x)
+    # (N, G, OC/G, OH*OW) @ (N, G, OH*OW, C/G*KH*KW), summed over N
+    col = col.reshape(N, G, C // G * KH * KW, OH * OW).transpose(0, 1, 3, 2)
+    gW = xp.matmul(gy.reshape(N, G, OC // G, OH * OW), col).sum(axis=0)
+    return gW.reshape(OC, C // G, KH, KW)
+
+
+def _depthwise_windows(x, kernel_size, stride, pad, dilate, out_size):
+    """Pad `x` as `im2col_array` does and yield `(kh, kw, view)` where `view`
+    is the `(N, C, OH, OW)` strided view of the input seen by the filter tap
+    `(kh, kw)`. Summing over the KH*KW taps replaces the im2col buffer."""
+    xp = cuda.get_array_module(x)
+    KH, KW = kernel_size
+    SH, SW = stride
+    PH, PW = pad
+    DH, DW = dilate
+    OH, OW = out_size
+    x = xp.pad(x, ((0, 0), (0, 0), (PH, PH + SH - 1), (PW, PW + SW - 1)),
+               mode='constant', constant_values=(0,))
+    for kh in range(KH):
+        h = kh * DH
+        for kw in range(KW):
+            w = kw * DW
+            yield kh, kw, x[:, :, h:h + SH * OH:SH, w:w + SW * OW:SW]
+
+
+def _depthwise_conv2d_array(x, W, stride, pad, dilate):
+    xp = cuda.get_array_module(x)
+    N, C, H, W_ = x.shape
+    OC, _, KH, KW = W.shape
+    M = OC // C  # channel multiplier
+    SH, SW = stride
+    PH, PW = pad
+    DH, DW = dilate
+    OH = get_conv_outsize(H, (KH - 1) * DH + 1, SH, PH)
+    OW = get_conv_outsize(W_, (KW - 1) * DW + 1, SW, PW)
+
+    W = W.reshape(1, C, M, KH, KW, 1, 1)
+    y = xp.zeros((N, C, M, OH, OW), dtype=x.dtype)
+    for kh, kw, view in _depthwise_windows(x, (KH, KW), stride, pad, dilate,
+                                           (OH, OW)):
+        y += view[:, :, None] * W[:, :, :, kh, kw]
+    return y.reshape(N, OC, OH, OW)
+
+
+def _depthwise_deconv2d_array(x, W, img_shape, stride, pad, dilate):
+    xp = cuda.get_array_module(x)
+    N, C, H, W_ = x.shape
+    _, M, KH, KW = W.shape
+    _, OC, out_h, out_w = img_shape
+    SH, SW = stride
+    PH, PW = pad
+    DH, DW = dilate
+
+    W = W.reshape(1, C, M, KH, KW, 1, 1)
+    img = xp.zeros((N, C, M, out_h + 2 * PH + SH - 1, out_w + 2 * PW + SW - 1),
+                   dtype=x.dtype)
+    x = x[:, :, None]
+    for kh in range(KH):
+        h = kh * DH
+        for kw in range(KW):
+            w = kw * DW
+            img[..., h:h + SH * H:SH, w:w + SW * W_:SW] += \
+                x * W[:, :, :, kh, kw]
+    img = img[..., PH:out_h + PH, PW:out_w + PW]
+    return img.reshape(N, OC, out_h, out_w)
+
+
+def _depthwise_conv2d_grad_w_array(x, gy, kernel_size, stride, pad, dilate):
+    xp = cuda.get_array_module(x)
+    N, C, H, W = x.shape
+    _, OC, OH, OW = gy.shape
+    KH, KW = kernel_size
+    M = OC // C
+
+    gy = gy.reshape(N, C, M, OH, OW)
+    gW = xp.empty((C, M, KH, KW), dtype=gy.dtype)
+    for kh, kw, view in _depthwise_windows(x, kernel_size, stride, pad,
+                                           dilate, (OH, OW)):
+        gW[:, :, kh, kw] = xp.einsum('ncmhw,nchw->cm', gy, view)
+    return gW.reshape(OC, 1, KH, KW)
+
+
+def _im2col_gpu(img, kernel_size, stride, pad, dilate=1):
     """im2col function for GPU.
     This code is ported from Chainer:
     https://github.com/chainer/chainer/blob/v6.4.0/chainer/utils/conv.py
@@ -422,9 +890,9 @@ def _im2col_gpu(img, kernel_size, stride, pad):
     kh, kw = pair(kernel_size)
     sy, sx = pair(stride)
     ph, pw = pair(pad)
-    out_h = get_conv_outsize(h, kh, sy, ph)
-    out_w = get_conv_outsize(w, kw, sx, pw)
-    dy, dx = 1, 1
+    dy, dx = pair(dilate)
+    out_h = get_conv_outsize(h, (kh - 1) * dy + 1, sy, ph)
+    out_w = get_conv_outsize(w, (kw - 1) * dx + 1, sx, pw)
     col = cuda.cupy.empty((n, c, kh, kw, out_h, out_w), dtype=img.dtype)
 
     cuda.cupy.ElementwiseKernel(
@@ -452,13 +920,12 @@ def _im2col_gpu(img, kernel_size, stride, pad):
     return col
 
 
-def _col2im_gpu(col, sy, sx, ph, pw, h, w):
+def _col2im_gpu(col, sy, sx, ph, pw, h, w, dy=1, dx=1):
     """col2im function for GPU.
     This code is ported from Chainer:
     https://github.com/chainer/chainer/blob/v6.4.0/chainer/utils/conv.py
     """
     n, c, kh, kw, out_h, out_w = col.shape
-    dx, dy = 1, 1
     img = cuda.cupy.empty((n, c, h, w), dtype=col.dtype)
 
     cuda.cupy.ElementwiseKernel(
@@ -1,18 +1,22 @@
-import os
 import weakref
 import numpy as np
 import dezero.functions as F
 from dezero import cuda
-from dezero.core import Parameter
+from dezero.core import Config, Parameter, Variable
+from dezero.checkpoint import save_arrays, load_arrays
 from dezero.utils import pair
 
 
 # =============================================================================
 # Layer (base class)
 # =============================================================================
+_call_stack = []  # Layers whose forward is running, innermost last
+
+
 class Layer:
     def __init__(self):
         self._params = set()
+        self._flat = None
 
     def __setattr__(self, name, value):
         if isinstance(value, (Parameter, Layer)):
@@ -20,7 +24,15 @@ class Layer:
         super().__setattr__(name, value)
 
     def __call__(self, *inputs):
-        outputs = self.forward(*inputs)
+        if Config.function_hooks:
+            # lets hooks attribute Functions to the Layer that runs them
+            _call_stack.append(self)
+            try:
+                outputs = self.forward(*inputs)
+            finally:
+                _call_stack.pop()
+        else:
+            outputs = self.forward(*inputs)
         if not isinstance(outputs, tuple):
             outputs = (outputs,)
         self.inputs = [weakref.ref(x) for x in inputs]
@@ -40,17 +52,151 @@ class Layer:
                 yield obj
 
     def cleargrads(self):
+        if self._flat is not None:
+            for data, grad, params in self._flat:
+                grad.fill(0)
+                for param in params:
+                    param.grad = None
+            return
+
         for param in self.params():
             param.cleargrad()
 
+    def reset_state(self):
+        """Forget the state that recurrent sublayers carry between calls."""
+        for name in self._params:
+            obj = self.__dict__[name]
+            if isinstance(obj, Layer):
+                obj.reset_state()
+
+    def unchain_state(self):
+        """Cut the graph behind the state that recurrent layers carry
+        between calls (such as `LSTM.h`), keeping its value.
+
+        Unlike `unchain_backward` this does not walk the graph; it costs
+        one `unchain` per state variable, and the graph itself is freed once
+        nothing else refers to it.
+        """
+        for obj in self.__dict__.values():
+            if isinstance(obj, Layer):
+                obj.unchain_state()
+            elif isinstance(obj, Variable) and \
+                    not isinstance(obj, Parameter):
+                obj.unchain()
+
     def to_cpu(self):
+        if self._flat is not None:
+            self._flat = [(cuda.as_numpy(data), cuda.as_numpy(grad), params)
+                          for data, grad, params in self._flat]
+            self._bind_flat()
+            return
+
         for param in self.params():
             param.to_cpu()
 
     def to_gpu(self):
+        if self._flat is not None:
+            self._flat = [(cuda.as_cupy(data), cuda.as_cupy(grad), params)
+                          for data, grad, params in self._flat]
+            self._bind_flat()
+            return
+
         for param in self.params():
             param.to_gpu()
 
+    def to_flat(self):
+        """Move all parameters and their gradients into one contiguous
+        buffer per dtype.
+
+        Afterwards every `param.data` and `param.grad.data` is a view into
+        a flat buffer (see `flat_arrays`), so whole-model operations such
+        as clearing gradients, computing norms or an allreduce can run on
+        a few large arrays. Backward writes gradients in place into the
+        buffer and `cleargrads` zero-fills it; as without flattening, a
+        parameter that got no gradient keeps `param.grad = None` (its part
+        of the buffer is zero), so optimizer hooks leave it alone.
+
+        The parameters must be initialized. Write new values in place
+        (`param.data[...] = x`); assigning a new array to `param.data`
+        detaches it from the buffer.
+
+        The gradient buffer only holds a parameter's gradient while
+        `param.grad.data` is its view. `param.cleargrad()` leaves its old
+        values in the buffer, and a backward with `create_graph=True` puts
+        `param.grad` outside it; `flat_arrays` zeroes the part of a cleared
+        gradient and copies a detached one back, rebinding `param.grad` to
+        the view unless it is part of a graph.
+        """
+        params_dict = {}
+        self._flatten_params(params_dict)
+        params, seen = [], set()
+        for key in sorted(params_dict):
+            param = params_dict[key]
+            if param is None or id(param) in seen:
+                continue
+            if param.data is None:
+                raise ValueError('Parameter {} is not initialized yet. Run a '
+                                 'forward pass before to_flat.'.format(key))
+            seen.add(id(param))
+            params.append(param)
+
+        groups = {}
+        for param in params:
+            groups.setdefault(param.dtype, []).append(param)
+
+        self._flat = []
+        for dtype, params in groups.items():
+            xp = cuda.get_array_module(params[0].data)
+            size = sum(param.size for param in params)
+            data = xp.empty(size, dtype=dtype)
+            grad = xp.zeros(size, dtype=dtype)
+            offset = 0
+            for param in params:
+                data[offset:offset + param.size] = param.data.ravel()
+                offset += param.size
+            self._flat.append((data, grad, params))
+        self._bind_flat()
+        return self
+
+    def flat_arrays(self):
+        """List of `(data, grad)` flat buffers made by `to_flat`, one pair per
+        dtype. Empty if the layer is not flattened."""
+        if self._flat is None:
+            return []
+        self._sync_flat_grads()
+        return [(data, grad) for data, grad, params in self._flat]
+
+    def _sync_flat_grads(self):
+        # bring back gradients that `cleargrad` or `create_graph` moved out
+        # of the buffer, so that it never holds stale values
+        for data, grad, params in self._flat:
+            for param in params:
+                view = param._flat_grad
+                if param.grad is None:
+                    view.fill(0)
+                elif param.grad.data is not view:
+                    view[...] = param.grad.data
+                    if param.grad.creator is None:
+                        param.grad = Variable(view)
+
+    def _bind_flat(self):
+        for data, grad, params in self._flat:
+            offset = 0
+            for param in params:
+                shape, size = param.shape, param.size
+                param.data = data[offset:offset + size].reshape(shape)
+                view = grad[offset:offset + size].reshape(shape)
+                if param.grad is not None:
+                    # a gradient in the old buffer moved with it
+                    if param.grad.data is not param._flat_grad:
+                        g = param.grad.data
+                        view[...] = cuda.as_numpy(g) if \
+                            cuda.get_array_module(view) is np else \
+                            cuda.as_cupy(g)
+                    param.grad = Variable(view)
+                param._flat_grad = view
+                offset += size
+
     def _flatten_params(self, params_dict, parent_key=""):
         for name in self._params:
             obj = self.__dict__[name]
@@ -62,25 +208,37 @@ class Layer:
                 params_dict[key] = obj
 
     def save_weights(self, path):
+        """Save the parameters to `path`. A path ending in `.dzw` uses the
+        raw format that `load_weights` memory-maps; any other path gets a
+        compressed `.npz` archive."""
         self.to_cpu()
 
         params_dict = {}
         self._flatten_params(params_dict)
         array_dict = {key: param.data for key, param in params_dict.items()
                       if param is not None}
-        try:
-            np.savez_compressed(path, **array_dict)
-        except (Exception, KeyboardInterrupt) as e:
-            if os.path.exists(path):
-                os.remove(path)
-            raise
+        save_arrays(path, array_dict, compress=True)
 
     def load_weights(self, path):
-        npz = np.load(path)
+        """Load parameters saved by `save_weights`. Raw `.dzw` files are
+        memory-mapped: loading only reads the index, and each parameter
+        pages in from disk when first used."""
+        self._load_params(load_arrays(path))
+
+    def _load_params(self, arrays, prefix=''):
         params_dict = {}
         self._flatten_params(params_dict)
         for key, param in params_dict.items():
-            param.data = npz[key]
+            if param is None:
+                continue
+            array = arrays[prefix + key]
+            if param.data is not None and \
+                    cuda.get_array_module(param.data) is not np:
+                array = cuda.as_cupy(array)  # stay on the current device
+            if param._flat_grad is not None:
+                param.data[...] = array  # keep the view into the flat buffer
+            else:
+                param.data = array
 
 
 # =============================================================================
@@ -119,7 +277,8 @@ class Linear(Layer):
 
 class Conv2d(Layer):
     def __init__(self, out_channels, kernel_size, stride=1,
-                 pad=0, nobias=False, dtype=np.float32, in_channels=None):
+                 pad=0, nobias=False, dtype=np.float32, in_channels=None,
+                 groups=1, keep_col=None, dilate=1):
         """Two-dimensional convolutional layer.
 
         Args:
@@ -131,6 +290,14 @@ class Conv2d(Layer):
             in_channels (int or None): Number of channels of input arrays. If
             `None`, parameter initialization will be deferred until the first
             forward data pass at which time the size will be determined.
+            groups (int): Number of groups the channels are split into.
+            `groups == in_channels` gives a depthwise layer.
+            keep_col (bool or None): Keep the forward im2col buffer for the
+            weight gradient (True) or rebuild it in backward (False). `None`
+            decides per call from `Config.conv_col_budget`. The outcome of
+            the last call is recorded in `col_stats`.
+            dilate (int or (int, int)): Dilation factor of filter
+            applications.
         """
         super().__init__()
         self.in_channels = in_channels
@@ -138,8 +305,13 @@ class Conv2d(Layer):
         self.kernel_size = kernel_size
         self.stride = stride
         self.pad = pad
+        self.dilate = dilate
+        self.groups = groups
+        self.keep_col = keep_col
+        self.col_stats = None
         self.dtype = dtype
 
+        self.fused = False
         self.W = Parameter(None, name='W')
         if in_channels is not None:
             self._init_W()
@@ -150,10 +322,10 @@ class Conv2d(Layer):
             self.b = Parameter(np.zeros(out_channels, dtype=dtype), name='b')
 
     def _init_W(self, xp=np):
-        C, OC = self.in_channels, self.out_channels
+        C, OC, G = self.in_channels, self.out_channels, self.groups
         KH, KW = pair(self.kernel_size)
-        scale = np.sqrt(1 / (C * KH * KW))
-        W_data = xp.random.randn(OC, C, KH, KW).astype(self.dtype) * scale
+        scale = np.sqrt(1 / (C // G * KH * KW))
+        W_data = xp.random.randn(OC, C // G, KH, KW).astype(self.dtype) * scale
         self.W.data = W_data
 
     def forward(self, x):
@@ -162,13 +334,52 @@ class Conv2d(Layer):
             xp = cuda.get_array_module(x)
             self._init_W(xp)
 
-        y = F.conv2d(x, self.W, self.b, self.stride, self.pad)
+        y = F.conv2d(x, self.W, self.b, self.stride, self.pad,
+                     dilate=self.dilate, groups=self.groups,
+                     keep_col=self.keep_col)
+        if y.creator is not None:
+            self.col_stats = y.creator.col_stats
         return y
 
+    def fold_batchnorm(self, bn, eps=2e-5):
+        """Fold the inference statistics of a following `BatchNorm` layer
+        into the filters and bias of this layer.
+
+        `bn` is reset to the identity transform afterwards, so `bn(conv(x))`
+        keeps returning the same values in test mode while `conv(x)` alone
+        now computes the whole pair.
+
+        Args:
+            bn (dezero.layers.BatchNorm): BatchNorm layer applied to the
+                output of this layer.
+            eps (float): Epsilon used by `F.batch_norm`.
+        """
+        if self.W.data is None or bn.avg_mean.data is None:
+            raise ValueError('Parameters are not initialized yet. Run a '
+                             'forward pass or load weights before folding.')
+        xp = cuda.get_array_module(self.W.data)
+        dtype = self.W.data.dtype
+
+        scale = bn.gamma.data / xp.sqrt(bn.avg_var.data + eps)
+        b = 0 if self.b is None else self.b.data
+        b = bn.beta.data + (b - bn.avg_mean.data) * scale
+        self.W.data = (self.W.data * scale.reshape(-1, 1, 1, 1)).astype(dtype)
+        if self.b is None:
+            self.b = Parameter(b.astype(dtype), name='b')
+        else:
+            self.b.data = b.astype(dtype)
+
+        D = scale.shape[0]
+        bn.gamma.data = xp.ones(D, dtype=bn.gamma.dtype)
+        bn.beta.data = xp.zeros(D, dtype=bn.beta.dtype)
+        bn.avg_mean.data = xp.zeros(D, dtype=bn.avg_mean.dtype)
+        bn.avg_var.data = xp.full(D, 1 - eps, dtype=bn.avg_var.dtype)
+
 
 class Deconv2d(Layer):
     def __init__(self, out_channels, kernel_size, stride=1,
-                 pad=0, nobias=False, dtype=np.float32, in_channels=None):
+                 pad=0, nobias=False, dtype=np.float32, in_channels=None,
+                 groups=1, dilate=1):
         """Two-dimensional deconvolutional (transposed convolution)layer.
 
         Args:
@@ -180,6 +391,10 @@ class Deconv2d(Layer):
             in_channels (int or None): Number of channels of input arrays. If
             `None`, parameter initialization will be deferred until the first
             forward data pass at which time the size will be determined.
+            groups (int): Number of groups the channels are split into.
+            `groups == in_channels` gives a depthwise layer.
+            dilate (int or (int, int)): Dilation factor of filter
+            applications.
         """
         super().__init__()
         self.in_channels = in_channels
@@ -187,6 +402,8 @@ class Deconv2d(Layer):
         self.kernel_size = kernel_size
         self.stride = stride
         self.pad = pad
+        self.dilate = dilate
+        self.groups = groups
         self.dtype = dtype
 
         self.W = Parameter(None, name='W')
@@ -199,10 +416,10 @@ class Deconv2d(Layer):
             self.b = Parameter(np.zeros(out_channels, dtype=dtype), name='b')
 
     def _init_W(self, xp=np):
-        C, OC = self.in_channels, self.out_channels
+        C, OC, G = self.in_channels, self.out_channels, self.groups
         KH, KW = pair(self.kernel_size)
-        scale = np.sqrt(1 / (C * KH * KW))
-        W_data = xp.random.randn(C, OC, KH, KW).astype(self.dtype) * scale
+        scale = np.sqrt(1 / (C // G * KH * KW))
+        W_data = xp.random.randn(C, OC // G, KH, KW).astype(self.dtype) * scale
         self.W.data = W_data
 
     def forward(self, x):
@@ -211,10 +428,33 @@ class Deconv2d(Layer):
             xp = cuda.get_array_module(x)
             self._init_W(xp)
 
-        y = F.deconv2d(x, self.W, self.b, self.stride, self.pad)
+        y = F.deconv2d(x, self.W, self.b, self.stride, self.pad,
+                       dilate=self.dilate, groups=self.groups)
         return y
 
 
+def conv_col_stats(layer, parent_key=''):
+    """Collect the `col_stats` of every `Conv2d` layer under `layer`.
+
+    Each entry tells how large the im2col buffer of the last forward was
+    (`bytes`), whether it was kept for backward (`kept`), and how many
+    seconds building it took in forward and, if it was not kept, again in
+    backward (`forward_seconds` / `backward_seconds`).
+
+    Returns:
+        dict: `col_stats` keyed by layer path (`'res2/a/conv1'`, ...).
+    """
+    stats = {}
+    for name in layer._params:
+        obj = layer.__dict__[name]
+        key = parent_key + '/' + name if parent_key else name
+        if isinstance(obj, Conv2d) and obj.col_stats is not None:
+            stats[key] = obj.col_stats
+        if isinstance(obj, Layer):
+            stats.update(conv_col_stats(obj, key))
+    return stats
+
+
 # =============================================================================
 # RNN / LSTM
 # =============================================================================
@@ -288,6 +528,57 @@ class LSTM(Layer):
         return h_new
 
 
+class SeqLSTM(Layer):
+    def __init__(self, hidden_size, in_size=None, dtype=np.float32):
+        """An LSTM that runs a whole (T, N, I) sequence per call.
+
+        Computes the same as stepping `LSTM` through the sequence, but the
+        input projections of all timesteps are one matmul, the four hidden
+        projections of a step are one (H, 4H) matmul and the whole
+        sequence is a single graph node (see `F.lstm`). Returns the hidden
+        states of all steps, (T, N, H); the last ones are carried to the
+        next call until `reset_state`.
+
+        Args:
+            hidden_size (int): The number of features in the hidden state.
+            in_size (int): The number of features in the input. If unspecified
+            or `None`, parameter initialization will be deferred until the
+            first `__call__(x)` at which time the size will be determined.
+            dtype: Data type of the parameters.
+        """
+        super().__init__()
+        self.hidden_size = hidden_size
+        self.in_size = in_size
+        self.dtype = dtype
+
+        H = hidden_size
+        self.W_x = Parameter(None, name='W_x')
+        if in_size is not None:
+            self._init_W_x()
+        W_h = np.random.randn(H, 4 * H).astype(dtype) * np.sqrt(1 / H)
+        self.W_h = Parameter(W_h, name='W_h')
+        self.b = Parameter(np.zeros(4 * H, dtype=dtype), name='b')
+        self.reset_state()
+
+    def _init_W_x(self, xp=np):
+        I, H = self.in_size, self.hidden_size
+        W_x = xp.random.randn(I, 4 * H).astype(self.dtype) * np.sqrt(1 / I)
+        self.W_x.data = W_x
+
+    def reset_state(self):
+        self.h = None
+        self.c = None
+
+    def forward(self, x):
+        if self.W_x.data is None:
+            self.in_size = x.shape[2]
+            self._init_W_x(cuda.get_array_module(x))
+
+        hs, self.h, self.c = F.lstm(x, self.W_x, self.W_h, self.b,
+                                    self.h, self.c)
+        return hs
+
+
 # =============================================================================
 # EmbedID / BatchNorm
 # =============================================================================
@@ -324,7 +615,7 @@ class BatchNorm(Layer):
         if self.beta.data is None:
             self.beta.data = xp.zeros(D, dtype=x.dtype)
 
-    def __call__(self, x):
+    def forward(self, x):
         if self.avg_mean.data is None:
             self._init_params(x)
         return F.batch_nrom(x, self.gamma, self.beta, self.avg_mean.data,
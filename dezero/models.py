@@ -46,6 +46,55 @@ class MLP(Model):
         return self.layers[-1](x)
 
 
+# =============================================================================
+# Conv-BatchNorm-ReLU folding (inference only)
+# =============================================================================
+def fold_batchnorm(model):
+    """Transform `model` into an inference-only model whose
+    conv -> batchnorm -> relu sequences run as a single fused convolution.
+
+    The statistics of every `BatchNorm` layer named `bnX` are folded into the
+    `Conv2d` layer `convX` that shares its parent (the naming used by the
+    models in this module), and the activation is applied in place on the
+    conv output. Parameters must be initialized before folding.
+
+    Args:
+        model (dezero.Layer): Model to transform in place.
+
+    Returns:
+        dezero.Layer: The transformed `model`.
+    """
+    layers = [model]
+    while layers:
+        layer = layers.pop()
+        for name in layer._params:
+            obj = layer.__dict__[name]
+            if not isinstance(obj, Layer):
+                continue
+            layers.append(obj)
+            if isinstance(obj, L.Conv2d):
+                if obj.W.data is None:
+                    raise ValueError('Parameters of {} are not initialized '
+                                     'yet.'.format(name))
+                bn = layer.__dict__.get('bn' + name[len('conv'):])
+                if name.startswith('conv') and isinstance(bn, L.BatchNorm):
+                    obj.fold_batchnorm(bn)
+                obj.fused = True
+    return model
+
+
+def _conv_bn_relu(x, conv, bn=None, relu=True):
+    if conv.fused:
+        f = F.conv2d_relu if relu else F.conv2d
+        return f(x, conv.W, conv.b, conv.stride, conv.pad,
+                 dilate=conv.dilate, groups=conv.groups)
+
+    h = conv(x)
+    if bn is not None:
+        h = bn(h)
+    return F.relu(h) if relu else h
+
+
 # =============================================================================
 # VGG
 # =============================================================================
@@ -76,23 +125,23 @@ class VGG16(Model):
             self.load_weights(weights_path)
 
     def forward(self, x):
-        x = F.relu(self.conv1_1(x))
-        x = F.relu(self.conv1_2(x))
+        x = _conv_bn_relu(x, self.conv1_1)
+        x = _conv_bn_relu(x, self.conv1_2)
         x = F.pooling(x, 2, 2)
-        x = F.relu(self.conv2_1(x))
-        x = F.relu(self.conv2_2(x))
+        x = _conv_bn_relu(x, self.conv2_1)
+        x = _conv_bn_relu(x, self.conv2_2)
         x = F.pooling(x, 2, 2)
-        x = F.relu(self.conv3_1(x))
-        x = F.relu(self.conv3_2(x))
-        x = F.relu(self.conv3_3(x))
+        x = _conv_bn_relu(x, self.conv3_1)
+        x = _conv_bn_relu(x, self.conv3_2)
+        x = _conv_bn_relu(x, self.conv3_3)
         x = F.pooling(x, 2, 2)
-        x = F.relu(self.conv4_1(x))
-        x = F.relu(self.conv4_2(x))
-        x = F.relu(self.conv4_3(x))
+        x = _conv_bn_relu(x, self.conv4_1)
+        x = _conv_bn_relu(x, self.conv4_2)
+        x = _conv_bn_relu(x, self.conv4_3)
         x = F.pooling(x, 2, 2)
-        x = F.relu(self.conv5_1(x))
-        x = F.relu(self.conv5_2(x))
-        x = F.relu(self.conv5_3(x))
+        x = _conv_bn_relu(x, self.conv5_1)
+        x = _conv_bn_relu(x, self.conv5_2)
+        x = _conv_bn_relu(x, self.conv5_3)
         x = F.pooling(x, 2, 2)
         x = F.reshape(x, (x.shape[0], -1))
         x = F.dropout(F.relu(self.fc6(x)))
@@ -144,7 +193,7 @@ class ResNet(Model):
             self.load_weights(weights_path)
 
     def forward(self, x):
-        x = F.relu(self.bn1(self.conv1(x)))
+        x = _conv_bn_relu(x, self.conv1, self.bn1)
         x = F.pooling(x, kernel_size=3, stride=2)
         x = self.res2(x)
         x = self.res3(x)
@@ -233,10 +282,10 @@ class BottleneckA(Layer):
         self.bn4 = L.BatchNorm()
 
     def forward(self, x):
-        h1 = F.relu(self.bn1(self.conv1(x)))
-        h1 = F.relu(self.bn2(self.conv2(h1)))
-        h1 = self.bn3(self.conv3(h1))
-        h2 = self.bn4(self.conv4(x))
+        h1 = _conv_bn_relu(x, self.conv1, self.bn1)
+        h1 = _conv_bn_relu(h1, self.conv2, self.bn2)
+        h1 = _conv_bn_relu(h1, self.conv3, self.bn3, relu=False)
+        h2 = _conv_bn_relu(x, self.conv4, self.bn4, relu=False)
         return F.relu(h1 + h2)
 
 
@@ -258,9 +307,9 @@ class BottleneckB(Layer):
         self.bn3 = L.BatchNorm()
 
     def forward(self, x):
-        h = F.relu(self.bn1(self.conv1(x)))
-        h = F.relu(self.bn2(self.conv2(h)))
-        h = self.bn3(self.conv3(h))
+        h = _conv_bn_relu(x, self.conv1, self.bn1)
+        h = _conv_bn_relu(h, self.conv2, self.bn2)
+        h = _conv_bn_relu(h, self.conv3, self.bn3, relu=False)
         return F.relu(h + x)
 
 
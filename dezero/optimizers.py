@@ -1,4 +1,5 @@
 import math
+import numpy as np
 from dezero import cuda, Parameter
 
 
@@ -6,29 +7,175 @@ from dezero import cuda, Parameter
 # Optimizer (base class)
 # =============================================================================
 class Optimizer:
+    # names of the per-parameter state dicts, passed to `update_arrays` in
+    # this order
+    state_names = ()
+    # elements per fused update on CPU: a chunk and its temporaries stay in
+    # cache across the several passes of `update_arrays`
+    chunk_size = 1 << 15
+
     def __init__(self):
         self.target = None
         self.hooks = []
+        self._flat_states = {}
+        self._scratch = {}
 
     def setup(self, target):
         self.target = target
         return self
 
     def update(self):
-        params = [p for p in self.target.params() if p.grad is not None]
+        all_params = {}
+        self.target._flatten_params(all_params)
+        params_dict = {key: p for key, p in all_params.items()
+                       if p is not None and p.grad is not None}
 
         for f in self.hooks:
-            f(params)
-
-        for param in params:
-            self.update_one(param)
-
-    def update_one(self, param):
+            f(list(params_dict.values()))
+
+        flat = getattr(self.target, '_flat', None)
+        if flat is not None and self._fusable():
+            paths = {id(p): key for key, p in all_params.items()}
+            for data, grad, flat_params in flat:
+                self._update_flat(data, grad, flat_params, paths)
+            return
+
+        for key, param in params_dict.items():
+            if param.grad is not None:
+                self.update_one(param, key)
+
+    def update_one(self, param, key=None):
+        """Update one parameter. `key` names its state, `update` passes the
+        parameter path (`'l0/W'`); it defaults to `id(param)`."""
+        if key is None:
+            key = id(param)
+        states = []
+        for name in self.state_names:
+            d = getattr(self, name)
+            state = d.get(key)
+            if state is None or state.shape != param.shape:
+                xp = cuda.get_array_module(param.data)
+                state = d[key] = xp.zeros_like(param.data)
+            states.append(state)
+        self.update_arrays(param.data, param.grad.data, *states)
+
+    def update_arrays(self, data, grad, *states):
+        """Update `data` in place from `grad` and the state arrays named by
+        `state_names`. The arrays are either one parameter or a contiguous
+        run of a flat buffer made by `Layer.to_flat`."""
         raise NotImplementedError()
 
     def add_hook(self, f):
         self.hooks.append(f)
 
+    def state_dict(self):
+        """Optimizer state as a dict of arrays keyed by
+        `'<state name>/<parameter path>'`, e.g. `'vs/l0/W'`."""
+        state = {}
+        for name in self.state_names:
+            for key, array in getattr(self, name).items():
+                if isinstance(key, str):
+                    state[name + '/' + key] = array
+        return state
+
+    def load_state_dict(self, state):
+        """Restore the state saved by `state_dict`. Arrays are moved to the
+        device of the parameter they belong to."""
+        params_dict = {}
+        self.target._flatten_params(params_dict)
+        self._flat_states = {}
+        for name in self.state_names:
+            d = {}
+            prefix = name + '/'
+            for key, array in state.items():
+                if not key.startswith(prefix):
+                    continue
+                path = key[len(prefix):]
+                param = params_dict.get(path)
+                if param is not None and param.data is not None and \
+                        cuda.get_array_module(param.data) is not np:
+                    d[path] = cuda.as_cupy(array)
+                else:
+                    d[path] = np.array(cuda.as_numpy(array))
+            setattr(self, name, d)
+
+    def _fusable(self):
+        return type(self).update_arrays is not Optimizer.update_arrays
+
+    def _update_flat(self, data, grad, params, paths):
+        states = [self._flat_state(name, data, params, paths)
+                  for name in self.state_names]
+
+        # Update every run of parameters whose gradient still lives in the
+        # buffer with a single call. Parameters left without one by hooks
+        # (FreezeParam) or by `create_graph` split the runs.
+        start = offset = 0
+        for param in params + [None]:
+            if param is None or param.grad is None or \
+                    param.grad.data is not param._flat_grad:
+                if offset > start:
+                    self._update_run(data, grad, states, start, offset)
+                if param is None:
+                    break
+                if param.grad is not None:
+                    self.update_one(param, paths.get(id(param)))
+                offset += param.size
+                start = offset
+            else:
+                offset += param.size
+
+    def _update_run(self, data, grad, states, start, stop):
+        step = stop - start
+        if cuda.get_array_module(data) is np:
+            step = self.chunk_size
+        for i in range(start, stop, step):
+            s = slice(i, min(i + step, stop))
+            self.update_arrays(data[s], grad[s], *[state[s] for state in states])
+
+    def _flat_state(self, name, data, params, paths):
+        # one entry per state and flat buffer; a buffer replaced by a new
+        # `to_flat` (or a device move) replaces its entry, since the id of
+        # a freed buffer can be reused
+        key = (name, data.dtype)
+        cached = self._flat_states.get(key)
+        if cached is not None and cached[0] is data:
+            return cached[1]
+
+        # Make the per-parameter state dict point into one flat array, so
+        # fused and per-parameter updates share it.
+        xp = cuda.get_array_module(data)
+        state = xp.zeros_like(data)
+        d = getattr(self, name)
+        offset = 0
+        for param in params:
+            view = state[offset:offset + param.size].reshape(param.shape)
+            path = paths.get(id(param), id(param))
+            if path in d and d[path].shape == param.shape:
+                view[...] = d[path]
+            d[path] = view
+            offset += param.size
+        self._flat_states[key] = (data, state)
+        return state
+
+    def _temp(self, x, n=1):
+        """`n` scratch arrays shaped like `x`, reused across calls."""
+        key = (type(x), x.dtype, x.shape, n)
+        views = self._scratch.get(key)
+        if views is not None:
+            return views
+
+        base_key = (type(x), x.dtype)
+        bufs = self._scratch.get(base_key, ())
+        if len(bufs) < n or bufs[0].size < x.size:
+            xp = cuda.get_array_module(x)
+            size = max([x.size] + [b.size for b in bufs])
+            bufs = [xp.empty(size, dtype=x.dtype) for _ in range(n)]
+            self._scratch.clear()  # drop views of the old buffers
+            self._scratch[base_key] = bufs
+        views = [b[:x.size].reshape(x.shape) for b in bufs[:n]]
+        self._scratch[key] = views
+        return views
+
 
 # =============================================================================
 # Hook functions
@@ -82,53 +229,52 @@ class SGD(Optimizer):
         super().__init__()
         self.lr = lr
 
-    def update_one(self, param):
-        param.data -= self.lr * param.grad.data
+    def update_arrays(self, data, grad):
+        t, = self._temp(grad)
+        data -= cuda.get_array_module(data).multiply(grad, self.lr, out=t)
 
 
 class MomentumSGD(Optimizer):
+    state_names = ('vs',)
+
     def __init__(self, lr=0.01, momentum=0.9):
         super().__init__()
         self.lr = lr
         self.momentum = momentum
         self.vs = {}
 
-    def update_one(self, param):
-        v_key = id(param)
-        if v_key not in self.vs:
-            xp = cuda.get_array_module(param.data)
-            self.vs[v_key] = xp.zeros_like(param.data)
-
-        v = self.vs[v_key]
+    def update_arrays(self, data, grad, v):
+        xp = cuda.get_array_module(data)
+        t, = self._temp(grad)
         v *= self.momentum
-        v -= self.lr * param.grad.data
-        param.data += v
+        v -= xp.multiply(grad, self.lr, out=t)
+        data += v
 
 
 class AdaGrad(Optimizer):
+    state_names = ('hs',)
+
     def __init__(self, lr=0.001, eps=1e-8):
         super().__init__()
         self.lr = lr
         self.eps = eps
         self.hs = {}
 
-    def update_one(self, param):
-        xp = cuda.get_array_module(param.data)
+    def update_arrays(self, data, grad, h):
+        xp = cuda.get_array_module(data)
+        t, = self._temp(grad)
 
-        h_key = id(param)
-        if h_key not in self.hs:
-            self.hs[h_key] = xp.zeros_like(param.data)
-
-        lr = self.lr
-        eps = self.eps
-        grad = param.grad.data
-        h = self.hs[h_key]
-
-        h += grad * grad
-        param.data -= lr * grad / (xp.sqrt(h) + eps)
+        h += xp.multiply(grad, grad, out=t)
+        xp.sqrt(h, out=t)
+        t += self.eps
+        xp.divide(grad, t, out=t)
+        t *= self.lr
+        data -= t
 
 
 class AdaDelta(Optimizer):
+    state_names = ('msg', 'msdx')
+
     def __init__(self, rho=0.95, eps=1e-6):
         super().__init__()
         self.rho = rho
@@ -136,28 +282,30 @@ class AdaDelta(Optimizer):
         self.msg = {}
         self.msdx = {}
 
-    def update_one(self, param):
-        xp = cuda.get_array_module(param.data)
-
-        key = id(param)
-        if key not in self.msg:
-            self.msg[key] = xp.zeros_like(param.data)
-            self.msdx[key] = xp.zeros_like(param.data)
-
-        msg, msdx = self.msg[key], self.msdx[key]
-        rho = self.rho
-        eps = self.eps
-        grad = param.grad.data
+    def update_arrays(self, data, grad, msg, msdx):
+        xp = cuda.get_array_module(data)
+        dx, t = self._temp(grad, 2)
+        rho, eps = self.rho, self.eps
 
         msg *= rho
-        msg += (1 - rho) * grad * grad
-        dx = xp.sqrt((msdx + eps) / (msg + eps)) * grad
+        xp.multiply(grad, grad, out=t)
+        t *= 1 - rho
+        msg += t
+        xp.add(msdx, eps, out=dx)
+        xp.add(msg, eps, out=t)
+        xp.divide(dx, t, out=dx)
+        xp.sqrt(dx, out=dx)
+        dx *= grad
         msdx *= rho
-        msdx += (1 - rho) * dx * dx
-        param.data -= dx
+        xp.multiply(dx, dx, out=t)
+        t *= 1 - rho
+        msdx += t
+        data -= dx
 
 
 class Adam(Optimizer):
+    state_names = ('ms', 'vs')
+
     def __init__(self, alpha=0.001, beta1=0.9, beta2=0.999, eps=1e-8):
         super().__init__()
         self.t = 0
@@ -172,24 +320,35 @@ class Adam(Optimizer):
         self.t += 1
         super().update(*args, **kwargs)
 
+    def state_dict(self):
+        state = super().state_dict()
+        state['t'] = np.array(self.t)
+        return state
+
+    def load_state_dict(self, state):
+        super().load_state_dict(state)
+        self.t = int(state['t'])
+
     @property
     def lr(self):
         fix1 = 1. - math.pow(self.beta1, self.t)
         fix2 = 1. - math.pow(self.beta2, self.t)
         return self.alpha * math.sqrt(fix2) / fix1
 
-    def update_one(self, param):
-        xp = cuda.get_array_module(param.data)
-
-        key = id(param)
-        if key not in self.ms:
-            self.ms[key] = xp.zeros_like(param.data)
-            self.vs[key] = xp.zeros_like(param.data)
-
-        m, v = self.ms[key], self.vs[key]
+    def update_arrays(self, data, grad, m, v):
+        xp = cuda.get_array_module(data)
+        t, = self._temp(grad)
         beta1, beta2, eps = self.beta1, self.beta2, self.eps
-        grad = param.grad.data
 
-        m += (1 - beta1) * (grad - m)
-        v += (1 - beta2) * (grad * grad - v)
-        param.data -= self.lr * m / (xp.sqrt(v) + eps)
\ No newline at end of file
+        xp.subtract(grad, m, out=t)
+        t *= 1 - beta1
+        m += t
+        xp.multiply(grad, grad, out=t)
+        t -= v
+        t *= 1 - beta2
+        v += t
+        xp.sqrt(v, out=t)
+        t += eps
+        xp.divide(m, t, out=t)
+        t *= self.lr
+        data -= t
@@ -0,0 +1,209 @@
+import time
+import numpy as np
+from dezero import layers
+from dezero.core import Config, MetaArray, Parameter, Variable
+from dezero.core import using_config, no_grad
+
+
+# =============================================================================
+# Profile (Function hook)
+# =============================================================================
+class Profile:
+    """Function hook that counts FLOPs and bytes moved per Layer and per
+    Function type.
+
+    Every Function called inside `model` is attributed to the innermost
+    Layer of `model` that runs it, keyed by the Layer's path as in
+    `save_weights` ('' is `model` itself). Use it as a context manager to
+    profile real runs (Functions run by `backward` are counted too), or
+    through `dry_run` to profile without data.
+
+    Example:
+        >>> with Profile(model) as profile:
+        ...     model(x)
+        >>> print(profile.roofline())
+    """
+    def __init__(self, model):
+        self.model = model
+        self.paths = {}
+        self._walk(model, '')
+        self.layers = {}
+        self.functions = {}
+        self.outputs = None
+        self.elapsed = 0.0
+        self._config = None
+
+    def _walk(self, layer, path):
+        self.paths[id(layer)] = path
+        for name in layer._params:
+            obj = layer.__dict__[name]
+            if isinstance(obj, layers.Layer):
+                self._walk(obj, path + '/' + name if path else name)
+
+    def _path(self):
+        for layer in reversed(layers._call_stack):
+            path = self.paths.get(id(layer))
+            if path is not None:
+                return path
+        return ''
+
+    def __enter__(self):
+        self._config = using_config('function_hooks',
+                                    Config.function_hooks + (self,))
+        self._config.__enter__()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed += time.perf_counter() - self._start
+        self._config.__exit__(*exc_info)
+        self._config = None
+
+    def __call__(self, function, xs, ys):
+        flops = function.flops(xs, ys)
+        read, written = function.traffic(xs, ys)
+        activation = sum(getattr(y, 'nbytes', 0) for y in ys)
+
+        for records, key in ((self.layers, self._path()),
+                             (self.functions, type(function).__name__)):
+            r = records.get(key)
+            if r is None:
+                r = records[key] = {'calls': 0, 'flops': 0, 'bytes_read': 0,
+                                    'bytes_written': 0, 'activation_bytes': 0}
+            r['calls'] += 1
+            r['flops'] += flops
+            r['bytes_read'] += read
+            r['bytes_written'] += written
+            r['activation_bytes'] += activation
+
+    def params(self, path):
+        """Number of parameter elements owned directly by the Layer at
+        `path`."""
+        layer = self.model
+        for name in path.split('/') if path else ():
+            layer = getattr(layer, name)
+        return sum(obj.size for obj in layer.__dict__.values()
+                   if isinstance(obj, Parameter) and obj.data is not None)
+
+    def _total(self, key):
+        return sum(r[key] for r in self.layers.values())
+
+    @property
+    def flops(self):
+        return self._total('flops')
+
+    @property
+    def bytes_moved(self):
+        return self._total('bytes_read') + self._total('bytes_written')
+
+    @property
+    def activation_bytes(self):
+        return self._total('activation_bytes')
+
+    def _name(self, path):
+        return path or '({})'.format(type(self.model).__name__)
+
+    def summary(self):
+        row = '{:<32}{:>7}{:>12.2f}{:>12.2f}{:>12}'
+        lines = ['{:<32}{:>7}{:>12}{:>12}{:>12}'.format(
+            'layer', 'calls', 'MFLOPs', 'act. MB', 'params')]
+        for path, r in self.layers.items():
+            lines.append(row.format(
+                self._name(path), r['calls'], r['flops'] / 1e6,
+                r['activation_bytes'] / 2 ** 20, self.params(path)))
+        lines.append(row.format(
+            'total', self._total('calls'), self.flops / 1e6,
+            self.activation_bytes / 2 ** 20,
+            sum(p.size for p in self.model.params())))
+        lines.append('({:.1f} ms)'.format(self.elapsed * 1e3))
+        return '\n'.join(lines)
+
+    def roofline(self, peak_flops=None, bandwidth=None, by='layer'):
+        """Roofline table of the layers (or, with `by='function'`, the
+        Function types).
+
+        The arithmetic intensity of each row is its FLOPs per byte moved.
+        Rows below the machine balance `peak_flops / bandwidth` are bound
+        by memory bandwidth, the others by compute; `time` is the lower
+        bound `max(flops / peak_flops, bytes / bandwidth)`. Peak FLOP/s and
+        bandwidth (bytes/s) of this host are measured when not given.
+        """
+        if peak_flops is None:
+            peak_flops = measure_peak_flops()
+        if bandwidth is None:
+            bandwidth = measure_bandwidth()
+        balance = peak_flops / bandwidth
+        records = self.layers if by == 'layer' else self.functions
+
+        row = '{:<32}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.3f}{:>9}'
+        lines = ['machine balance {:.2f} FLOP/B ({:.1f} GFLOP/s, '
+                 '{:.1f} GB/s)'.format(balance, peak_flops / 1e9,
+                                       bandwidth / 1e9),
+                 '{:<32}{:>10}{:>10}{:>10}{:>10}{:>9}'.format(
+                     by, 'MFLOPs', 'MB', 'FLOP/B', 'time ms', 'bound')]
+        total = 0.0
+        for key, r in records.items():
+            moved = r['bytes_read'] + r['bytes_written']
+            intensity = r['flops'] / moved if moved else float('inf')
+            t = max(r['flops'] / peak_flops, moved / bandwidth)
+            total += t
+            lines.append(row.format(
+                self._name(key) if by == 'layer' else key,
+                r['flops'] / 1e6, moved / 2 ** 20, intensity, t * 1e3,
+                '-' if not moved else
+                'compute' if intensity >= balance else 'memory'))
+        lines.append('{:<32}{:>10.2f}{:>10.2f}{:>10}{:>10.3f}'.format(
+            'total', self.flops / 1e6, self.bytes_moved / 2 ** 20, '',
+            total * 1e3))
+        return '\n'.join(lines)
+
+
+def measure_peak_flops(n=1024, repeat=3):
+    """FLOP/s of this host measured with a float32 matmul."""
+    a = np.random.rand(n, n).astype(np.float32)
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        a.dot(a)
+        best = min(best, time.perf_counter() - start)
+    return 2 * n ** 3 / best
+
+
+def measure_bandwidth(nbytes=1 << 26, repeat=3):
+    """Bytes/s of this host measured with a copy of `nbytes`."""
+    src = np.ones(nbytes // 4, dtype=np.float32)
+    dst = np.empty_like(src)
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        np.copyto(dst, src)
+        best = min(best, time.perf_counter() - start)
+    return 2 * nbytes / best
+
+
+# =============================================================================
+# dry_run
+# =============================================================================
+def dry_run(model, *shapes, dtype=np.float32, train=False):
+    """Run `model` on inputs of the given shapes without any data.
+
+    Functions only propagate shapes and dtypes (`Config.meta`), so lazily
+    initialized parameters get their real values and shapes while no
+    activation is allocated. Returns a `Profile` whose `outputs` are the
+    `MetaArray`s the model returns.
+
+    Example:
+        >>> model = dezero.models.ResNet50(pretrained=False)
+        >>> print(dry_run(model, (1, 3, 224, 224)).summary())
+    """
+    profile = Profile(model)
+    inputs = [Variable(MetaArray(shape, dtype)) for shape in shapes]
+
+    with no_grad(), using_config('train', train), \
+            using_config('meta', True), profile:
+        outputs = model(*inputs)
+
+    if not isinstance(outputs, tuple):
+        outputs = (outputs,)
+    profile.outputs = tuple(y.data for y in outputs)
+    return profile
@@ -0,0 +1,92 @@
+import time
+import dezero.functions as F
+
+
+# =============================================================================
+# TruncatedBPTT
+# =============================================================================
+class TruncatedBPTT:
+    """Truncated backpropagation through time for recurrent models.
+
+    Each `step` runs the model on one timestep of a batch and adds its loss;
+    every `bptt_length` steps the accumulated loss is backpropagated, the
+    optimizer updates and the graph is cut behind the hidden state with
+    `Layer.unchain_state`, so the state carries over to the next window
+    while the cost of a window stays constant however long the sequence is.
+
+    Example:
+        >>> trainer = TruncatedBPTT(model, optimizer, bptt_length=30)
+        >>> for epoch in range(max_epoch):
+        ...     loss = trainer.run(SeqDataLoader(train_set, batch_size=30))
+        ...     print(loss, trainer.tokens_per_sec)
+
+    Args:
+        model (Layer): Model called as `model(x)` on every timestep.
+        optimizer (Optimizer): Optimizer set up with `model`.
+        bptt_length (int): Number of timesteps per backward.
+        loss_fn (callable): `loss_fn(y, t)` of one timestep.
+    """
+    def __init__(self, model, optimizer, bptt_length=30,
+                 loss_fn=F.mean_squared_error):
+        self.model = model
+        self.optimizer = optimizer
+        self.bptt_length = bptt_length
+        self.loss_fn = loss_fn
+
+        self.loss = 0
+        self.count = 0
+        self.tokens = 0
+        self.elapsed = 0.0
+        self.history = []  # (tokens, seconds) of every window
+
+    def step(self, x, t):
+        """Run one timestep. Returns the loss of the window if this step
+        completed it, else None."""
+        start = time.perf_counter()
+        y = self.model(x)
+        self.loss += self.loss_fn(y, t)
+        self.count += 1
+        self.tokens += len(t)
+        self.elapsed += time.perf_counter() - start
+
+        if self.count == self.bptt_length:
+            return self.flush()
+
+    def flush(self):
+        """Backpropagate the steps accumulated so far and update."""
+        if self.count == 0:
+            return None
+        start = time.perf_counter()
+        loss = self.loss
+        self.model.cleargrads()
+        loss.backward()
+        self.model.unchain_state()
+        self.optimizer.update()
+        self.elapsed += time.perf_counter() - start
+
+        self.history.append((self.tokens, self.elapsed))
+        self.loss, self.count, self.tokens, self.elapsed = 0, 0, 0, 0.0
+        return float(loss.data)
+
+    def run(self, loader):
+        """Train on a whole pass of `loader` (e.g. `SeqDataLoader`) from a
+        reset state; returns the mean loss per timestep."""
+        self.model.reset_state()
+        self.history = []
+        total, count = 0.0, 0
+        for x, t in loader:
+            loss = self.step(x, t)
+            if loss is not None:
+                total += loss
+            count += 1
+        loss = self.flush()  # the last, shorter window
+        if loss is not None:
+            total += loss
+        return total / count if count else 0.0
+
+    @property
+    def tokens_per_sec(self):
+        """Throughput over the windows of the last `run` (or since it)."""
+        tokens = sum(n for n, _ in self.history)
+        seconds = sum(s for _, s in self.history)
+        return tokens / seconds if seconds else 0.0
@@ -22,6 +22,35 @@ class Compose:
             img = t(img)
         return img
 
+    @property
+    def batch(self):
+        """The composition of the `batch` versions of the transforms, or
+        None if one of them has none.
+
+        `batch(array, inplace=False)` runs each stage in place once the
+        array is a temporary of an earlier stage (or from the start with
+        `inplace`), and fuses a floating `AsType` followed by `Normalize`.
+        """
+        stages = []
+        for t in self.transforms:
+            f = getattr(t, 'batch', None)
+            if f is None:
+                return None
+            prev = stages[-1][0] if stages else None
+            if isinstance(t, Normalize) and isinstance(prev, AsType) and \
+                    np.dtype(prev.dtype).kind == 'f':
+                stages[-1] = (t, t.fused_batch(prev.dtype))
+            else:
+                stages.append((t, f))
+
+        def batch(array, inplace=False):
+            for _, f in stages:
+                out = f(array, inplace=inplace)
+                inplace = inplace or not np.may_share_memory(out, array)
+                array = out
+            return array
+        return batch
+
 
 # =============================================================================
 # Transforms for PIL Image
@@ -118,19 +147,49 @@ class Normalize:
         self.mean = mean
         self.std = std
 
-    def __call__(self, array):
+    def _stats(self, ndim, dtype, axis=0):
+        # mean and std broadcastable along the channel `axis`
         mean, std = self.mean, self.std
 
         if not np.isscalar(mean):
-            mshape = [1] * array.ndim
-            mshape[0] = len(array) if len(self.mean) == 1 else len(self.mean)
-            mean = np.array(self.mean, dtype=array.dtype).reshape(*mshape)
+            mshape = [1] * ndim
+            mshape[axis] = len(self.mean)
+            mean = np.array(self.mean, dtype=dtype).reshape(*mshape)
         if not np.isscalar(std):
-            rshape = [1] * array.ndim
-            rshape[0] = len(array) if len(self.std) == 1 else len(self.std)
-            std = np.array(self.std, dtype=array.dtype).reshape(*rshape)
+            rshape = [1] * ndim
+            rshape[axis] = len(self.std)
+            std = np.array(self.std, dtype=dtype).reshape(*rshape)
+        return mean, std
+
+    def __call__(self, array):
+        mean, std = self._stats(array.ndim, array.dtype)
         return (array - mean) / std
 
+    def batch(self, array, inplace=False):
+        """Normalize every example of a (N, ...) batch; a floating point
+        `array` is overwritten when `inplace`."""
+        mean, std = self._stats(array.ndim, array.dtype, axis=1)
+        if not (inplace and array.dtype.kind == 'f'):
+            return (array - mean) / std
+        array -= mean
+        array /= std
+        return array
+
+    def fused_batch(self, dtype):
+        """`batch` preceded by a conversion to `dtype` (`AsType`), in one
+        pass for the conversion and subtraction and one in place pass for
+        the division."""
+        def batch(array, inplace=False):
+            mean, std = self._stats(array.ndim, dtype, axis=1)
+            if inplace and array.dtype == dtype:
+                out = array
+            else:
+                out = np.empty(array.shape, dtype=dtype)
+            np.subtract(array, mean, out=out, dtype=dtype)
+            np.divide(out, std, out=out)
+            return out
+        return batch
+
 
 class Flatten:
     """Flatten a NumPy array.
@@ -138,6 +197,9 @@ class Flatten:
     def __call__(self, array):
         return array.flatten()
 
+    def batch(self, array, inplace=False):
+        return array.reshape(len(array), -1)
+
 
 class AsType:
     def __init__(self, dtype=np.float32):
@@ -146,6 +208,9 @@ class AsType:
     def __call__(self, array):
         return array.astype(self.dtype)
 
+    def batch(self, array, inplace=False):
+        return array.astype(self.dtype, copy=not inplace)
+
 
 ToFloat = AsType
 
@@ -6,6 +6,7 @@ import dezero.layers as L
 from dezero import DataLoader
 from dezero.models import Sequential
 from dezero.optimizers import Adam
+from dezero.profiler import dry_run
 
 
 use_gpu = dezero.cuda.gpu_enable
@@ -46,11 +47,9 @@ dis = Sequential(
 
 
 def init_weight(dis, gen, hidden_size):
-    # Input dummy data to initialize weights
-    batch_size = 1
-    z = np.random.rand(batch_size, hidden_size)
-    fake_images = gen(z)
-    dis(fake_images)
+    # Propagate shapes only to initialize weights
+    fake_images, = dry_run(gen, (1, hidden_size), dtype=np.float64).outputs
+    dry_run(dis, fake_images.shape, dtype=np.float64)
 
     for l in dis.layers + gen.layers:
         classname = l.__class__.__name__
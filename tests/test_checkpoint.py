@@ -0,0 +1,263 @@
+import os
+import copy
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import dezero.functions as F
+import dezero.layers as L
+from dezero import optimizers
+from dezero.checkpoint import save_checkpoint, load_checkpoint
+from dezero.checkpoint import save_arrays, load_arrays, is_raw_file
+from dezero.checkpoint import CheckpointWriter, save_sharded, load_sharded
+from dezero.models import MLP
+from dezero.utils import array_allclose
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'ckpt.npz')
+        self.x = np.random.randn(8, 4).astype('f')
+        self.t = np.random.randn(8, 2).astype('f')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _train(self, model, optimizer, steps):
+        for _ in range(steps):
+            model.cleargrads()
+            loss = F.mean_squared_error(model(self.x), self.t)
+            loss.backward()
+            optimizer.update()
+
+    def _resume(self, name, flat=False):
+        model = MLP((5, 3, 2))
+        model(self.x)
+        init = copy.deepcopy(model)
+        if flat:
+            model.to_flat()
+        optimizer = getattr(optimizers, name)().setup(model)
+        self._train(model, optimizer, 3)
+        save_checkpoint(self.path, model, optimizer)
+        self._train(model, optimizer, 2)
+
+        model2 = init  # same structure, stale weights
+        if flat:
+            model2.to_flat()
+        optimizer2 = getattr(optimizers, name)().setup(model2)
+        load_checkpoint(self.path, model2, optimizer2)
+        self._train(model2, optimizer2, 2)
+        return model(self.x).data, model2(self.x).data
+
+    def test_resume(self):
+        for name in ('MomentumSGD', 'AdaGrad', 'AdaDelta', 'Adam'):
+            y, y2 = self._resume(name)
+            self.assertTrue(array_allclose(y, y2), name)
+
+    def test_resume_flat(self):
+        for name in ('MomentumSGD', 'Adam'):
+            y, y2 = self._resume(name, flat=True)
+            self.assertTrue(array_allclose(y, y2), name)
+
+    def test_state_dict(self):
+        model = MLP((5, 2))
+        model(self.x)
+        optimizer = optimizers.Adam().setup(model)
+        self._train(model, optimizer, 1)
+        state = optimizer.state_dict()
+        self.assertEqual(sorted(state),
+                         ['ms/l0/W', 'ms/l0/b', 'ms/l1/W', 'ms/l1/b', 't',
+                          'vs/l0/W', 'vs/l0/b', 'vs/l1/W', 'vs/l1/b'])
+        self.assertEqual(int(state['t']), 1)
+
+    def test_recreated_param(self):
+        model = MLP((5, 2))
+        model(self.x)
+        optimizer = optimizers.MomentumSGD().setup(model)
+        self._train(model, optimizer, 1)
+        model.l1 = model.layers[1] = L.Linear(3)  # new layer, same path
+        self.t = np.random.randn(8, 3).astype('f')
+        self._train(model, optimizer, 1)
+        self.assertEqual(len(optimizer.vs), 4)
+        self.assertEqual(optimizer.vs['l1/W'].shape, (5, 3))
+
+
+class TestRawFormat(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'w.dzw')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_roundtrip(self):
+        arrays = {'a': np.random.randn(3, 5).astype('f'),
+                  'b/c': np.arange(7, dtype=np.int64),
+                  'd': np.array(2.5),
+                  'e': np.zeros((0, 4), dtype=np.float16),
+                  'f': np.random.randn(4, 6)[:, ::2]}
+        save_arrays(self.path, arrays)
+        self.assertTrue(is_raw_file(self.path))
+        for mmap_mode in (True, False):
+            loaded = load_arrays(self.path, mmap_mode)
+            self.assertEqual(sorted(loaded), sorted(arrays))
+            for key, a in arrays.items():
+                self.assertEqual(loaded[key].dtype, a.dtype)
+                self.assertTrue(np.array_equal(loaded[key], a))
+                self.assertEqual(loaded[key].ctypes.data % 64, 0)
+
+    def test_copy_on_write(self):
+        save_arrays(self.path, {'a': np.ones(10, dtype='f')})
+        a = load_arrays(self.path)['a']
+        a += 1
+        self.assertTrue(np.all(load_arrays(self.path)['a'] == 1))
+
+    def test_weights(self):
+        x = np.random.randn(2, 4).astype('f')
+        model = MLP((5, 2))
+        model(x)
+        model.save_weights(self.path)
+        npz = os.path.join(self.tmpdir, 'w.npz')
+        model.save_weights(npz)
+        self.assertFalse(is_raw_file(npz))
+
+        for path in (self.path, npz):
+            model2 = MLP((5, 2))
+            model2.load_weights(path)
+            self.assertTrue(array_allclose(model(x).data, model2(x).data))
+
+    def test_checkpoint(self):
+        x = np.random.randn(2, 4).astype('f')
+        model = MLP((5, 2))
+        model(x)
+        optimizer = optimizers.Adam().setup(model)
+        model.cleargrads()
+        model(x).sum().backward()
+        optimizer.update()
+        save_checkpoint(self.path, model, optimizer)
+
+        model2 = MLP((5, 2))
+        optimizer2 = optimizers.Adam().setup(model2)
+        load_checkpoint(self.path, model2, optimizer2)
+        self.assertTrue(array_allclose(model(x).data, model2(x).data))
+        self.assertEqual(optimizer2.t, 1)
+        self.assertTrue(array_allclose(optimizer2.vs['l0/W'],
+                                       optimizer.vs['l0/W']))
+
+
+class TestCheckpointWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.x = np.random.randn(2, 4).astype('f')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_keep(self):
+        model = MLP((5, 2))
+        model(self.x)
+        optimizer = optimizers.MomentumSGD().setup(model)
+        with CheckpointWriter(self.tmpdir, keep=2) as writer:
+            for step in range(4):
+                model.cleargrads()
+                model(self.x).sum().backward()
+                optimizer.update()
+                writer.save(model, optimizer)
+                expected = model(self.x).data
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         ['ckpt_00000002.dzw', 'ckpt_00000003.dzw'])
+        self.assertEqual(writer.latest(),
+                         os.path.join(self.tmpdir, 'ckpt_00000003.dzw'))
+
+        model2 = MLP((5, 2))
+        optimizer2 = optimizers.MomentumSGD().setup(model2)
+        load_checkpoint(writer.latest(), model2, optimizer2)
+        self.assertTrue(array_allclose(model2(self.x).data, expected))
+
+        self.assertEqual(len(writer.history), 4)
+        for stats in writer.history:
+            self.assertGreater(stats['bytes'], 0)
+            self.assertGreaterEqual(stats['write_seconds'], 0)
+
+        with self.assertRaises(ValueError):
+            CheckpointWriter(self.tmpdir, keep=0)
+
+    def test_snapshot(self):
+        model = MLP((5, 2))
+        model(self.x)
+        with CheckpointWriter(self.tmpdir, ext='.npz') as writer:
+            writer.save(model, step=10)
+            W = model.l0.W.data.copy()
+            model.l0.W.data += 1  # after save returns, must not leak in
+        arrays = load_arrays(writer.path(10))
+        self.assertTrue(np.array_equal(arrays['model/l0/W'], W))
+
+    def test_error(self):
+        model = MLP((5, 2))
+        model(self.x)
+        writer = CheckpointWriter(self.tmpdir)
+        writer.directory = os.path.join(self.tmpdir, 'missing')
+        writer.save(model)
+        with self.assertRaises(OSError):
+            writer.wait()
+        writer.close()
+
+
+class TestShardedCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.x = np.random.randn(8, 4).astype('f')
+        self.t = np.random.randn(8, 2).astype('f')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _train(self, model, optimizer):
+        model.cleargrads()
+        loss = F.mean_squared_error(model(self.x), self.t)
+        loss.backward()
+        optimizer.update()
+
+    def test_incremental(self):
+        model = MLP((5, 3, 2))
+        model(self.x)
+        optimizer = optimizers.Adam().setup(model)
+        self._train(model, optimizer)
+        stats = save_sharded(self.tmpdir, model, optimizer)
+        self.assertEqual(stats['written'], ['_root', 'l0', 'l1', 'l2'])
+
+        stats = save_sharded(self.tmpdir, model, optimizer)
+        self.assertEqual(stats['written'], [])
+        self.assertEqual(stats['bytes_written'], 0)
+
+        optimizer.add_hook(optimizers.FreezeParam(model.l0, model.l1))
+        self._train(model, optimizer)
+        stats = save_sharded(self.tmpdir, model, optimizer)
+        self.assertEqual(stats['written'], ['_root', 'l2'])
+        self.assertEqual(stats['skipped'], ['l0', 'l1'])
+        files = [f for f in os.listdir(self.tmpdir) if f.endswith('.dzw')]
+        self.assertEqual(len(files), 4)
+
+        model2 = MLP((5, 3, 2))
+        optimizer2 = optimizers.Adam().setup(model2)
+        load_sharded(self.tmpdir, model2, optimizer2, workers=2)
+        self.assertTrue(array_allclose(model(self.x).data,
+                                       model2(self.x).data))
+        self.assertEqual(optimizer2.t, 2)
+        self.assertTrue(array_allclose(optimizer2.ms['l2/W'],
+                                       optimizer.ms['l2/W']))
+
+    def test_depth(self):
+        model = MLP((5, 2))
+        model(self.x)
+        stats = save_sharded(self.tmpdir, model, depth=2)
+        self.assertEqual(stats['written'], ['l0', 'l1'])
+        model2 = MLP((5, 2))
+        load_sharded(self.tmpdir, model2, mmap_mode=False)
+        self.assertTrue(array_allclose(model(self.x).data,
+                                       model2(self.x).data))
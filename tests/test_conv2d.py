@@ -1,8 +1,11 @@
 import unittest
 import numpy as np
+import dezero
+from dezero import Variable
 import dezero.layers as L
 import dezero.functions as F
-from dezero.utils import gradient_check, array_equal
+from dezero.models import Sequential
+from dezero.utils import gradient_check, array_equal, array_allclose
 import chainer.functions as CF
 
 
@@ -143,4 +146,259 @@ class TestConv2d(unittest.TestCase):
         W = np.random.randn(o, c, k[0], k[1])
         b = np.random.randn(o)
         f = lambda W: F.conv2d(x, W, b, s, p)
-        self.assertTrue(gradient_check(f, W))
\ No newline at end of file
+        self.assertTrue(gradient_check(f, W))
+
+
+class TestConv2dReLU(unittest.TestCase):
+
+    def _inputs(self):
+        # a fixed draw whose pre-activations are at least 4e-3 away from
+        # the kink of relu, far more than the shift gradient_check makes
+        rng = np.random.RandomState(0)
+        x = rng.randn(1, 5, 20, 15)
+        W = rng.randn(3, 5, 5, 3)
+        b = rng.randn(3)
+        return x, W, b
+
+    def test_forward1(self):
+        n, c, h, w = 1, 5, 20, 15
+        o, k, s, p = 3, (5, 3), 1, 3
+        x = np.random.randn(n, c, h, w).astype('f')
+        W = np.random.randn(o, c, k[0], k[1]).astype('f')
+        b = np.random.randn(o).astype('f')
+        y = F.conv2d_relu(x, W, b, s, p)
+        expected = CF.relu(CF.convolution_2d(x, W, b, s, p))
+        self.assertTrue(array_equal(expected.data, y.data))
+
+    def test_backward1(self):
+        s, p = 1, 3
+        x, W, b = self._inputs()
+        f = lambda x: F.conv2d_relu(x, W, b, s, p)
+        self.assertTrue(gradient_check(f, x))
+
+    def test_backward2(self):
+        s, p = 1, 3
+        x, W, b = self._inputs()
+        f = lambda W: F.conv2d_relu(x, W, b, s, p)
+        self.assertTrue(gradient_check(f, W))
+
+
+class TestGroupedConv2d(unittest.TestCase):
+
+    def test_forward1(self):
+        n, c, h, w = 2, 6, 15, 15
+        o, k, s, p, g = 9, (3, 3), (2, 1), (1, 2), 3
+        x = np.random.randn(n, c, h, w).astype('f')
+        W = np.random.randn(o, c // g, k[0], k[1]).astype('f')
+        b = np.random.randn(o).astype('f')
+        y = F.conv2d(x, W, b, s, p, groups=g)
+        expected = CF.convolution_2d(x, W, b, s, p, groups=g)
+        self.assertTrue(array_allclose(expected.data, y.data))
+
+    def test_forward2(self):
+        # depthwise
+        n, c, h, w = 2, 6, 15, 15
+        o, k, s, p, g = 12, (3, 3), 2, 1, 6
+        x = np.random.randn(n, c, h, w).astype('f')
+        W = np.random.randn(o, c // g, k[0], k[1]).astype('f')
+        b = np.random.randn(o).astype('f')
+        y = F.conv2d(x, W, b, s, p, groups=g)
+        expected = CF.convolution_2d(x, W, b, s, p, groups=g)
+        self.assertTrue(array_allclose(expected.data, y.data))
+
+    def test_forward3(self):
+        n, c, h, w = 2, 4, 15, 15
+        x = np.random.randn(n, c, h, w).astype('f')
+        layer = L.Conv2d(4, kernel_size=3, pad=1, groups=4)
+        y = layer(x)
+        self.assertEqual(layer.W.shape, (4, 1, 3, 3))
+        expected = CF.convolution_2d(x, layer.W.data, layer.b.data, 1, 1,
+                                     groups=4)
+        self.assertTrue(array_allclose(expected.data, y.data))
+
+    def test_backward1(self):
+        n, c, h, w = 1, 4, 7, 6
+        o, k, s, p, g = 6, (3, 3), 2, 1, 2
+        x = np.random.randn(n, c, h, w)
+        W = np.random.randn(o, c // g, k[0], k[1])
+        b = np.random.randn(o)
+        f = lambda x: F.conv2d(x, W, b, s, p, groups=g)
+        self.assertTrue(gradient_check(f, x))
+
+    def test_backward2(self):
+        n, c, h, w = 1, 4, 7, 6
+        o, k, s, p, g = 6, (3, 3), 2, 1, 2
+        x = np.random.randn(n, c, h, w)
+        W = np.random.randn(o, c // g, k[0], k[1])
+        b = np.random.randn(o)
+        f = lambda W: F.conv2d(x, W, b, s, p, groups=g)
+        self.assertTrue(gradient_check(f, W))
+
+    def test_backward3(self):
+        # depthwise
+        n, c, h, w = 1, 4, 7, 6
+        o, k, s, p, g = 8, (3, 3), 2, 1, 4
+        x = np.random.randn(n, c, h, w)
+        W = np.random.randn(o, c // g, k[0], k[1])
+        b = np.random.randn(o)
+        f = lambda x: F.conv2d(x, W, b, s, p, groups=g)
+        self.assertTrue(gradient_check(f, x))
+
+    def test_backward4(self):
+        # depthwise
+        n, c, h, w = 1, 4, 7, 6
+        o, k, s, p, g = 8, (3, 3), 2, 1, 4
+        x = np.random.randn(n, c, h, w)
+        W = np.random.randn(o, c // g, k[0], k[1])
+        b = np.random.randn(o)
+        f = lambda W: F.conv2d(x, W, b, s, p, groups=g)
+        self.assertTrue(gradient_check(f, W))
+
+
+class TestDilatedConv2d(unittest.TestCase):
+
+    def test_forward1(self):
+        n, c, h, w = 2, 3, 15, 14
+        o, k, s, p, d = 5, (3, 3), 1, 2, 2
+        x = np.random.randn(n, c, h, w).astype('f')
+        W = np.random.randn(o, c, k[0], k[1]).astype('f')
+        b = np.random.randn(o).astype('f')
+        y = F.conv2d(x, W, b, s, p, dilate=d)
+        expected = CF.convolution_2d(x, W, b, s, p, dilate=d)
+        self.assertTrue(array_allclose(expected.data, y.data))
+
+    def test_forward2(self):
+        n, c, h, w = 2, 3, 15, 14
+        o, k, s, p, d = 5, (3, 2), (2, 1), (1, 3), (2, 3)
+        x = np.random.randn(n, c, h, w).astype('f')
+        W = np.random.randn(o, c, k[0], k[1]).astype('f')
+        b = np.random.randn(o).astype('f')
+        y = F.conv2d(x, W, b, s, p, dilate=d)
+        expected = CF.convolution_2d(x, W, b, s, p, dilate=d)
+        self.assertTrue(array_allclose(expected.data, y.data))
+
+    def test_forward3(self):
+        # depthwise
+        n, c, h, w = 2, 4, 15, 15
+        o, k, s, p, d, g = 8, (3, 3), 2, 2, 2, 4
+        x = np.random.randn(n, c, h, w).astype('f')
+        W = np.random.randn(o, c // g, k[0], k[1]).astype('f')
+        y = F.conv2d(x, W, None, s, p, dilate=d, groups=g)
+        expected = CF.convolution_2d(x, W, None, s, p, dilate=d, groups=g)
+        self.assertTrue(array_allclose(expected.data, y.data))
+
+    def test_forward4(self):
+        n, c, h, w = 2, 3, 12, 12
+        x = np.random.randn(n, c, h, w).astype('f')
+        layer = L.Conv2d(4, kernel_size=3, pad=2, dilate=2)
+        y = layer(x)
+        self.assertEqual(y.shape, (n, 4, h, w))
+        expected = CF.convolution_2d(x, layer.W.data, layer.b.data, 1, 2,
+                                     dilate=2)
+        self.assertTrue(array_allclose(expected.data, y.data))
+
+    def test_backward1(self):
+        n, c, h, w = 1, 3, 9, 8
+        o, k, s, p, d = 4, (3, 3), 2, 1, (2, 3)
+        x = np.random.randn(n, c, h, w)
+        W = np.random.randn(o, c, k[0], k[1])
+        b = np.random.randn(o)
+        f = lambda x: F.conv2d(x, W, b, s, p, dilate=d)
+        self.assertTrue(gradient_check(f, x))
+
+    def test_backward2(self):
+        n, c, h, w = 1, 3, 9, 8
+        o, k, s, p, d = 4, (3, 3), 2, 1, (2, 3)
+        x = np.random.randn(n, c, h, w)
+        W = np.random.randn(o, c, k[0], k[1])
+        b = np.random.randn(o)
+        f = lambda W: F.conv2d(x, W, b, s, p, dilate=d)
+        self.assertTrue(gradient_check(f, W))
+
+    def test_backward3(self):
+        # grouped
+        n, c, h, w = 1, 4, 9, 8
+        o, k, s, p, d, g = 6, (3, 3), 1, 2, 2, 2
+        x = np.random.randn(n, c, h, w)
+        W = np.random.randn(o, c // g, k[0], k[1])
+        f = lambda W: F.conv2d(x, W, None, s, p, dilate=d, groups=g)
+        self.assertTrue(gradient_check(f, W))
+
+    def test_positional_groups(self):
+        # dilate comes after the arguments that predate it
+        n, c, h, w = 2, 4, 9, 8
+        o, k, s, p, g = 6, (3, 3), 1, 1, 2
+        x = np.random.randn(n, c, h, w).astype('f')
+        W = np.random.randn(o, c // g, k[0], k[1]).astype('f')
+        y = F.conv2d(x, W, None, s, p, g)
+        expected = CF.convolution_2d(x, W, None, s, p, groups=g)
+        self.assertTrue(array_allclose(expected.data, y.data))
+        layer = L.Conv2d(o, k, s, p, True, np.float32, c, g)
+        self.assertEqual(layer(x).shape, expected.shape)
+        self.assertEqual(layer.dilate, 1)
+
+
+class TestConv2dWorkers(unittest.TestCase):
+
+    def test_forward1(self):
+        n, c, h, w = 5, 4, 9, 8
+        o, k, s, p = 6, (3, 3), 2, 1
+        x = np.random.randn(n, c, h, w).astype('f')
+        W = np.random.randn(o, c, k[0], k[1]).astype('f')
+        b = np.random.randn(o).astype('f')
+        expected = F.conv2d(x, W, b, s, p)
+        with dezero.using_config('conv_workers', 3):
+            y = F.conv2d(x, W, b, s, p)
+        self.assertTrue(array_allclose(expected.data, y.data))
+
+    def test_backward1(self):
+        n, c, h, w = 5, 4, 9, 8
+        o, k, s, p = 6, (3, 3), 2, 1
+        x = Variable(np.random.randn(n, c, h, w))
+        W = Variable(np.random.randn(o, c, k[0], k[1]))
+        b = Variable(np.random.randn(o))
+        F.sum(F.conv2d(x, W, b, s, p) ** 2).backward()
+        gx, gW = x.grad.data, W.grad.data
+        x.cleargrad()
+        W.cleargrad()
+        with dezero.using_config('conv_workers', 3):
+            y = F.conv2d(x, W, b, s, p)
+            F.sum(y ** 2).backward()
+        self.assertTrue(array_allclose(gx, x.grad.data))
+        self.assertTrue(array_allclose(gW, W.grad.data))
+        # the im2col times of all chunks are summed
+        stats = y.creator.col_stats
+        self.assertGreater(stats['forward_seconds'], 0.)
+        self.assertGreater(stats['backward_seconds'], 0.)
+
+
+class TestConv2dKeepCol(unittest.TestCase):
+
+    def test_backward1(self):
+        n, c, h, w = 2, 4, 9, 8
+        o, k, s, p = 6, (3, 3), 2, 1
+        x = np.random.randn(n, c, h, w)
+        b = np.random.randn(o)
+        W = Variable(np.random.randn(o, c, k[0], k[1]))
+        F.sum(F.conv2d(x, W, b, s, p, keep_col=False) ** 2).backward()
+        expected = W.grad.data
+        W.cleargrad()
+        y = F.conv2d(x, W, b, s, p, keep_col=True)
+        F.sum(y ** 2).backward()
+        self.assertTrue(array_allclose(expected, W.grad.data))
+        self.assertTrue(y.creator.col_stats['kept'])
+        self.assertEqual(y.creator.col_stats['backward_seconds'], 0.)
+
+    def test_backward2(self):
+        n, c, h, w = 2, 4, 9, 8
+        x = np.random.randn(n, c, h, w).astype('f')
+        model = Sequential(L.Conv2d(6, 3, pad=1))
+        with dezero.using_config('conv_col_budget', 10 ** 9):
+            F.sum(model(x)).backward()
+        stats = L.conv_col_stats(model)['l0']
+        self.assertTrue(stats['kept'])
+        self.assertEqual(stats['bytes'], n * c * 3 * 3 * h * w * 4)
+        F.sum(model(x)).backward()
+        stats = L.conv_col_stats(model)['l0']
+        self.assertFalse(stats['kept'])
+        self.assertGreater(stats['backward_seconds'], 0.)
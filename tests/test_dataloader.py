@@ -0,0 +1,318 @@
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import dezero
+from dezero import DataLoader, SeqDataLoader
+from dezero.dataloaders import BucketSampler, DistributedSampler
+from dezero.dataloaders import pad_collate, pad_sequences
+import dezero.datasets as D
+import dezero.transforms as T
+
+
+class Squares(dezero.Dataset):
+    def prepare(self):
+        self.data = np.arange(50, dtype=np.float32).reshape(25, 2)
+        self.label = np.arange(25)
+
+
+class Broken(Squares):
+    def __getitem__(self, index):
+        if index == 7:
+            raise ValueError('bad example')
+        return super().__getitem__(index)
+
+
+def _epoch(loader):
+    return [(x.copy(), t.copy()) for x, t in loader]
+
+
+def _equal(batches, expected):
+    return len(batches) == len(expected) and all(
+        np.array_equal(x, ex) and np.array_equal(t, et)
+        for (x, t), (ex, et) in zip(batches, expected))
+
+
+class TestDataLoader(unittest.TestCase):
+
+    def test_workers(self):
+        dataset = Squares()
+        expected = _epoch(DataLoader(dataset, 4, seed=0))
+        for multiprocess in (True, False):
+            with DataLoader(dataset, 4, seed=0, num_workers=2,
+                            multiprocess=multiprocess) as loader:
+                self.assertTrue(_equal(_epoch(loader), expected))
+                self.assertEqual(len(loader._workers), 2)
+            self.assertEqual(loader._workers, [])
+
+    def test_seed(self):
+        dataset = Squares()
+        loader = DataLoader(dataset, 4, seed=3, num_workers=2, prefetch=3)
+        for x, t in loader:
+            break  # leaves batches of epoch 0 in flight
+        loader.reset()
+        order = np.random.RandomState(3 + 1).permutation(25)
+        x = np.concatenate([x for x, t in loader])
+        self.assertTrue(np.array_equal(x, dataset.data[order]))
+        loader.close()
+
+    def test_seq(self):
+        dataset = Squares()
+        expected = _epoch(SeqDataLoader(dataset, 5))
+        loader = SeqDataLoader(dataset, 5, num_workers=2)
+        self.assertTrue(_equal(_epoch(loader), expected))
+        self.assertTrue(_equal(_epoch(loader), expected))
+        loader.close()
+
+    def test_no_label(self):
+        dataset = Squares()
+        dataset.label = None
+        with DataLoader(dataset, 10, shuffle=False, num_workers=1) as loader:
+            x, t = next(loader)
+        self.assertTrue(np.array_equal(x, dataset.data[:10]))
+        self.assertEqual(list(t), [None] * 10)
+
+    def test_worker_error(self):
+        loader = DataLoader(Broken(), 5, shuffle=False, num_workers=2)
+        with self.assertRaises(RuntimeError):
+            _epoch(loader)
+        self.assertEqual(loader._workers, [])
+
+
+class TestGetBatch(unittest.TestCase):
+
+    def _check(self, dataset, indices):
+        x, t = dataset.get_batch(indices)
+        examples = [dataset[i] for i in indices]
+        self.assertTrue(np.array_equal(
+            x, np.array([example[0] for example in examples])))
+        self.assertEqual(x.dtype, np.array([examples[0][0]]).dtype)
+        self.assertTrue(np.array_equal(
+            t, np.array([example[1] for example in examples])))
+
+    def test_transforms(self):
+        indices = np.array([3, 0, 24, 3])
+        for transform in (None,
+                          T.Compose([T.Flatten(), T.ToFloat(),
+                                     T.Normalize(0., 255.)]),
+                          T.Compose([T.AsType(np.float64),
+                                     T.Normalize([1., 2.], [2., 4.])]),
+                          T.Normalize([1.], 3.)):
+            self._check(Squares(transform=transform), indices)
+        self._check(Squares(target_transform=T.ToInt(np.int8)), indices)
+
+    def test_fallback(self):
+        # per-example transforms and __getitem__ overrides still apply
+        self._check(Squares(transform=lambda x: x * 2), [1, 2])
+        dataset = Broken()
+        self._check(dataset, [1, 2])
+        with self.assertRaises(ValueError):
+            dataset.get_batch([7])
+
+
+class Tokens(dezero.Dataset):
+    def __init__(self, tokens):
+        self.tokens = tokens
+        super().__init__()
+
+    def prepare(self):
+        self.data, self.label = self.tokens[:-1], self.tokens[1:]
+
+
+class BrokenStream(dezero.StreamDataset):
+    def chunks(self, shard=0, num_shards=1):
+        yield np.arange(4), None
+        raise ValueError('bad chunk')
+
+
+class TestStream(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'corpus.bin')
+        self.tokens = np.random.randint(0, 1000, 301).astype(np.uint16)
+        self.tokens.tofile(self.path)
+
+    def _stream(self, **kwargs):
+        return D.TokenStream(self.path, dtype=np.uint16, chunk_size=16,
+                             **kwargs)
+
+    def _sorted(self, batches):
+        x = np.concatenate([x for x, t in batches])
+        t = np.concatenate([t for x, t in batches])
+        order = np.lexsort((t, x))
+        return x[order], t[order]
+
+    def test_shards(self):
+        stream = self._stream()
+        self.assertEqual(len(stream), 300)
+        for num_shards in (1, 3, 7):
+            x = np.concatenate([x for shard in range(num_shards)
+                                for x, t in stream.chunks(shard, num_shards)])
+            self.assertTrue(np.array_equal(x, self.tokens[:-1]))
+        x, t = zip(*stream)
+        self.assertTrue(np.array_equal(t, self.tokens[1:]))
+
+    def test_shuffle_buffer(self):
+        stream = self._stream(buffer_size=50)
+        rng = lambda: np.random.RandomState(0)
+        x = np.concatenate([x for x, t in stream.shuffled_chunks(rng=rng())])
+        y = np.concatenate([x for x, t in stream.shuffled_chunks(rng=rng())])
+        self.assertTrue(np.array_equal(x, y))
+        self.assertFalse(np.array_equal(x, self.tokens[:-1]))
+        self.assertTrue(np.array_equal(np.sort(x), np.sort(self.tokens[:-1])))
+
+    def test_loader(self):
+        stream = self._stream(buffer_size=40, transform=T.AsType(np.float32))
+        expected = self._sorted(_epoch(DataLoader(stream, 32)))
+        self.assertEqual(expected[0].dtype, np.float32)
+        self.assertTrue(np.array_equal(
+            expected[0], np.sort(self.tokens[:-1]).astype(np.float32)))
+        for multiprocess in (True, False):
+            with DataLoader(stream, 32, seed=1, num_workers=3,
+                            multiprocess=multiprocess) as loader:
+                batches = _epoch(loader)
+                self.assertTrue(all(len(x) <= 32 for x, t in batches))
+                self.assertEqual(self._sorted(batches)[0].tolist(),
+                                 expected[0].tolist())
+                self.assertTrue(_equal(
+                    _epoch(DataLoader(stream, 32, seed=1, num_workers=3,
+                                      multiprocess=multiprocess)),
+                    batches))
+                for x, t in loader:
+                    break  # the next epoch is cut short
+            self.assertEqual(loader._workers, [])
+
+    def test_seq(self):
+        expected = _epoch(SeqDataLoader(Tokens(self.tokens), 7))
+        self.assertTrue(_equal(_epoch(SeqDataLoader(self._stream(), 7)),
+                               expected))
+
+    def test_worker_error(self):
+        loader = DataLoader(BrokenStream(), 2, num_workers=2)
+        with self.assertRaises(RuntimeError):
+            _epoch(loader)
+        self.assertEqual(loader._workers, [])
+
+
+class Sentences(dezero.Dataset):
+    def prepare(self):
+        rng = np.random.RandomState(0)
+        lengths = rng.randint(1, 40, 97)
+        self.data = [rng.randint(1, 50, n) for n in lengths]
+        self.label = [x[::-1].copy() for x in self.data]
+
+
+class TestBucketSampler(unittest.TestCase):
+
+    def setUp(self):
+        self.dataset = Sentences()
+        self.lengths = [len(x) for x in self.dataset.data]
+
+    def test_batches(self):
+        sampler = BucketSampler(self.lengths, 8, bucket_size=32, seed=0)
+        batches = sampler.batches(0)
+        self.assertEqual(len(batches), len(sampler))
+        self.assertEqual(sorted(np.concatenate(batches)), list(range(97)))
+        self.assertTrue(all(np.array_equal(a, b) for a, b in
+                            zip(batches, sampler.batches(0))))
+        self.assertFalse(all(np.array_equal(a, b) for a, b in
+                             zip(batches, sampler.batches(1))))
+
+        stats = sampler.stats()
+        self.assertEqual(stats['tokens'], sum(self.lengths))
+        self.assertGreater(stats['bucketed']['efficiency'],
+                           stats['random']['efficiency'])
+        self.assertGreater(stats['random']['efficiency'],
+                           stats['global']['efficiency'])
+        self.assertIn('bucketed', sampler.summary())
+
+    def test_loader(self):
+        sampler = BucketSampler(self.lengths, 8, seed=1)
+        for num_workers in (0, 2):
+            with DataLoader(self.dataset, None, sampler=sampler,
+                            collate=pad_collate,
+                            num_workers=num_workers) as loader:
+                self.assertEqual(loader.max_iter, len(sampler))
+                batches = [batch for batch in loader]
+            self.assertEqual(len(batches), len(sampler))
+            for (x, t, mask), index in zip(batches, sampler.batches(0)):
+                lengths = mask.sum(axis=1)
+                self.assertEqual(lengths.tolist(),
+                                 [self.lengths[i] for i in index])
+                self.assertEqual(x.shape[1], lengths.max())
+                for row, label, n, i in zip(x, t, lengths, index):
+                    self.assertTrue(np.array_equal(row[:n],
+                                                   self.dataset.data[i]))
+                    self.assertTrue(np.array_equal(label[:n],
+                                                   self.dataset.label[i]))
+                    self.assertFalse(row[n:].any())
+
+    def test_pad_sequences(self):
+        x, mask = pad_sequences([[1, 2, 3], [4], []], length=2, value=-1,
+                                dtype=np.float32)
+        self.assertEqual(x.dtype, np.float32)
+        self.assertEqual(x.tolist(), [[1, 2], [4, -1], [-1, -1]])
+        self.assertEqual(mask.tolist(), [[True, True], [True, False],
+                                         [False, False]])
+        with self.assertRaises(ValueError):
+            pad_sequences([])
+
+
+def _rank_indices(dataset, num_replicas, rank, epochs, results):
+    sampler = DistributedSampler(len(dataset), num_replicas, rank, 4, seed=5)
+    loader = DataLoader(dataset, None, sampler=sampler)
+    seen = []
+    for _ in range(epochs):
+        seen.append(np.concatenate([t for x, t in loader]).tolist())
+    results.put((rank, seen))
+
+
+class TestDistributedSampler(unittest.TestCase):
+
+    def test_shares(self):
+        for data_size, drop_last in ((25, False), (25, True), (24, False)):
+            samplers = [DistributedSampler(data_size, 4, rank, 3,
+                                           drop_last=drop_last)
+                        for rank in range(4)]
+            shares = [s.indices(2) for s in samplers]
+            self.assertEqual(len({len(s) for s in shares}), 1)
+            self.assertEqual(len({len(s) for s in samplers}), 1)
+            indices = np.concatenate(shares)
+            unique = np.unique(indices)
+            if drop_last:
+                self.assertEqual(len(indices), 24)
+                self.assertEqual(len(unique), 24)
+            else:
+                self.assertEqual(len(indices), 4 * math.ceil(data_size / 4))
+                self.assertEqual(unique.tolist(), list(range(data_size)))
+            self.assertTrue(np.array_equal(
+                np.concatenate(samplers[1].batches(2)), shares[1]))
+        self.assertFalse(np.array_equal(samplers[0].indices(0),
+                                        samplers[0].indices(1)))
+        with self.assertRaises(ValueError):
+            DistributedSampler(10, 2, 2, 1)
+
+    def test_processes(self):
+        ctx = multiprocessing.get_context('fork')
+        results = ctx.Queue()
+        ranks = [ctx.Process(target=_rank_indices,
+                             args=(Squares(), 3, rank, 2, results))
+                 for rank in range(3)]
+        for p in ranks:
+            p.start()
+        seen = dict(results.get(timeout=30) for _ in ranks)
+        for p in ranks:
+            p.join()
+        for epoch in range(2):
+            indices = sorted(i for rank in range(3)
+                             for i in seen[rank][epoch])
+            # padded with the first two of the permutation
+            order = np.random.RandomState(5 + epoch).permutation(25)
+            self.assertEqual(indices, sorted(list(range(25)) +
+                                             order[:2].tolist()))
+        self.assertNotEqual(seen[0][0], seen[0][1])
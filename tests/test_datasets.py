@@ -0,0 +1,206 @@
+import io
+import os
+import pickle
+import shutil
+import tarfile
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+import dezero.datasets as D
+from dezero import DataLoader
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        patcher = mock.patch.object(D, 'cache_dir', self.dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.data = np.random.randint(0, 256, (20, 3, 4, 4)).astype(np.uint8)
+        self.label = np.arange(20)
+        self.url = 'https://example.com/data.tar.gz'
+
+    def _save(self):
+        with mock.patch('builtins.print'):
+            return D.save_cache(self.data, self.label, self.url, train=True)
+
+    def test_roundtrip(self):
+        self.assertEqual(D.load_cache(self.url, train=True), (None, None))
+        self._save()
+        data, label = D.load_cache(self.url, train=True)
+        self.assertIsInstance(data, np.memmap)
+        self.assertEqual(data.dtype, np.uint8)
+        self.assertFalse(data.flags.writeable)
+        self.assertTrue(np.array_equal(data, self.data))
+        self.assertTrue(np.array_equal(label, self.label))
+        self.assertEqual(D.load_cache(self.url, train=False), (None, None))
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['data.tar.gz.train.data.npy',
+                          'data.tar.gz.train.json',
+                          'data.tar.gz.train.label.npy'])
+
+    def test_corrupted(self):
+        filepath = self._save()
+        path = filepath + '.data.npy'
+        stat = os.stat(path)
+        with open(path, 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            byte = f.read(1)
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes([byte[0] ^ 1]))
+        self.assertEqual(D.load_cache(self.url, train=True), (None, None))
+
+        # same size and mtime: only caught by a full verification
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        data, _ = D.load_cache(self.url, train=True)
+        self.assertIsNotNone(data)
+        self.assertEqual(D.load_cache(self.url, train=True, verify=True),
+                         (None, None))
+
+        self._save()  # rebuilding overwrites the bad cache
+        data, _ = D.load_cache(self.url, train=True, verify=True)
+        self.assertTrue(np.array_equal(data, self.data))
+
+    def test_dataset(self):
+        self._save()
+        data, label = D.load_cache(self.url, train=True)
+        dataset = D.Dataset()
+        dataset.data, dataset.label = data, label
+        x, t = dataset.get_batch(np.array([3, 1]))
+        self.assertTrue(np.array_equal(x, self.data[[3, 1]]))
+        x, t = dataset[5]
+        self.assertTrue(np.array_equal(x, self.data[5]))
+        with DataLoader(dataset, 8, shuffle=False, num_workers=2) as loader:
+            x = np.concatenate([x for x, t in loader])
+        self.assertTrue(np.array_equal(x, self.data))
+
+
+def _cifar_tarball(path, folder, batches):
+    with tarfile.open(path, 'w:gz') as tar:
+        for name, batch in batches:
+            payload = pickle.dumps(batch)
+            info = tarfile.TarInfo('{}/{}'.format(folder, name))
+            info.size = len(payload)
+            tar.addfile(info, io.BytesIO(payload))
+
+
+class TestCIFAR(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'cifar.tar.gz')
+        for patcher in (mock.patch.object(D, 'cache_dir', self.dir),
+                        mock.patch.object(D, 'get_file',
+                                          lambda url: self.path),
+                        mock.patch('builtins.print')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.rng = np.random.RandomState(0)
+
+    def _batch(self, n, **labels):
+        batch = {b'data': self.rng.randint(0, 256, (n, 3072)).astype('u1')}
+        for key, classes in labels.items():
+            batch[key.encode()] = list(self.rng.randint(0, classes, n))
+        return batch
+
+    def test_cifar10(self):
+        batches = [('data_batch_{}'.format(i + 1), self._batch(4, labels=10))
+                   for i in range(5)]
+        test = self._batch(3, labels=10)
+        # stored out of order, among members that are not batches
+        _cifar_tarball(self.path, 'cifar-10-batches-py',
+                       [('readme.html', {}), ('test_batch', test)] +
+                       batches[3:] + [('batches.meta', {})] + batches[:3])
+
+        dataset = D.CIFAR10(train=True)
+        data = np.concatenate([b[b'data'] for _, b in batches])
+        label = np.concatenate([b[b'labels'] for _, b in batches])
+        self.assertEqual(dataset.data.dtype, np.uint8)
+        self.assertTrue(np.array_equal(dataset.data,
+                                       data.reshape(20, 3, 32, 32)))
+        self.assertTrue(np.array_equal(dataset.label, label))
+
+        dataset = D.CIFAR10(train=False)
+        self.assertTrue(np.array_equal(dataset.data.reshape(3, -1),
+                                       test[b'data']))
+
+        os.remove(self.path)  # now served from the cache
+        self.assertEqual(len(D.CIFAR10(train=True)), 20)
+
+    def test_cifar100(self):
+        train = self._batch(6, fine_labels=100, coarse_labels=20)
+        _cifar_tarball(self.path, 'cifar-100-python',
+                       [('meta', {}), ('train', train),
+                        ('test', self._batch(2, fine_labels=100,
+                                             coarse_labels=20))])
+        for label_type in ('fine', 'coarse'):
+            dataset = D.CIFAR100(train=True, label_type=label_type)
+            self.assertTrue(np.array_equal(
+                dataset.label, train['{}_labels'.format(label_type).encode()]))
+            self.assertTrue(np.array_equal(dataset.data.reshape(6, -1),
+                                           train[b'data']))
+
+    def test_errors(self):
+        _cifar_tarball(self.path, 'cifar-10-batches-py',
+                       [('data_batch_1', self._batch(4, labels=10)),
+                        ('data_batch_2', self._batch(3, labels=10))])
+        with self.assertRaises(ValueError):
+            D.extract_cifar(self.path, ['data_batch_1', 'data_batch_2'])
+        with self.assertRaises(ValueError):
+            D.extract_cifar(self.path, ['data_batch_1', 'data_batch_3'])
+
+
+class TestShakespear(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'shakespear.txt')
+        self.text = 'First Citizen:\nBefore we proceed any further, ' \
+                    'hear me speak.\n\nAll:\nSpeak, speak.\n' * 3
+        with open(self.path, 'w') as f:
+            f.write(self.text)
+        for patcher in (mock.patch.object(D, 'cache_dir', self.dir),
+                        mock.patch.object(D, 'get_file',
+                                          lambda url, name: self.path),
+                        mock.patch('builtins.print')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_encoding(self):
+        dataset = D.Shakespear()
+        char_to_id = {}
+        for c in self.text:
+            char_to_id.setdefault(c, len(char_to_id))
+        ids = [char_to_id[c] for c in self.text]
+        self.assertEqual(dataset.char_to_id, char_to_id)
+        self.assertEqual(dataset.data.tolist(), ids[:-1])
+        self.assertEqual(dataset.label.tolist(), ids[1:])
+        self.assertIsInstance(dataset.data, np.memmap)
+        self.assertEqual(dataset.decode(dataset.data), self.text[:-1])
+        self.assertEqual(dataset.encode('Speak').tolist(),
+                         [char_to_id[c] for c in 'Speak'])
+        with self.assertRaises(ValueError):
+            dataset.encode('Z')
+
+    def test_chunks(self):
+        ids, vocab = D.encode_text(self.path, chunk_size=7)
+        chars = ''.join(dict.fromkeys(self.text))
+        char_to_id = {c: i for i, c in enumerate(chars)}
+        self.assertEqual(ids.tolist(), [char_to_id[c] for c in self.text])
+        self.assertEqual(vocab.tobytes().decode(), chars)
+
+    def test_cache(self):
+        D.Shakespear()
+        with mock.patch.object(D, 'build_vocab') as build_vocab:
+            D.Shakespear()
+        build_vocab.assert_not_called()
+
+        with open(self.path, 'a') as f:
+            f.write('Zounds!')
+        dataset = D.Shakespear()
+        self.assertEqual(dataset.decode(dataset.label[-7:]), 'Zounds!')
@@ -71,4 +71,92 @@ class TestDeconv2d(unittest.TestCase):
         W = np.random.uniform(0, 1, (c_i, c_o, h_k, w_k))
         b = np.random.uniform(0, 1, c_o)
         f = lambda b: F.deconv2d(x, W, b, stride=(s_y, s_x), pad=(h_p, w_p))
-        self.assertTrue(gradient_check(f, b))
\ No newline at end of file
+        self.assertTrue(gradient_check(f, b))
+
+
+class TestGroupedDeconv2d(unittest.TestCase):
+
+    def test_forward1(self):
+        n, c_i, c_o, g = 2, 4, 6, 2
+        h_i, w_i = 5, 6
+        x = np.random.uniform(0, 1, (n, c_i, h_i, w_i)).astype(np.float32)
+        W = np.random.uniform(0, 1, (c_i, c_o // g, 3, 3)).astype(np.float32)
+        b = np.random.uniform(0, 1, c_o).astype(np.float32)
+        expected = CF.deconvolution_2d(x, W, b, stride=2, pad=1, groups=g)
+        y = F.deconv2d(x, W, b, stride=2, pad=1, groups=g)
+        self.assertTrue(array_allclose(expected.data, y.data))
+
+    def test_forward2(self):
+        # depthwise
+        n, c_i, c_o, g = 2, 4, 8, 4
+        h_i, w_i = 5, 6
+        x = np.random.uniform(0, 1, (n, c_i, h_i, w_i)).astype(np.float32)
+        W = np.random.uniform(0, 1, (c_i, c_o // g, 3, 3)).astype(np.float32)
+        b = np.random.uniform(0, 1, c_o).astype(np.float32)
+        expected = CF.deconvolution_2d(x, W, b, stride=2, pad=1, groups=g)
+        y = F.deconv2d(x, W, b, stride=2, pad=1, groups=g)
+        self.assertTrue(array_allclose(expected.data, y.data))
+
+    def test_backward1(self):
+        n, c_i, c_o, g = 1, 4, 6, 2
+        x = np.random.uniform(0, 1, (n, c_i, 4, 3))
+        W = np.random.uniform(0, 1, (c_i, c_o // g, 3, 3))
+        b = np.random.uniform(0, 1, c_o)
+        f = lambda x: F.deconv2d(x, W, b, stride=2, pad=1, groups=g)
+        self.assertTrue(gradient_check(f, x))
+
+    def test_backward2(self):
+        # depthwise
+        n, c_i, c_o, g = 1, 4, 8, 4
+        x = np.random.uniform(0, 1, (n, c_i, 4, 3))
+        W = np.random.uniform(0, 1, (c_i, c_o // g, 3, 3))
+        b = np.random.uniform(0, 1, c_o)
+        f = lambda W: F.deconv2d(x, W, b, stride=2, pad=1, groups=g)
+        self.assertTrue(gradient_check(f, W))
+
+    def test_init(self):
+        # the scale follows the fan-in of one group, as in Conv2d
+        layer = L.Deconv2d(64, 3, in_channels=64, groups=16)
+        self.assertEqual(layer.W.shape, (64, 4, 3, 3))
+        std = np.sqrt(1 / (64 // 16 * 3 * 3))
+        self.assertAlmostEqual(float(layer.W.data.std()), std, delta=0.1 * std)
+
+
+class TestDilatedDeconv2d(unittest.TestCase):
+
+    def test_forward1(self):
+        n, c_i, c_o = 2, 3, 4
+        h_i, w_i = 5, 6
+        x = np.random.uniform(0, 1, (n, c_i, h_i, w_i)).astype(np.float32)
+        W = np.random.uniform(0, 1, (c_i, c_o, 3, 3)).astype(np.float32)
+        b = np.random.uniform(0, 1, c_o).astype(np.float32)
+        expected = CF.deconvolution_2d(x, W, b, stride=2, pad=1, dilate=2)
+        y = F.deconv2d(x, W, b, stride=2, pad=1, dilate=2)
+        self.assertTrue(array_allclose(expected.data, y.data))
+
+    def test_forward2(self):
+        # depthwise
+        n, c_i, c_o, g = 2, 4, 8, 4
+        h_i, w_i = 5, 6
+        x = np.random.uniform(0, 1, (n, c_i, h_i, w_i)).astype(np.float32)
+        W = np.random.uniform(0, 1, (c_i, c_o // g, 3, 3)).astype(np.float32)
+        expected = CF.deconvolution_2d(x, W, None, stride=1, pad=2,
+                                       dilate=(2, 3), groups=g)
+        y = F.deconv2d(x, W, None, stride=1, pad=2, dilate=(2, 3), groups=g)
+        self.assertTrue(array_allclose(expected.data, y.data))
+
+    def test_backward1(self):
+        n, c_i, c_o = 1, 3, 2
+        x = np.random.uniform(0, 1, (n, c_i, 4, 3))
+        W = np.random.uniform(0, 1, (c_i, c_o, 3, 3))
+        b = np.random.uniform(0, 1, c_o)
+        f = lambda x: F.deconv2d(x, W, b, stride=2, pad=1, dilate=2)
+        self.assertTrue(gradient_check(f, x))
+
+    def test_backward2(self):
+        n, c_i, c_o = 1, 3, 2
+        x = np.random.uniform(0, 1, (n, c_i, 4, 3))
+        W = np.random.uniform(0, 1, (c_i, c_o, 3, 3))
+        b = np.random.uniform(0, 1, c_o)
+        f = lambda W: F.deconv2d(x, W, b, stride=2, pad=1, dilate=2)
+        self.assertTrue(gradient_check(f, W))
@@ -0,0 +1,134 @@
+import os
+import copy
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import dezero
+import dezero.functions as F
+from dezero.models import MLP
+from dezero.utils import array_allclose
+
+
+def _train(model, x, t, steps=3):
+    optimizer = dezero.optimizers.MomentumSGD(lr=0.1).setup(model)
+    for _ in range(steps):
+        model.cleargrads()
+        loss = F.mean_squared_error(model(x), t)
+        loss.backward()
+        optimizer.update()
+
+
+class TestFlatParams(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.x = np.random.randn(8, 4).astype('f')
+        self.t = np.random.randn(8, 2).astype('f')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_views(self):
+        model = MLP((5, 3, 2))
+        model(self.x)
+        expected = {id(p): p.data.copy() for p in model.params()}
+        model.to_flat()
+
+        (data, grad), = model.flat_arrays()
+        self.assertEqual(data.size, sum(p.size for p in model.params()))
+        for p in model.params():
+            self.assertTrue(np.shares_memory(p.data, data))
+            self.assertTrue(np.shares_memory(p._flat_grad, grad))
+            self.assertIsNone(p.grad)
+            self.assertTrue(array_allclose(p.data, expected[id(p)]))
+
+    def test_grads(self):
+        model = MLP((5, 3, 2))
+        model(self.x)
+        ref = copy.deepcopy(model)
+        model.to_flat()
+
+        for m in (model, ref):
+            m.cleargrads()
+            loss = F.mean_squared_error(m(self.x), self.t)
+            loss.backward()
+
+        (data, grad), = model.flat_arrays()
+        self.assertTrue(np.any(grad != 0))
+        refs = {p.name + str(p.shape): p for p in ref.params()}
+        for p in model.params():
+            self.assertTrue(p.grad.data is p._flat_grad)
+            r = refs[p.name + str(p.shape)]
+            self.assertTrue(array_allclose(p.grad.data, r.grad.data))
+
+        model.cleargrads()
+        self.assertTrue(np.all(grad == 0))
+
+    def test_detached_grads(self):
+        model = MLP((5, 3, 2))
+        model(self.x)
+        ref = copy.deepcopy(model)
+        model.to_flat()
+        for m in (model, ref):
+            m.cleargrads()
+            F.mean_squared_error(m(self.x), self.t).backward()
+        W, b = model.l0.W, model.l1.b
+
+        # a cleared gradient is written by the next backward into the buffer
+        W.cleargrad()
+        W._flat_grad.fill(-1)
+        F.mean_squared_error(model(self.x), self.t).backward()
+        self.assertIs(W.grad.data, W._flat_grad)
+        self.assertTrue(array_allclose(W._flat_grad, ref.l0.W.grad.data))
+        b.cleargrad()
+        model.flat_arrays()
+        self.assertTrue(np.all(b._flat_grad == 0))
+        self.assertIsNone(b.grad)
+
+        # create_graph keeps the gradient graph; the buffer gets its values
+        model.cleargrads()
+        F.mean_squared_error(model(self.x), self.t).backward(
+            create_graph=True)
+        W._flat_grad.fill(-1)
+        model.flat_arrays()
+        self.assertIsNotNone(W.grad.creator)
+        self.assertTrue(array_allclose(W._flat_grad, ref.l0.W.grad.data))
+
+    def test_train(self):
+        model = MLP((5, 3, 2))
+        model(self.x)
+        ref = copy.deepcopy(model)
+        model.to_flat()
+
+        _train(model, self.x, self.t)
+        _train(ref, self.x, self.t)
+        self.assertTrue(array_allclose(model(self.x).data, ref(self.x).data))
+
+    def test_save_load(self):
+        path = os.path.join(self.tmpdir, 'w.npz')
+        model = MLP((5, 3, 2))
+        model(self.x)
+        model.to_flat()
+        _train(model, self.x, self.t)
+        model.save_weights(path)
+
+        plain = MLP((5, 3, 2))
+        plain.load_weights(path)
+        self.assertTrue(array_allclose(model(self.x).data,
+                                       plain(self.x).data))
+
+        flat = MLP((5, 3, 2))
+        flat(self.x)
+        flat.to_flat()
+        (data, grad), = flat.flat_arrays()
+        flat.load_weights(path)
+        for p in flat.params():
+            self.assertTrue(np.shares_memory(p.data, data))
+        self.assertTrue(array_allclose(model(self.x).data,
+                                       flat(self.x).data))
+
+    def test_uninitialized(self):
+        model = MLP((5, 3, 2))
+        with self.assertRaises(ValueError):
+            model.to_flat()
@@ -0,0 +1,82 @@
+import unittest
+import numpy as np
+import dezero.functions as F
+import dezero.layers as L
+from dezero.profiler import dry_run
+from dezero.utils import gradient_check, array_allclose
+
+
+def _fused_from(step):
+    # the [f, i, o, u] gate layout of F.lstm from the eight Linear layers
+    seq = L.SeqLSTM(step.x2f.out_size, in_size=step.x2f.in_size)
+    seq.W_x.data = np.concatenate(
+        [step.x2f.W.data, step.x2i.W.data, step.x2o.W.data, step.x2u.W.data],
+        axis=1)
+    seq.W_h.data = np.concatenate(
+        [step.h2f.W.data, step.h2i.W.data, step.h2o.W.data, step.h2u.W.data],
+        axis=1)
+    seq.b.data = np.concatenate(
+        [step.x2f.b.data, step.x2i.b.data, step.x2o.b.data, step.x2u.b.data])
+    return seq
+
+
+class TestLSTM(unittest.TestCase):
+
+    def setUp(self):
+        T, N, I, H = 5, 3, 4, 6
+        self.x = np.random.randn(T, N, I)
+        self.W_x = np.random.randn(I, 4 * H)
+        self.W_h = np.random.randn(H, 4 * H) * 0.5
+        self.b = np.random.randn(4 * H)
+        self.h = np.random.randn(N, H)
+        self.c = np.random.randn(N, H)
+
+    def test_forward(self):
+        step = L.LSTM(6, in_size=4)
+        seq = _fused_from(step)
+        x = self.x.astype('f')
+        for _ in range(2):  # the second call continues from the state
+            ys = [step(xt) for xt in x]
+            hs = seq(x)
+            expected = np.stack([y.data for y in ys])
+            self.assertTrue(array_allclose(hs.data, expected, atol=1e-6))
+            self.assertTrue(array_allclose(seq.c.data, step.c.data,
+                                           atol=1e-6))
+
+    def test_backward(self):
+        args = [self.x, self.W_x, self.W_h, self.b]
+        for state in ([], [self.h, self.c]):
+            inputs = args + state
+            for k in range(len(inputs)):
+                def f(v, k=k):
+                    a = list(inputs)
+                    a[k] = v
+                    hs, h, c = F.lstm(*a)
+                    return F.sum(hs * hs) + F.sum(h) + F.sum(c * c)
+                self.assertTrue(gradient_check(f, inputs[k]))
+
+    def test_backward_unused_outputs(self):
+        f = lambda x: F.lstm(x, self.W_x, self.W_h, self.b)[2]
+        self.assertTrue(gradient_check(f, self.x))
+
+    def test_grads_match_step(self):
+        step = L.LSTM(6, in_size=4)
+        seq = _fused_from(step)
+        x = self.x.astype('f')
+        loss = 0
+        for xt in x:
+            y = step(xt)
+            loss += F.sum(y * y)
+        loss.backward()
+        loss = F.sum(seq(x) ** 2)
+        loss.backward()
+        gW_h = np.concatenate([step.h2f.W.grad.data, step.h2i.W.grad.data,
+                               step.h2o.W.grad.data, step.h2u.W.grad.data],
+                              axis=1)
+        self.assertTrue(array_allclose(seq.W_h.grad.data, gW_h, atol=1e-5))
+
+    def test_dry_run(self):
+        model = L.SeqLSTM(8)
+        profile = dry_run(model, (7, 2, 3))
+        self.assertEqual(profile.outputs[0].shape, (7, 2, 8))
+        self.assertEqual(model.W_x.shape, (3, 32))
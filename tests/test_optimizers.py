@@ -0,0 +1,161 @@
+import copy
+import math
+import unittest
+import numpy as np
+import dezero
+import dezero.functions as F
+from dezero import optimizers
+from dezero.models import MLP
+from dezero.utils import array_allclose
+
+
+def _reference(name, data, grad, state, t):
+    # the textbook per-parameter updates
+    if name == 'SGD':
+        return data - 0.01 * grad
+    if name == 'MomentumSGD':
+        v = state.setdefault('v', np.zeros_like(data))
+        v[...] = 0.9 * v - 0.01 * grad
+        return data + v
+    if name == 'AdaGrad':
+        h = state.setdefault('h', np.zeros_like(data))
+        h += grad * grad
+        return data - 0.001 * grad / (np.sqrt(h) + 1e-8)
+    if name == 'AdaDelta':
+        msg = state.setdefault('msg', np.zeros_like(data))
+        msdx = state.setdefault('msdx', np.zeros_like(data))
+        msg[...] = 0.95 * msg + 0.05 * grad * grad
+        dx = np.sqrt((msdx + 1e-6) / (msg + 1e-6)) * grad
+        msdx[...] = 0.95 * msdx + 0.05 * dx * dx
+        return data - dx
+    if name == 'Adam':
+        m = state.setdefault('m', np.zeros_like(data))
+        v = state.setdefault('v', np.zeros_like(data))
+        m += 0.1 * (grad - m)
+        v += 0.001 * (grad * grad - v)
+        lr = 0.001 * math.sqrt(1 - 0.999 ** t) / (1 - 0.9 ** t)
+        return data - lr * m / (np.sqrt(v) + 1e-8)
+
+
+NAMES = ('SGD', 'MomentumSGD', 'AdaGrad', 'AdaDelta', 'Adam')
+
+
+class TestOptimizers(unittest.TestCase):
+
+    def setUp(self):
+        self.x = np.random.randn(8, 4)
+        self.t = np.random.randn(8, 2)
+
+    def _step(self, model, optimizer):
+        model.cleargrads()
+        loss = F.mean_squared_error(model(self.x), self.t)
+        loss.backward()
+        optimizer.update()
+
+    def test_update_one(self):
+        for name in NAMES:
+            p = dezero.Parameter(np.random.randn(3, 4))
+            layer = dezero.Layer()
+            layer.p = p
+            optimizer = getattr(optimizers, name)().setup(layer)
+            data, state = p.data.copy(), {}
+            for t in range(1, 4):
+                grad = np.random.randn(3, 4)
+                p.grad = dezero.Variable(grad)
+                optimizer.update()
+                data = _reference(name, data, grad, state, t)
+                self.assertTrue(array_allclose(p.data, data), name)
+
+    def test_flat(self):
+        for name in NAMES:
+            model = MLP((5, 3, 2))
+            model(self.x)
+            ref = copy.deepcopy(model)
+            model.to_flat()
+            opt = getattr(optimizers, name)().setup(model)
+            ref_opt = getattr(optimizers, name)().setup(ref)
+            for _ in range(3):
+                self._step(model, opt)
+                self._step(ref, ref_opt)
+            y, ref_y = model(self.x).data, ref(self.x).data
+            self.assertTrue(array_allclose(y, ref_y, atol=1e-6), name)
+
+    def test_reflatten(self):
+        # a new flat buffer may get the id of the freed one
+        for name in ('MomentumSGD', 'Adam'):
+            model = MLP((5, 3, 2))
+            model(self.x)
+            ref = copy.deepcopy(model)
+            opt = getattr(optimizers, name)().setup(model)
+            ref_opt = getattr(optimizers, name)().setup(ref)
+            for _ in range(20):
+                model.to_flat()
+                self._step(model, opt)
+                self._step(ref, ref_opt)
+            y, ref_y = model(self.x).data, ref(self.x).data
+            self.assertTrue(array_allclose(y, ref_y, atol=1e-6), name)
+            self.assertEqual(len(opt._flat_states), len(opt.state_names))
+
+    def test_flat_freeze(self):
+        model = MLP((5, 3, 2))
+        model(self.x)
+        model.to_flat()
+        W0 = model.l0.W.data.copy()
+        W1 = model.l1.W.data.copy()
+        optimizer = optimizers.MomentumSGD().setup(model)
+        optimizer.add_hook(optimizers.FreezeParam(model.l0))
+        for _ in range(2):
+            self._step(model, optimizer)
+        self.assertTrue(array_allclose(model.l0.W.data, W0))
+        self.assertFalse(array_allclose(model.l1.W.data, W1))
+
+    def test_flat_state_views(self):
+        model = MLP((5, 3, 2))
+        model(self.x)
+        model.to_flat()
+        optimizer = optimizers.Adam().setup(model)
+        self._step(model, optimizer)
+        base = optimizer.ms['l0/W'].base
+        self.assertEqual(base.size, sum(p.size for p in model.params()))
+        for key in ('l0/W', 'l0/b', 'l1/W', 'l1/b'):
+            self.assertIs(optimizer.ms[key].base, base)
+            self.assertEqual(optimizer.vs[key].base.ndim, 1)
+
+        # the flat state is built once and reused by later updates
+        self._step(model, optimizer)
+        self.assertIs(optimizer.ms['l0/W'].base, base)
+        self.assertEqual(len(optimizer._flat_states), 2)
+
+    def test_flat_no_grad(self):
+        # hooks must not touch parameters that got no gradient, like the
+        # running averages of BatchNorm or an unused layer
+        class Net(dezero.Model):
+            def __init__(self):
+                super().__init__()
+                self.l0 = dezero.layers.Linear(5)
+                self.bn = dezero.layers.BatchNorm()
+                self.l1 = dezero.layers.Linear(2)
+                self.unused = dezero.layers.Linear(3)
+
+            def forward(self, x):
+                return self.l1(F.relu(self.bn(self.l0(x))))
+
+        model = Net()
+        model(self.x)
+        model.unused(self.x)
+        ref = copy.deepcopy(model)
+        model.to_flat()
+        opt = optimizers.Adam().setup(model)
+        ref_opt = optimizers.Adam().setup(ref)
+        for o in (opt, ref_opt):
+            o.add_hook(optimizers.WeightDecay(0.1))
+        for _ in range(3):
+            self._step(model, opt)
+            self._step(ref, ref_opt)
+        self.assertIsNone(model.unused.W.grad)
+        params, ref_params = {}, {}
+        model._flatten_params(params)
+        ref._flatten_params(ref_params)
+        for key in ('bn/avg_mean', 'bn/avg_var', 'unused/W', 'l0/W'):
+            self.assertTrue(array_allclose(params[key].data,
+                                           ref_params[key].data), key)
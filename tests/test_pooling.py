@@ -1,5 +1,6 @@
 import unittest
 import numpy as np
+import dezero
 import dezero.functions as F
 from dezero.utils import gradient_check, array_allclose
 import chainer.functions as CF
@@ -60,6 +61,39 @@ class TestPooling(unittest.TestCase):
         f = lambda x: F.pooling(x, ksize, stride, pad)
         self.assertTrue(gradient_check(f, x))
 
+    def test_forward3(self):
+        n, c, h, w = 2, 5, 15, 15
+        ksize, stride, pad = 3, 2, 0
+        x = np.random.randn(n, c, h, w).astype('f')
+
+        y = F.pooling(x, ksize, stride, pad)
+        expected = CF.max_pooling_2d(x, ksize, stride, pad, cover_all=False)
+        self.assertTrue(array_allclose(expected.data, y.data))
+
+    def test_forward4(self):
+        n, c, h, w = 2, 5, 16, 16
+        ksize, stride, pad = 2, 2, 0
+        x = np.random.randn(n, c, h, w).astype('f')
+
+        with dezero.no_grad():
+            y = F.pooling(x, ksize, stride, pad)
+        expected = CF.max_pooling_2d(x, ksize, stride, pad)
+        self.assertTrue(array_allclose(expected.data, y.data))
+
+    def test_backward2(self):
+        n, c, h, w = 1, 5, 15, 15
+        ksize, stride, pad = 2, 2, 0
+        x = np.random.randn(n, c, h, w).astype('f') * 1000
+        f = lambda x: F.pooling(x, ksize, stride, pad)
+        self.assertTrue(gradient_check(f, x))
+
+    def test_backward3(self):
+        n, c, h, w = 1, 5, 7, 7
+        ksize, stride, pad = 3, 2, 1
+        x = np.random.randn(n, c, h, w).astype('f') * 1000
+        f = lambda x: F.pooling(x, ksize, stride, pad)
+        self.assertTrue(gradient_check(f, x))
+
 
 class TestAveragePooling(unittest.TestCase):
 
@@ -86,4 +120,19 @@ class TestAveragePooling(unittest.TestCase):
         ksize, stride, pad = 2, 2, 0
         x = np.random.randn(n, c, h, w).astype('f') * 1000
         f = lambda x: F.average_pooling(x, ksize, stride, pad)
+        self.assertTrue(gradient_check(f, x))
+
+    def test_forward3(self):
+        n, c, h, w = 2, 5, 7, 7
+        x = np.random.randn(n, c, h, w).astype('f')
+
+        y = F.average_pooling(x, (h, w), 1, 0)
+        expected = CF.average_pooling_2d(x, (h, w), 1, 0)
+        self.assertTrue(array_allclose(expected.data, y.data))
+
+    def test_backward2(self):
+        n, c, h, w = 1, 5, 15, 15
+        ksize, stride, pad = 2, 2, 0
+        x = np.random.randn(n, c, h, w).astype('f') * 1000
+        f = lambda x: F.average_pooling(x, ksize, stride, pad)
         self.assertTrue(gradient_check(f, x))
\ No newline at end of file
@@ -0,0 +1,105 @@
+import unittest
+import numpy as np
+import dezero
+import dezero.functions as F
+import dezero.layers as L
+from dezero.core import MetaArray
+from dezero.models import MLP, VGG16, ResNet50, Sequential
+from dezero.profiler import Profile, dry_run
+
+
+def _shapes(model):
+    params = {}
+    model._flatten_params(params)
+    return {key: (p.shape, p.dtype) for key, p in params.items()}
+
+
+class TestDryRun(unittest.TestCase):
+
+    def _check(self, make, shape):
+        model, ref = make(), make()
+        profile = dry_run(model, shape)
+        with dezero.no_grad(), dezero.test_mode():
+            y = ref(np.random.randn(*shape).astype('f'))
+        self.assertEqual(_shapes(model), _shapes(ref))
+        self.assertEqual(profile.outputs[0].shape, y.shape)
+        self.assertEqual(profile.outputs[0].dtype, y.dtype)
+        return profile
+
+    def test_mlp(self):
+        profile = self._check(lambda: MLP((30, 20, 10)), (8, 40))
+        flops = {'l0': 8 * 30 * (2 * 40 + 1), 'l1': 8 * 20 * (2 * 30 + 1),
+                 'l2': 8 * 10 * (2 * 20 + 1), '': 8 * 30 + 8 * 20}
+        self.assertEqual({k: r['flops'] for k, r in profile.layers.items()},
+                         flops)
+        self.assertEqual(profile.layers['l1']['activation_bytes'],
+                         8 * 20 * 4)
+        self.assertEqual(profile.params('l1'), 30 * 20 + 20)
+
+    def test_conv(self):
+        make = lambda: Sequential(
+            L.Conv2d(8, kernel_size=3, pad=2, dilate=2), L.BatchNorm(),
+            F.relu, lambda x: F.pooling(x, 2, 2),
+            L.Deconv2d(4, kernel_size=4, stride=2, pad=1),
+            lambda x: F.average_pooling(x, 3, 1, 1), F.flatten, L.Linear(5))
+        profile = self._check(make, (2, 3, 9, 9))
+        self.assertEqual(profile.layers['l0']['flops'],
+                         2 * 8 * 9 * 9 * (2 * 3 * 3 * 3 + 1))
+
+    def test_vgg16(self):
+        profile = self._check(VGG16, (1, 3, 64, 64))
+        self.assertGreater(profile.flops, 0)
+
+    def test_resnet50(self):
+        profile = self._check(lambda: ResNet50(), (1, 3, 64, 64))
+        self.assertTrue(all(r['flops'] > 0 for r in profile.layers.values()))
+
+    def test_no_data(self):
+        model = MLP((30, 10))
+        dry_run(model, (1000000, 20))
+        self.assertFalse(dezero.Config.meta)
+        self.assertEqual(dezero.Config.function_hooks, ())
+
+        x = dezero.Variable(MetaArray((4, 3)))
+        with dezero.using_config('meta', True):
+            y = F.sum(F.exp(x) * 2, axis=1, keepdims=True)
+        self.assertIsInstance(y.data, MetaArray)
+        self.assertEqual(y.shape, (4, 1))
+
+
+class TestProfile(unittest.TestCase):
+
+    def test_traffic(self):
+        model = MLP((30, 10))
+        x = np.random.randn(8, 40).astype('f')
+        with Profile(model) as profile:
+            y = model(x)
+        l0 = profile.layers['l0']
+        self.assertEqual(l0['flops'], 8 * 30 * (2 * 40 + 1))
+        self.assertEqual(l0['bytes_read'], (8 * 40 + 40 * 30 + 30) * 4)
+        self.assertEqual(l0['bytes_written'], 8 * 30 * 4)
+        self.assertEqual(profile.functions['Linear']['calls'], 2)
+        self.assertEqual(profile.functions['Sigmoid']['flops'], 8 * 30)
+        self.assertEqual(dezero.Config.function_hooks, ())
+
+        meta = dry_run(model, x.shape)
+        self.assertEqual(meta.layers, profile.layers)
+
+    def test_views(self):
+        model = Sequential(lambda x: F.reshape(x, (4, -1)), F.transpose)
+        profile = dry_run(model, (4, 3, 2))
+        self.assertEqual(profile.functions['Reshape']['bytes_read'], 0)
+        self.assertEqual(profile.bytes_moved, 0)
+
+    def test_roofline(self):
+        model = MLP((300, 10))
+        profile = dry_run(model, (256, 400))
+        lines = profile.roofline(peak_flops=1e12, bandwidth=1e11).split('\n')
+        rows = {line.split()[0]: line.split()[-1] for line in lines[2:-1]}
+        # machine balance 10 FLOP/B: l0 does ~50 FLOP/B, the sigmoid 0.125
+        # and l1 (ten outputs per input row) ~4.7
+        self.assertEqual(rows, {'l0': 'compute', '(MLP)': 'memory',
+                                'l1': 'memory'})
+        lines = profile.roofline(1e12, 1e11, by='function').split('\n')
+        self.assertEqual([line.split()[0] for line in lines[2:-1]],
+                         ['Linear', 'Sigmoid'])
@@ -3,7 +3,7 @@ import numpy as np
 import chainer
 import dezero
 from dezero.utils import array_allclose
-from dezero.models import VGG16
+from dezero.models import VGG16, BottleneckA, fold_batchnorm
 
 
 class TestResnet152(unittest.TestCase):
@@ -79,4 +79,34 @@ class TestResnet152(unittest.TestCase):
                 m1 = getattr(model, l)
                 m2 = getattr(_model, l)
                 self.assertTrue(array_allclose(m1.W.data, m2.W.data.T))
-                self.assertTrue(array_allclose(m1.b.data, m2.b.data))
\ No newline at end of file
+                self.assertTrue(array_allclose(m1.b.data, m2.b.data))
+
+
+class TestFoldBatchNorm(unittest.TestCase):
+
+    def test_forward1(self):
+        x = np.random.randn(2, 8, 9, 9).astype('f')
+        model = BottleneckA(8, 4, 16, stride=2)
+        model(x)  # initialize parameters
+        for bn in (model.bn1, model.bn2, model.bn3, model.bn4):
+            D = bn.gamma.shape[0]
+            bn.gamma.data = np.random.rand(D).astype('f') + 0.5
+            bn.beta.data = np.random.randn(D).astype('f')
+            bn.avg_mean.data = np.random.randn(D).astype('f')
+            bn.avg_var.data = np.random.rand(D).astype('f') + 0.5
+
+        with dezero.test_mode():
+            expected = model(x)
+            fold_batchnorm(model)
+            y = model(x)
+        self.assertTrue(model.conv1.fused)
+        self.assertTrue(array_allclose(y.data, expected.data))
+
+    def test_forward2(self):
+        x = np.random.randn(1, 3, 32, 32).astype('f')
+        model = VGG16()
+        with dezero.test_mode():
+            expected = model(x)
+            fold_batchnorm(model)
+            y = model(x)
+        self.assertTrue(array_allclose(y.data, expected.data))
@@ -0,0 +1,66 @@
+import copy
+import gc
+import unittest
+import weakref
+import dezero
+import dezero.functions as F
+import dezero.layers as L
+from dezero import Model, SeqDataLoader
+from dezero.trainers import TruncatedBPTT
+from dezero.utils import array_allclose
+
+
+class SimpleRNN(Model):
+    def __init__(self, hidden_size, out_size):
+        super().__init__()
+        self.rnn = L.LSTM(hidden_size, in_size=1)
+        self.fc = L.Linear(out_size, in_size=hidden_size)
+
+    def forward(self, x):
+        return self.fc(self.rnn(x))
+
+
+class TestTruncatedBPTT(unittest.TestCase):
+
+    def setUp(self):
+        train_set = dezero.datasets.SinCurve(train=True)
+        self.loader = SeqDataLoader(train_set, batch_size=10)
+
+    def test_same_as_unchain_backward(self):
+        model = SimpleRNN(8, 1)
+        ref = copy.deepcopy(model)
+        trainer = TruncatedBPTT(model, dezero.optimizers.SGD().setup(model),
+                                bptt_length=7)
+        trainer.run(self.loader)
+
+        optimizer = dezero.optimizers.SGD().setup(ref)
+        ref.reset_state()
+        loss, count = 0, 0
+        for x, t in self.loader:
+            loss += F.mean_squared_error(ref(x), t)
+            count += 1
+            if count % 7 == 0 or count == self.loader.max_iter:
+                ref.cleargrads()
+                loss.backward()
+                loss.unchain_backward()
+                optimizer.update()
+        self.assertTrue(array_allclose(model.fc.W.data, ref.fc.W.data))
+        self.assertTrue(array_allclose(model.rnn.h.data, ref.rnn.h.data))
+
+    def test_graph_cut(self):
+        model = SimpleRNN(8, 1)
+        trainer = TruncatedBPTT(model, dezero.optimizers.SGD().setup(model),
+                                bptt_length=3)
+        x, t = next(self.loader)
+        gc.disable()
+        self.addCleanup(gc.enable)
+        trainer.step(x, t)
+        first = weakref.ref(model.rnn.h.creator)
+        trainer.step(x, t)
+        self.assertIsNotNone(trainer.step(x, t))
+
+        self.assertIsNone(model.rnn.h.creator)
+        self.assertIsNone(model.rnn.c.creator)
+        self.assertIsNone(first())  # freed without the cycle collector
+        self.assertEqual(trainer.history[0][0], 3 * len(t))
+        self.assertGreater(trainer.tokens_per_sec, 0)
@@ -0,0 +1,49 @@
+import unittest
+import numpy as np
+import dezero.transforms as T
+
+
+def _per_example(transform, x):
+    return np.array([transform(example) for example in x])
+
+
+class TestBatchTransforms(unittest.TestCase):
+
+    def setUp(self):
+        self.x = np.random.randint(0, 256, (6, 3, 4, 5)).astype(np.uint8)
+
+    def test_same_as_per_example(self):
+        for transform in (
+                T.Compose([T.Flatten(), T.ToFloat(), T.Normalize(0., 255.)]),
+                T.Compose([T.ToFloat(), T.Normalize(0.5, 0.5)]),
+                T.Compose([T.AsType(np.float64),
+                           T.Normalize([1., 2., 3.], [.5, .2, .1])]),
+                T.Compose([T.Normalize(2., 3.), T.AsType(np.float32)]),
+                T.Compose([T.ToInt(np.int16), T.Normalize(1., 2.)]),
+                T.Compose([])):
+            expected = _per_example(transform, self.x)
+            for inplace in (False, True):
+                y = transform.batch(self.x.copy(), inplace=inplace)
+                self.assertEqual(y.dtype, expected.dtype)
+                self.assertTrue(np.array_equal(y, expected))
+
+    def test_inplace(self):
+        x = self.x.astype(np.float32)
+        transform = T.Compose([T.Flatten(), T.Normalize(1., 2.)])
+        y = transform.batch(x)
+        self.assertTrue(np.array_equal(x, self.x))
+
+        y = transform.batch(x, inplace=True)
+        self.assertTrue(np.shares_memory(x, y))
+        self.assertTrue(np.array_equal(y.reshape(x.shape), x))
+
+    def test_fused(self):
+        transform = T.Compose([T.ToFloat(), T.Normalize(0.5, 0.5)])
+        x = self.x.copy()
+        y = transform.batch(x, inplace=True)
+        self.assertEqual(y.dtype, np.float32)
+        self.assertTrue(np.array_equal(x, self.x))  # uint8 input is kept
+
+    def test_not_batchable(self):
+        transform = T.Compose([T.ToFloat(), lambda x: x * 2])
+        self.assertIsNone(transform.batch)